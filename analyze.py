@@ -1,10 +1,34 @@
+from src.utils import bounded_map, chunked, get_data_path, get_ollama_endpoints, iter_chats
+from src.pool import ClientPool
+from src.journal import DatasetJournal, open_dataset_writer, dump_dataset
+from src.index import ChatIndex
+from src.frames import is_frames_path
+from src.cache import ResponseCache
+from src.telemetry import Telemetry
+from src.schemas import ANALYSIS_SCHEMA, BATCH_ANALYSIS_SCHEMA, CONFIDENT_ANALYSIS_SCHEMA, parse
+from src.streaming import StreamingClient
+from src.concurrency import AdaptiveLimit, current_workers
+from evaluate_results import (encode, evaluate, TASKS, CONFIDENCE, StratifiedEvaluation, population_strata,
+                              print_stratified_report)
+from collections import Counter
 import json
 import argparse
-import ollama
+import random
+import math
+import hashlib
 from tqdm import tqdm
+import time
 import re
+import os
 
 MODEL = "qwen3:8b"
+CLIENT = ClientPool(get_ollama_endpoints())
+# Ollama "think" setting for the analysis model (None keeps the model default)
+THINK = None
+# Single-valued analysis labels compared by --rescore (agent_mistakes is compared as a set)
+RESCORED_FIELDS = ("request_intent", "customer_satisfaction", "quality_score")
+# Analyzed datasets are written with this JSON indent
+OUTPUT_INDENT = 2
 
 ANALYSIS_PROMPT_TEMPLATE = """
 You are an expert QA auditor evaluating customer support chats.
@@ -34,6 +58,70 @@ OUTPUT JSON:
 }}
 """
 
+FAST_ANALYSIS_PROMPT_TEMPLATE = """
+You are an expert QA auditor evaluating customer support chats.
+Return ONLY a valid JSON object.
+
+DO NOT guess policies.
+DO NOT invent mistakes.
+ONLY describe what is directly observable.
+
+CATEGORIES:
+- request_intent: "payment problems", "technical errors", "account access", "questions about the tariff", "refund", "other"
+- customer_satisfaction: "satisfied", "neutral", "unsatisfied"
+- agent_mistakes: ONLY from:
+  - no_resolution
+  - rude_tone
+  - ignored_question
+- confidence: "high", "medium", "low" - how sure you are about ALL labels above.
+  Use "low" when the outcome of the dialogue is ambiguous.
+
+DIALOGUE:
+{dialogue_text}
+
+OUTPUT JSON:
+{{
+  "reasoning": "1 sentence max",
+  "request_intent": "string",
+  "customer_satisfaction": "string",
+  "agent_mistakes": ["string"],
+  "confidence": "string"
+}}
+"""
+
+BATCH_ANALYSIS_PROMPT_TEMPLATE = """
+You are an expert QA auditor evaluating customer support chats.
+You will get several independent dialogues. Evaluate EACH of them separately.
+Return ONLY a valid JSON object whose "results" list has exactly one object per dialogue.
+
+DO NOT guess policies.
+DO NOT invent mistakes.
+ONLY describe what is directly observable.
+
+CATEGORIES:
+- request_intent: "payment problems", "technical errors", "account access", "questions about the tariff", "refund", "other"
+- customer_satisfaction: "satisfied", "neutral", "unsatisfied"
+- agent_mistakes: ONLY from:
+  - no_resolution
+  - rude_tone
+  - ignored_question
+
+{dialogues_text}
+
+OUTPUT JSON:
+{{
+  "results": [
+    {{
+      "id": "dialogue ID",
+      "reasoning": "1 sentence max",
+      "request_intent": "string",
+      "customer_satisfaction": "string",
+      "agent_mistakes": ["string"]
+    }}
+  ]
+}}
+"""
+
 INTENT_MAP = {
     "refund": "refund",
     "tariff_refund": "refund",
@@ -65,33 +153,132 @@ CONFIDENCE_WEAK_PHRASES = [
     "we'll see"
 ]
 
+# Fast-model confidence levels that send a chat to the large model
+ESCALATE_CONFIDENCE = {"low"}
+
+def check_connection():
+    """Health-checks every Ollama host; unreachable ones are ejected from the pool."""
+    try:
+        CLIENT.list()
+        print(f"[+] Connected to Ollama at {CLIENT.endpoint}")
+    except Exception:
+        print(f"[!] Critical Error: Cannot connect to Ollama at {CLIENT.endpoint}")
+        exit(1)
+
 def format_chat(chat):
     return "\n".join(
         f"[{m.get('role','').upper()}]: {m.get('text','')}"
         for m in chat
     )
 
-def analyze_dialogue(chat):
+def item_labels(item):
+    meta = item.get("metadata", {})
+    return {"intent": meta.get("intent"), "case_type": meta.get("case_type")}
+
+def call_model(prompt, schema, cache=None, telemetry=None, labels=None, model=MODEL):
+    """
+    Requests output constrained to a JSON schema and returns it parsed and validated.
+    Raises ValueError when the response still does not match; the call is then counted as wasted.
+    """
+    request = dict(
+        model=model,
+        prompt=prompt,
+        format=schema,
+        options={"temperature": 0.0, "seed": 42}
+    )
+    if THINK is not None:
+        request["think"] = THINK
+    response = cache.generate(CLIENT, **request) if cache else CLIENT.generate(**request)
+
+    text = re.sub(r"<think>.*?</think>", "", response["response"], flags=re.S).strip()
+    try:
+        result = parse(text, schema)
+    except ValueError:
+        if telemetry:
+            telemetry.record(response, failed=True, stage="analyze", model=model, **(labels or {}))
+        raise
+
+    if telemetry:
+        telemetry.record(response, stage="analyze", model=model, **(labels or {}))
+    return result
+
+def analyze_dialogue(chat, cache=None, telemetry=None, labels=None, model=MODEL):
     prompt = ANALYSIS_PROMPT_TEMPLATE.format(
         dialogue_text=format_chat(chat)
     )
 
+    # Only unparseable answers become an empty result; connection and server errors reach
+    # the caller, so the chat is reported as failed and the AdaptiveLimit sees the error
     try:
-        response = ollama.generate(
-            model=MODEL,
-            prompt=prompt,
-            options={"temperature": 0.0, "seed": 42}
-        )
+        return call_model(prompt, ANALYSIS_SCHEMA, cache, telemetry, labels, model)
+    except ValueError:
+        return {}
 
-        text = re.sub(r"<think>.*?</think>", "", response["response"], flags=re.S)
-        text = text.replace("```json", "").replace("```", "").strip()
+def analyze_dialogue_fast(chat, model, cache=None, telemetry=None, labels=None):
+    """Like analyze_dialogue, but the model also reports its confidence."""
+    prompt = FAST_ANALYSIS_PROMPT_TEMPLATE.format(
+        dialogue_text=format_chat(chat)
+    )
 
-        match = re.search(r"\{.*\}", text, re.S)
-        return json.loads(match.group()) if match else {}
+    try:
+        return call_model(prompt, CONFIDENT_ANALYSIS_SCHEMA, cache, telemetry, labels, model)
+    except ValueError:
+        return {}
 
-    except Exception:
+def analyze_batch(items, cache=None, telemetry=None):
+    """
+    Analyzes several chats with one prompt.
+    Returns {id: raw result} for every chat the model answered properly.
+    """
+    prompt = BATCH_ANALYSIS_PROMPT_TEMPLATE.format(
+        dialogues_text="\n\n".join(
+            f"DIALOGUE ID {item['id']}:\n{format_chat(item.get('chat', []))}"
+            for item in items
+        )
+    )
+
+    labels = {"batch_size": len(items)}
+    for key in ("intent", "case_type"):
+        values = {item_labels(item)[key] for item in items}
+        labels[key] = values.pop() if len(values) == 1 else "mixed"
+
+    try:
+        parsed = call_model(prompt, BATCH_ANALYSIS_SCHEMA, cache, telemetry, labels)
+    except ValueError:
         return {}
 
+    expected = {str(item["id"]) for item in items}
+    results = {}
+    for r in parsed["results"]:
+        _id = str(r.pop("id")).strip()
+        if _id in expected:
+            results[_id] = r
+    return results
+
+def analyze_batch_split(items, cache=None, telemetry=None):
+    """
+    Analyzes a batch, splitting it in half whenever the answer is malformed or
+    incomplete, down to single-chat calls.
+    Returns ({id: raw result}, number of LLM calls).
+    """
+    if len(items) == 1:
+        item = items[0]
+        return {str(item["id"]): analyze_dialogue(item.get("chat", []), cache, telemetry, item_labels(item))}, 1
+
+    results = analyze_batch(items, cache, telemetry)
+    calls = 1
+
+    missing = [item for item in items if str(item["id"]) not in results]
+    if missing:
+        half = (len(missing) + 1) // 2
+        for part in (missing[:half], missing[half:]):
+            if part:
+                part_results, part_calls = analyze_batch_split(part, cache, telemetry)
+                results.update(part_results)
+                calls += part_calls
+
+    return results, calls
+
 def normalize_labels(r):
     r["request_intent"] = INTENT_MAP.get(
         r.get("request_intent", "").lower().strip(), "other"
@@ -102,16 +289,18 @@ def normalize_labels(r):
     r["agent_mistakes"] = list(set(r.get("agent_mistakes", [])))
     return r
 
-def infer_no_resolution(chat, result):
+def rule_unresolved(chat):
+    """Rule signal: the agent's last message sounds unsure or hands the case over."""
     last_agent = next(
-        (m["text"].lower() for m in reversed(chat) if m["role"] == "agent"),
+        (m.get("text", "").lower() for m in reversed(chat) if m.get("role") == "agent"),
         ""
     )
+    return any(p in last_agent for p in CONFIDENCE_WEAK_PHRASES) or "escalate" in last_agent
 
+def infer_no_resolution(chat, result):
     unresolved = (
         result["customer_satisfaction"] != "satisfied"
-        or any(p in last_agent for p in CONFIDENCE_WEAK_PHRASES)
-        or "escalate" in last_agent
+        or rule_unresolved(chat)
     )
 
     if unresolved and "no_resolution" not in result["agent_mistakes"]:
@@ -148,32 +337,437 @@ def final_validation(result):
     result["quality_score"] = max(1, min(5, result["quality_score"]))
     return result
 
-def run_analysis(input_file, output_file):
-    with open(input_file, "r", encoding="utf-8") as f:
-        data = json.load(f)
-
-    for item in tqdm(data):
-        chat = item.get("chat", [])
-        r = analyze_dialogue(chat)
-
-        r = normalize_labels(r)
-        infer_no_resolution(chat, r)
-        clamp_satisfaction(r)
-
-        r["quality_score"] = recompute_quality_score(r)
-        r = final_validation(r)
-
-        item["analysis"] = r
+def postprocess(chat, raw):
+    """Applies the rules to a raw model answer, which is kept under "raw" for --rescore."""
+    r = normalize_labels(dict(raw))
+    infer_no_resolution(chat, r)
+    clamp_satisfaction(r)
 
-    with open(output_file, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
+    r["quality_score"] = recompute_quality_score(r)
+    r = final_validation(r)
+    r["raw"] = raw
+    return r
 
+def analyze_item(item, cache=None, telemetry=None):
+    chat = item.get("chat", [])
+    return postprocess(chat, analyze_dialogue(chat, cache, telemetry, item_labels(item)))
+
+def escalation_reason(chat, raw):
+    """Returns why a fast-model answer has to be redone by the large model, or None to keep it."""
+    if not raw:
+        return "invalid"
+    if raw.get("confidence") in ESCALATE_CONFIDENCE:
+        return "low_confidence"
+    if (rule_unresolved(chat) and raw.get("customer_satisfaction") == "satisfied"
+            and "no_resolution" not in raw.get("agent_mistakes", [])):
+        return "contradicts_rules"
+    return None
+
+def analyze_item_cascade(item, cascade, cache=None, telemetry=None):
+    """
+    Labels a chat with the fast model and escalates it to the large model when the answer
+    is invalid, unsure or contradicts the rule signals. Returns (analysis, number of LLM calls).
+    """
+    fast_model, model = cascade
+    chat = item.get("chat", [])
+    labels = item_labels(item)
+
+    raw = analyze_dialogue_fast(chat, fast_model, cache, telemetry, labels)
+    reason = escalation_reason(chat, raw)
+    if reason:
+        raw = analyze_dialogue(chat, cache, telemetry, labels, model)
+
+    result = postprocess(chat, raw)
+    result["cascade"] = {"model": model if reason else fast_model, "escalation": reason}
+    return result, 2 if reason else 1
+
+def analyze_items(items, cache=None, telemetry=None, cascade=None):
+    """
+    Analyzes a group of chats in one batched prompt, or one by one through the
+    (fast model, large model) cascade.
+    Returns (list of analyses aligned with items, number of LLM calls).
+    """
+    # Items that already carry an analysis (e.g. a previous output used as input) are kept as is
+    todo = [item for item in items if "analysis" not in item]
+    if cascade:
+        raw, calls = {}, 0
+        for item in todo:
+            raw[str(item["id"])], item_calls = analyze_item_cascade(item, cascade, cache, telemetry)
+            calls += item_calls
+    else:
+        raw, calls = analyze_batch_split(todo, cache, telemetry) if todo else ({}, 0)
+
+    analyses = []
+    for item in items:
+        if "analysis" in item:
+            analyses.append(item["analysis"])
+        elif cascade:
+            analyses.append(raw[str(item["id"])])
+        else:
+            chat = item.get("chat", [])
+            analyses.append(postprocess(chat, raw[str(item["id"])]))
+    return analyses, calls
+
+def run_key(input_file, cascade=None):
+    """Identifies what a run's results depend on: the input file, the models and the prompts."""
+    key = json.dumps([
+        os.path.abspath(input_file), MODEL, cascade, THINK,
+        ANALYSIS_PROMPT_TEMPLATE, FAST_ANALYSIS_PROMPT_TEMPLATE, BATCH_ANALYSIS_PROMPT_TEMPLATE
+    ])
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+def run_analysis(input_file, output_file, workers=1, cache=None, batch_size=1, telemetry=None, cascade=None,
+                 fresh=False):
+    telemetry = telemetry or Telemetry(os.path.splitext(output_file)[0] + ".metrics.jsonl")
+    if cascade and batch_size > 1:
+        print("[!] The cascade analyzes chats one by one, ignoring --batch-size")
+        batch_size = 1
+
+    # Results are journaled as they finish, so a restart only redoes missing IDs.
+    # The journal is removed once a run completes without errors.
+    journal = DatasetJournal(os.path.splitext(output_file)[0] + ".jsonl")
+    key = run_key(input_file, cascade)
+    if fresh:
+        journal.remove()
+    elif journal.exists() and (journal.read_meta() or {}).get("run_key") != key:
+        print(f"[!] {journal.path} holds an unfinished run with another input, model or prompt.")
+        print("[!] Rerun with --fresh to discard it.")
+        return
+    journal.write_meta({"run_key": key})
+    # Drops a line torn by a crash, so it is neither parsed nor appended to
+    journal.resume()
+
+    done_ids = {item["id"] for item in journal if "analysis" in item}
+    if done_ids:
+        print(f"[*] Resuming: {len(done_ids)} chats already analyzed")
+
+    pending = (item for item in iter_chats(input_file) if item.get("id") not in done_ids)
+
+    analyzed = 0
+    calls = 0
+    failed = []
+    escalations = Counter()
+    start = time.perf_counter()
+
+    results = bounded_map(
+        lambda batch: analyze_items(batch, cache, telemetry, cascade),
+        chunked(pending, max(1, batch_size)),
+        workers=workers
+    )
+    with tqdm(unit="chat") as progress:
+        for batch, result, error in results:
+            progress.update(len(batch))
+            progress.set_postfix({**telemetry.postfix(), "conc": current_workers(workers)})
+            if error is not None:
+                print(f"[!] Error at IDs {[item.get('id') for item in batch]}: {error}")
+                # Exported without an analysis and not journaled, so a rerun retries them
+                failed.extend(batch)
+                continue
+
+            analyses, batch_calls = result
+            calls += batch_calls
+            for item, r in zip(batch, analyses):
+                item["analysis"] = r
+                journal.append(item)
+                analyzed += 1
+                if "cascade" in r:
+                    escalations[r["cascade"]["escalation"]] += 1
+
+    journal.close()
+    journal.export(output_file, extra=failed, indent=OUTPUT_INDENT)
+    if failed:
+        print(f"[!] {len(failed)} chats failed and were exported without analysis; "
+              f"rerun the same command to retry only them")
+    else:
+        journal.remove()
+
+    elapsed = time.perf_counter() - start
+    if analyzed:
+        print(f"[*] {analyzed} chats in {elapsed:.1f}s ({analyzed / elapsed:.2f} chats/sec, "
+              f"{calls} LLM calls, batch size {batch_size})")
+    if escalations:
+        total = sum(escalations.values())
+        escalated = total - escalations[None]
+        reasons = {reason: n for reason, n in escalations.items() if reason}
+        print(f"[*] Cascade {cascade[0]} -> {cascade[1]}: {escalated}/{total} chats escalated "
+              f"({escalated / total:.1%}) {reasons}")
+    if cache:
+        print(f"[*] Cache: {cache.stats()}")
+    telemetry.print_summary()
+    telemetry.close()
+    CLIENT.print_stats()
+    if isinstance(workers, AdaptiveLimit):
+        workers.print_summary()
     print("✔ Analysis complete")
 
+def rescore(input_file, output_file):
+    """
+    Reapplies postprocess() to the raw model answers stored with each analysis,
+    without any LLM calls, and prints how many labels changed.
+    """
+    changes = Counter()
+    transitions = {field: Counter() for field in RESCORED_FIELDS}
+    mistakes = Counter()
+    rescored = skipped = 0
+    start = time.perf_counter()
+
+    # Written next to the output first, so input and output may be the same file
+    tmp_path = output_file + ".tmp"
+    writer = open_dataset_writer(tmp_path, frames=is_frames_path(output_file), indent=OUTPUT_INDENT)
+    for item in iter_chats(input_file):
+        old = item.get("analysis")
+        if not old or "raw" not in old:
+            # Analyzed before raw answers were kept: only a new LLM run can rescore it
+            skipped += 1
+            writer.write(item)
+            continue
+
+        new = postprocess(item.get("chat", []), old["raw"])
+        if "cascade" in old:
+            new["cascade"] = old["cascade"]
+        item["analysis"] = new
+        writer.write(item)
+        rescored += 1
+
+        changed = False
+        for field in RESCORED_FIELDS:
+            if old.get(field) != new.get(field):
+                changes[field] += 1
+                transitions[field][(old.get(field), new.get(field))] += 1
+                changed = True
+        # Mistake lists come from a set, so only their contents count
+        before, after = set(old.get("agent_mistakes", [])), set(new["agent_mistakes"])
+        if before != after:
+            changes["agent_mistakes"] += 1
+            mistakes.update(f"+{m}" for m in after - before)
+            mistakes.update(f"-{m}" for m in before - after)
+            changed = True
+        changes["any"] += changed
+    writer.close()
+    os.replace(tmp_path, output_file)
+
+    print(f"[*] Rescored {rescored} chats in {time.perf_counter() - start:.1f}s, saved to {output_file}")
+    if skipped:
+        print(f"[!] {skipped} chats have no stored raw answer and were left unchanged")
+    print(f"[*] Chats with changed labels: {changes['any']}/{rescored}")
+    for field in RESCORED_FIELDS:
+        top = ", ".join(f"{a} -> {b}: {n}" for (a, b), n in transitions[field].most_common(5))
+        print(f"    {field:<22} {changes[field]:>6} changed" + (f" ({top})" if top else ""))
+    top = ", ".join(f"{m}: {n}" for m, n in mistakes.most_common())
+    print(f"    {'agent_mistakes':<22} {changes['agent_mistakes']:>6} changed" + (f" ({top})" if top else ""))
+    return changes
+
+def run_audit(input_file, output_file, target_width=0.1, initial=50, step=100, max_samples=1000, workers=1,
+              cache=None, cascade=None, confidence=CONFIDENCE, seed=0):
+    """
+    Sampled audit: analyzes a stratified (intent x case_type) sample instead of the whole dataset and
+    keeps adding chats where accuracy is most uncertain until the widest task's confidence interval
+    is narrower than target_width, or max_samples chats were analyzed.
+    """
+    strata = population_strata(input_file)
+    evaluation = StratifiedEvaluation({h: len(rows) for h, rows in strata.items()})
+    # A fixed shuffle per stratum: reruns draw the same chats and hit the response cache
+    rng = random.Random(seed)
+    for rows in strata.values():
+        rng.shuffle(rows)
+
+    index = ChatIndex(input_file)
+    telemetry = Telemetry(os.path.splitext(output_file)[0] + ".metrics.jsonl")
+    taken = Counter()
+    audited = []
+    # Two chats per stratum are the least that gives it a variance estimate
+    plan = evaluation.allocate(min(max(initial, 2 * len(strata)), max_samples), taken, floor=2)
+    report = None
+    round_ = 0
+
+    while plan:
+        round_ += 1
+        rows = []
+        for h, n in plan.items():
+            rows += strata[h][taken[h]:taken[h] + n]
+            taken[h] += n
+        rows.sort(key=lambda row: row[1])
+
+        for item, result, error in tqdm(bounded_map(
+            lambda item: analyze_items([item], cache, telemetry, cascade), index.fetch(rows), workers=workers
+        ), total=len(rows), desc=f"Audit round {round_}", unit="chat"):
+            if error is not None:
+                print(f"[!] Error at ID {item.get('id')}: {error}")
+                continue
+            item["analysis"] = result[0][0]
+            evaluation.add(item)
+            audited.append(item)
+
+        report = evaluation.report(confidence)
+        sampled = sum(taken.values())
+        print(f"[*] Round {round_}: {report['n']} chats analyzed ({report['n'] / evaluation.total:.1%} of dataset), "
+              f"widest {confidence:.0%} CI: {report['widest_task']} {report['width']:.3f} (target {target_width})")
+
+        if report["width"] <= target_width:
+            print(f"[+] Target width reached with {report['n']} chats")
+            break
+        if sampled >= min(max_samples, evaluation.total):
+            print(f"[!] Stopped at {sampled} chats (--max-samples or whole dataset) before reaching the target width")
+            break
+
+        # The width shrinks about with 1/sqrt(n): ask for the estimated shortfall, at most `step` at a time
+        needed = math.ceil(report["n"] * ((report["width"] / target_width) ** 2 - 1))
+        k = min(step, max_samples - sampled, max(needed, len(strata)))
+        plan = evaluation.allocate(k, taken, task=report["widest_task"])
+
+    dump_dataset(audited, output_file, indent=OUTPUT_INDENT)
+    print(f"[+] Audited chats saved to {output_file} "
+          f"(evaluate with: python evaluate_results.py --input {output_file} --population {input_file})")
+    print_stratified_report(report)
+    telemetry.print_summary()
+    telemetry.close()
+    return report
+
+def compare_batch_modes(input_file, batch_size, sample=20, workers=1):
+    """Measures chats/sec of batched vs single-item analysis on the same sample (cache bypassed)."""
+    items = []
+    for item in iter_chats(input_file):
+        item.pop("analysis", None)
+        items.append(item)
+        if len(items) == sample:
+            break
+
+    report = {}
+    for mode, size in (("single", 1), ("batched", batch_size)):
+        start = time.perf_counter()
+        calls = sum(
+            result[1] for _, result, error in bounded_map(
+                lambda batch: analyze_items(batch), chunked(items, size), workers=workers
+            ) if error is None
+        )
+        elapsed = time.perf_counter() - start
+        report[mode] = {"chats_per_sec": len(items) / elapsed, "llm_calls": calls, "seconds": elapsed}
+        print(f"[*] {mode:<8} (batch size {size}): {report[mode]['chats_per_sec']:.2f} chats/sec, {calls} LLM calls")
+
+    print(f"[+] Batched speedup: {report['batched']['chats_per_sec'] / report['single']['chats_per_sec']:.2f}x")
+    return report
+
+def compare_cascade(input_file, cascade, sample=50, workers=1, resamples=1000):
+    """
+    Analyzes the same sample with the large model only and with the cascade (cache bypassed)
+    and compares accuracy against the generation metadata using evaluate_results.py's metrics.
+    """
+    items = []
+    for item in iter_chats(input_file):
+        item.pop("analysis", None)
+        items.append(item)
+        if len(items) == sample:
+            break
+
+    report = {}
+    for mode, mode_cascade in (("large_only", None), ("cascade", cascade)):
+        telemetry = Telemetry()
+        analyzed = []
+        calls = 0
+        start = time.perf_counter()
+        for batch, result, error in bounded_map(
+            lambda batch: analyze_items(batch, telemetry=telemetry, cascade=mode_cascade),
+            chunked((dict(item) for item in items), 1),
+            workers=workers
+        ):
+            if error is None:
+                batch[0]["analysis"] = result[0][0]
+                analyzed.append(batch[0])
+                calls += result[1]
+        elapsed = time.perf_counter() - start
+
+        gt, pr, slices, _ = encode(analyzed)
+        metrics = evaluate(gt, pr, slices, resamples)["tasks"]
+        escalated = sum(1 for item in analyzed if item["analysis"].get("cascade", {}).get("escalation"))
+        report[mode] = {
+            "chats_per_sec": len(analyzed) / elapsed,
+            "llm_calls": calls,
+            "escalation_rate": escalated / len(analyzed) if mode_cascade and analyzed else None,
+            "server_seconds": {m: r["server_seconds"] for m, r in telemetry.summary().items()},
+            "accuracy": {task: metrics[task]["overall"] for task in TASKS},
+        }
+
+    print(f"\n--- Cascade {cascade[0]} -> {cascade[1]} vs {cascade[1]} only ({len(items)} chats) ---")
+    print("task".ljust(16) + "large only".ljust(24) + "cascade")
+    for task in TASKS:
+        cells = []
+        for mode in ("large_only", "cascade"):
+            m = report[mode]["accuracy"][task]
+            if not m["n"]:
+                # Every chat failed, or the input was empty
+                cells.append("n/a".ljust(24))
+                continue
+            lo, hi = m["accuracy_ci"]
+            cells.append(f"{m['accuracy']:.1%} [{lo:.1%}-{hi:.1%}]".ljust(24))
+        print(task.ljust(16) + "".join(cells))
+    for mode in ("large_only", "cascade"):
+        r = report[mode]
+        server = ", ".join(f"{m} {sec:.1f}s" for m, sec in r["server_seconds"].items())
+        print(f"[*] {mode:<10}: {r['chats_per_sec']:.2f} chats/sec, {r['llm_calls']} LLM calls, server time {server}")
+    rate = report["cascade"]["escalation_rate"]
+    print(f"[+] Escalation rate: {rate:.1%}" if rate is not None else "[!] The cascade analyzed no chats")
+    return report
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--input", default="data/dataset.json")
     parser.add_argument("--output", default="data/evaluated_test.json")
+    parser.add_argument("--workers", type=int, default=1, help="Number of concurrent LLM requests")
+    parser.add_argument("--adaptive", action="store_true",
+                        help="Tune concurrency from observed latency and errors, starting at --workers")
+    parser.add_argument("--max-workers", type=int, default=16, help="Upper bound for --adaptive")
+    parser.add_argument("--batch-size", type=int, default=1, help="Chats packed into one analysis prompt")
+    parser.add_argument("--compare", type=int, metavar="N",
+                        help="Only measure batched vs single-item throughput on the first N chats")
+    parser.add_argument("--cascade", metavar="FAST_MODEL",
+                        help=f"Label chats with FAST_MODEL first and escalate only doubtful ones to {MODEL}")
+    parser.add_argument("--compare-cascade", type=int, metavar="N",
+                        help="Only compare cascade vs large-model accuracy and throughput on the first N chats")
+    parser.add_argument("--rescore", action="store_true",
+                        help="Only rerun the post-processing rules on the raw answers stored in --input "
+                             "(an analyzed dataset) and print how many labels changed; no LLM calls")
+    parser.add_argument("--audit", type=float, metavar="WIDTH",
+                        help="Analyze only a stratified sample (intent x case_type), growing it until every "
+                             "accuracy's confidence interval is narrower than WIDTH (e.g. 0.1)")
+    parser.add_argument("--audit-initial", type=int, default=50, help="First sample size of --audit")
+    parser.add_argument("--audit-step", type=int, default=100, help="Most chats added per --audit round")
+    parser.add_argument("--max-samples", type=int, default=1000, help="Most chats analyzed by --audit")
+    parser.add_argument("--fresh", action="store_true",
+                        help="Discard results journaled by an unfinished earlier run instead of resuming it")
+    parser.add_argument("--no-cache", action="store_true", help="Bypass the LLM response cache")
+    parser.add_argument("--cache-size", type=int, default=512, help="Response cache size limit in MB")
+    parser.add_argument("--stream", action="store_true",
+                        help="Stream responses and cancel each request once a valid JSON answer is complete")
+    parser.add_argument("--no-early-stop", action="store_true",
+                        help="With --stream, read responses to the end to measure tokens decoded after the answer")
+    parser.add_argument("--think", choices=["on", "off"], help="Enable or disable thinking of the analysis model")
+    parser.add_argument("--think-budget", type=int, metavar="N",
+                        help="Cut thinking after N tokens and re-ask without thinking (implies --stream)")
     args = parser.parse_args()
 
-    run_analysis(args.input, args.output)
\ No newline at end of file
+    THINK = {"on": True, "off": False}.get(args.think)
+    if args.stream or args.think_budget is not None:
+        CLIENT = StreamingClient(CLIENT, early_stop=not args.no_early_stop, think_budget=args.think_budget)
+
+    cascade = (args.cascade, MODEL) if args.cascade else None
+
+    if not args.rescore:
+        check_connection()
+
+    if args.rescore:
+        rescore(args.input, args.output)
+    elif args.audit:
+        cache = None if args.no_cache else ResponseCache(get_data_path("llm_cache.sqlite"), args.cache_size * 1024 * 1024)
+        run_audit(args.input, args.output, args.audit, args.audit_initial, args.audit_step, args.max_samples,
+                  workers=args.workers, cache=cache, cascade=cascade)
+    elif args.compare:
+        compare_batch_modes(args.input, args.batch_size, sample=args.compare, workers=args.workers)
+    elif args.compare_cascade:
+        if not cascade:
+            parser.error("--compare-cascade needs --cascade FAST_MODEL")
+        compare_cascade(args.input, cascade, sample=args.compare_cascade, workers=args.workers)
+    else:
+        cache = None if args.no_cache else ResponseCache(get_data_path("llm_cache.sqlite"), args.cache_size * 1024 * 1024)
+        workers = AdaptiveLimit(args.cascade or MODEL, args.workers, args.max_workers) if args.adaptive else args.workers
+        run_analysis(args.input, args.output, workers=workers, cache=cache, batch_size=args.batch_size,
+                     cascade=cascade, fresh=args.fresh)
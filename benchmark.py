@@ -0,0 +1,311 @@
+from src.mock_ollama import MockOllamaServer
+from src.utils import BASE_DIR, get_data_path, iter_chats
+from src.records import ChatStore
+from src.journal import dump_dataset
+from src.frames import FrameReader
+from itertools import cycle, islice
+import random
+from datetime import datetime
+import subprocess
+import tempfile
+import argparse
+import json
+import time
+import sys
+import os
+
+SCRIPTS = ("generate", "analyze")
+REPRESENTATIONS = ("dicts", "records")
+
+
+def percentile(values, q):
+    """Nearest-rank percentile, q in [0, 100]."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(q / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+def run_script(args, cwd, env, verbose=False):
+    """Runs a script and returns (wall seconds, peak RSS in MB)."""
+    start = time.perf_counter()
+    output = None if verbose else subprocess.DEVNULL
+    process = subprocess.Popen([sys.executable] + args, cwd=cwd, env=env, stdout=output, stderr=output)
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    elapsed = time.perf_counter() - start
+
+    if process.returncode != 0:
+        raise RuntimeError(f"{args[0]} exited with code {process.returncode}")
+    # ru_maxrss is reported in kilobytes on Linux
+    return elapsed, usage.ru_maxrss / 1024
+
+
+def make_input_dataset(path, size, source=get_data_path("dataset.json")):
+    """Writes a dataset of `size` chats by cycling through an existing one."""
+    with open(path, 'w', encoding='utf-8') as f:
+        for i, chat in enumerate(islice(cycle(list(iter_chats(source))), size), 1):
+            f.write(json.dumps({**chat, "id": i}, ensure_ascii=False) + "\n")
+
+
+def bench_generate(size, workdir, env, workers, verbose, extra_args=()):
+    os.makedirs(os.path.join(workdir, "data"), exist_ok=True)
+    args = [os.path.join(BASE_DIR, "generate.py"), "--file", "bench.json", "--intent", "payment_issue",
+            "--samples", str(size), "--workers", str(workers), *extra_args]
+    elapsed, rss = run_script(args, workdir, env, verbose)
+
+    chats = sum(1 for _ in iter_chats(os.path.join(workdir, "data", "bench.json")))
+    return elapsed, rss, chats, size - chats
+
+
+def bench_analyze(size, workdir, env, workers, verbose, batch_size=1, extra_args=()):
+    input_path = os.path.join(workdir, "input.jsonl")
+    output_path = os.path.join(workdir, "output.json")
+    make_input_dataset(input_path, size)
+
+    args = [os.path.join(BASE_DIR, "analyze.py"), "--input", input_path, "--output", output_path,
+            "--workers", str(workers), "--batch-size", str(batch_size), "--no-cache", *extra_args]
+    elapsed, rss = run_script(args, workdir, env, verbose)
+
+    # The mock always returns a reasoning field, so its absence means the response was not parsed
+    analyses = [item.get("analysis", {}) for item in iter_chats(output_path)]
+    failures = sum(1 for a in analyses if "reasoning" not in a) + size - len(analyses)
+    return elapsed, rss, len(analyses), failures
+
+
+def run_benchmarks(sizes, scripts, mock_options, workers=1, batch_size=1, verbose=False, stream=False):
+    mock = MockOllamaServer(**mock_options).start()
+    env = {**os.environ, "OLLAMA_HOST": mock.url}
+    extra_args = ["--stream"] if stream else []
+    runs = []
+
+    try:
+        for script in scripts:
+            for size in sizes:
+                mock.reset()
+                with tempfile.TemporaryDirectory() as workdir:
+                    if script == "generate":
+                        elapsed, rss, items, failures = bench_generate(size, workdir, env, workers, verbose, extra_args)
+                    else:
+                        elapsed, rss, items, failures = bench_analyze(size, workdir, env, workers, verbose, batch_size, extra_args)
+
+                stats = mock.stats()
+                run = {
+                    "script": script,
+                    "size": size,
+                    "items": items,
+                    "seconds": elapsed,
+                    "throughput": items / elapsed,
+                    "requests": stats["requests"],
+                    "errors": stats["errors"],
+                    "malformed": stats["malformed"],
+                    "parse_failure_rate": failures / size if size else 0.0,
+                    "decoded_tokens": stats["decoded_tokens"],
+                    "cancelled_tokens": stats["cancelled_tokens"],
+                    "latency": {f"p{q}": percentile(stats["latencies"], q) for q in (50, 95, 99)},
+                    "peak_rss_mb": rss
+                }
+                runs.append(run)
+                print_run(run)
+    finally:
+        mock.stop()
+
+    return runs
+
+
+def load_chats(representation, n, source=get_data_path("dataset.json")):
+    """Builds n chats in memory by cycling the source dataset; every chat is parsed anew, as from a file."""
+    lines = [json.dumps(chat, ensure_ascii=False) for chat in iter_chats(source)]
+    chats = (json.loads(line) for line in islice(cycle(lines), n))
+    if representation == "dicts":
+        return list(chats)
+    return ChatStore(chats)
+
+
+def bench_memory(n, dict_limit):
+    """
+    Peak RSS of n chats held as dicts and as a ChatStore, each built in its own
+    process, minus the same process with an empty dataset. Dicts above
+    dict_limit chats are measured at dict_limit and scaled linearly.
+    """
+    script = os.path.join(BASE_DIR, "benchmark.py")
+    measure = lambda representation, size: run_script([script, "--memory-child", representation, str(size)],
+                                                       BASE_DIR, os.environ)
+    baseline = {r: measure(r, 0)[1] for r in REPRESENTATIONS}
+
+    results = {}
+    for representation in REPRESENTATIONS:
+        size = min(n, dict_limit) if representation == "dicts" else n
+        elapsed, rss = measure(representation, size)
+        results[representation] = {
+            "measured_chats": size,
+            "seconds": elapsed,
+            "mb": (rss - baseline[representation]) * n / size if size else 0.0,
+            "extrapolated": size != n
+        }
+
+    for representation, result in results.items():
+        note = f" (extrapolated from {result['measured_chats']})" if result["extrapolated"] else ""
+        print(f"[*] {representation:<8} n={n}: {result['mb']:9.1f} MB, "
+              f"{result['mb'] * 2 ** 20 / n:6.0f} B/chat, built in {result['seconds']:.1f}s{note}")
+    saving = 1 - results["records"]["mb"] / results["dicts"]["mb"]
+    print(f"[+] ChatStore saves {saving:.0%} ({results['dicts']['mb'] / results['records']['mb']:.1f}x smaller)")
+    return results
+
+
+def bench_storage(n, reads=200, scan_reads=5, seed=42):
+    """
+    Size, write throughput and random read-by-ID latency of n chats as an
+    indented JSON array and as compressed frames (.jsonz). Reading one chat
+    from JSON means scanning up to it, so fewer of those reads are timed.
+    """
+    source = list(iter_chats(get_data_path("dataset.json")))
+    chats = lambda: ({**chat, "id": i} for i, chat in enumerate(islice(cycle(source), n), 1))
+    rng = random.Random(seed)
+    results = {}
+
+    with tempfile.TemporaryDirectory() as workdir:
+        for name, filename in (("json", "bench.json"), ("frames", "bench.jsonz")):
+            path = os.path.join(workdir, filename)
+            start = time.perf_counter()
+            dump_dataset(chats(), path)
+            write_seconds = time.perf_counter() - start
+
+            latencies = []
+            if name == "frames":
+                with FrameReader(path) as reader:
+                    for _ in range(reads):
+                        start = time.perf_counter()
+                        reader.get(rng.randint(1, n))
+                        latencies.append(time.perf_counter() - start)
+            else:
+                for _ in range(scan_reads):
+                    chat_id = rng.randint(1, n)
+                    start = time.perf_counter()
+                    next(chat for chat in iter_chats(path) if chat["id"] == chat_id)
+                    latencies.append(time.perf_counter() - start)
+
+            results[name] = {
+                "mb": os.path.getsize(path) / 2 ** 20,
+                "write_chats_per_s": n / write_seconds,
+                "read_ms": {f"p{q}": percentile(latencies, q) * 1000 for q in (50, 99)},
+                "reads": len(latencies)
+            }
+
+    for name, result in results.items():
+        print(f"[*] {name:<6} n={n}: {result['mb']:8.1f} MB | write {result['write_chats_per_s']:8.0f} chats/s | "
+              f"read by ID p50 {result['read_ms']['p50']:.2f} ms p99 {result['read_ms']['p99']:.2f} ms "
+              f"({result['reads']} reads)")
+    print(f"[+] Frames are {results['json']['mb'] / results['frames']['mb']:.1f}x smaller, "
+          f"reads {results['json']['read_ms']['p50'] / results['frames']['read_ms']['p50']:.0f}x faster")
+    return results
+
+
+def print_run(run):
+    latency = run["latency"]
+    fmt = lambda x: f"{x * 1000:.0f}ms" if x is not None else "-"
+    print(f"[*] {run['script']:<8} n={run['size']:<6} {run['throughput']:8.2f} items/s | "
+          f"p50 {fmt(latency['p50'])} p95 {fmt(latency['p95'])} p99 {fmt(latency['p99'])} | "
+          f"parse failures {run['parse_failure_rate']:.1%} | peak RSS {run['peak_rss_mb']:.1f} MB | "
+          f"decoded {run['decoded_tokens']} tok, cancelled {run['cancelled_tokens']} tok")
+
+
+def compare_results(runs, baseline_path, threshold=0.1):
+    """Prints throughput and memory deltas against a previous results file."""
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = {(r["script"], r["size"]): r for r in json.load(f)["runs"]}
+
+    regressions = 0
+    print(f"\n--- Compared to {baseline_path} ---")
+    for run in runs:
+        old = baseline.get((run["script"], run["size"]))
+        if old is None:
+            continue
+        throughput = run["throughput"] / old["throughput"] - 1
+        rss = run["peak_rss_mb"] / old["peak_rss_mb"] - 1
+        regressed = throughput < -threshold or rss > threshold
+        regressions += regressed
+        print(f"{'[!]' if regressed else '[+]'} {run['script']:<8} n={run['size']:<6} "
+              f"throughput {throughput:+.1%} | peak RSS {rss:+.1%}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Offline benchmarks for generate.py and analyze.py against a mock Ollama server",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 50, 200], help="Dataset sizes to run")
+    parser.add_argument("--scripts", nargs="+", choices=SCRIPTS, default=list(SCRIPTS))
+    parser.add_argument("--workers", type=int, default=1, help="--workers passed to both scripts")
+    parser.add_argument("--batch-size", type=int, default=1, help="--batch-size passed to analyze.py")
+    parser.add_argument("--output", default=get_data_path("benchmark_results.json"), help="Results JSON path")
+    parser.add_argument("--baseline", help="Previous results JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Relative change reported as regression")
+    parser.add_argument("--verbose", action="store_true", help="Show script output")
+
+    # Mock server behaviour
+    parser.add_argument("--latency", type=float, default=0.02, help="Fixed per-request latency in seconds")
+    parser.add_argument("--token-rate", type=float, default=2000.0, help="Decode tokens per second")
+    parser.add_argument("--prompt-rate", type=float, default=20000.0, help="Prompt eval tokens per second")
+    parser.add_argument("--load-latency", type=float, default=0.0, help="Seconds to load a non-resident model")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with HTTP 500")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="Share of responses with truncated JSON")
+    parser.add_argument("--parallel", type=int, default=4, help="Requests the mock serves concurrently")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--think-tokens", type=int, default=0, help="Thinking tokens the mock decodes before each analysis")
+    parser.add_argument("--trailing-tokens", type=int, default=0,
+                        help="Whitespace tokens the mock decodes after each answer")
+    parser.add_argument("--stream", action="store_true",
+                        help="Run both scripts with --stream (cancel requests once the JSON is complete)")
+
+    # Dataset memory and storage formats instead of the script benchmarks
+    parser.add_argument("--memory", type=int, metavar="N", help="Compare memory of N chats as dicts vs ChatStore")
+    parser.add_argument("--memory-dict-limit", type=int, default=200000,
+                        help="Largest dict dataset actually built; bigger N is extrapolated")
+    parser.add_argument("--storage", type=int, metavar="N", help="Compare JSON and .jsonz storage of N chats")
+    parser.add_argument("--storage-reads", type=int, default=200, help="Random reads timed on the .jsonz file")
+    parser.add_argument("--memory-child", nargs=2, metavar=("REPR", "N"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.memory_child:
+        load_chats(args.memory_child[0], int(args.memory_child[1]))
+        sys.exit(0)
+
+    if args.memory or args.storage:
+        results = {"timestamp": datetime.now().isoformat(timespec="seconds")}
+        if args.memory:
+            results["memory"] = {"chats": args.memory, **bench_memory(args.memory, args.memory_dict_limit)}
+        if args.storage:
+            results["storage"] = {"chats": args.storage, **bench_storage(args.storage, args.storage_reads)}
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=4)
+        print(f"[+] Results saved to {args.output}")
+        sys.exit(0)
+
+    mock_options = {
+        "latency": args.latency,
+        "token_rate": args.token_rate,
+        "prompt_rate": args.prompt_rate,
+        "load_latency": args.load_latency,
+        "error_rate": args.error_rate,
+        "malformed_rate": args.malformed_rate,
+        "parallel": args.parallel,
+        "seed": args.seed,
+        "think_tokens": args.think_tokens,
+        "trailing_tokens": args.trailing_tokens
+    }
+    runs = run_benchmarks(args.sizes, args.scripts, mock_options, args.workers, args.batch_size, args.verbose,
+                          args.stream)
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump({
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "options": {**mock_options, "workers": args.workers, "batch_size": args.batch_size, "stream": args.stream},
+            "runs": runs
+        }, f, indent=4)
+    print(f"[+] Results saved to {args.output}")
+
+    if args.baseline:
+        sys.exit(1 if compare_results(runs, args.baseline, args.threshold) else 0)
@@ -1,8 +1,17 @@
-import json
+from src.utils import iter_chats
+from src.index import ChatIndex
+from src.config import INTENTS, CASE_TYPES, AGENT_MISTAKES, PERSONALITIES
 from collections import Counter
+from statistics import NormalDist
+from array import array
+import numpy as np
+import argparse
+import json
 
 INPUT_FILE = "data/evaluated_test.json"
 TOP_N_MISMATCHES = 15
+BOOTSTRAP_RESAMPLES = 1000
+CONFIDENCE = 0.95
 
 INTENT_GT_TO_PRED = {
     "payment_issue": "payment problems",
@@ -16,6 +25,20 @@ UNSAT_CASE_TYPES = {
     "hidden_unsatisfaction", "agent_mistake"
 }
 
+# Evaluated tasks and their label order (confusion matrix rows/columns)
+TASKS = {
+    "intent": list(INTENT_GT_TO_PRED.values()) + ["other"],
+    "satisfaction": ["satisfied", "unsatisfied", "neutral"],
+    "no_resolution": ["no", "yes"],
+    "quality_score": ["in_range", "out_of_range"],
+}
+
+# Ground-truth metadata the metrics are sliced by
+SLICES = ["case_type", "mistake", "personality_type", "intent"]
+
+# Metadata a sampled audit is stratified by (ChatIndex filter names)
+STRATA = ("intent", "case_type")
+
 def expected_satisfaction(case_type: str) -> str:
     return "satisfied" if case_type == "success" else "unsatisfied"
 
@@ -38,126 +61,444 @@ def print_confusion_matrix(cm, labels, title):
     width = max(len(x) for x in header) + 2
 
     print("".join(h.ljust(width) for h in header))
-    for gt in labels:
-        row = [gt] + [str(cm[(gt, pr)]) for pr in labels]
+    for gt, row in zip(labels, cm):
+        row = [gt] + [str(v) for v in row]
         print("".join(x.ljust(width) for x in row))
 
-def main():
-    with open(INPUT_FILE, encoding="utf-8") as f:
-        data = json.load(f)
+def load_items(input_file, filters):
+    """Streams every chat, or only the indexed chats matching the label filters."""
+    if not any(filters.values()):
+        return iter_chats(input_file)
+
+    index = ChatIndex(input_file)
+    index.update()
+    rows = index.query(**filters)
+    print(f"[*] {len(rows)} chats match {({k: v for k, v in filters.items() if v})}")
+    return index.fetch(rows)
+
+
+class LabelCodes:
+    """
+    Encodes label strings as small integer codes, one byte per item. The codes
+    are widened to 2 and then 4 bytes when a field has more than 256 distinct values.
+    """
+
+    def __init__(self, labels=None):
+        self.labels = list(labels or [])
+        self._codes = {label: i for i, label in enumerate(self.labels)}
+        self.values = array("B")
+        self._widen()
+
+    def _widen(self):
+        for typecode in ("B", "H", "I"):
+            if len(self.labels) <= 1 << (8 * array(typecode).itemsize):
+                if typecode != self.values.typecode:
+                    self.values = array(typecode, self.values)
+                return
+
+    def add(self, label):
+        code = self._codes.get(label)
+        if code is None:
+            code = self._codes[label] = len(self.labels)
+            self.labels.append(label)
+            self._widen()
+        self.values.append(code)
+
+    def array(self):
+        return np.frombuffer(self.values, dtype=f"u{self.values.itemsize}").astype(np.intp)
+
+
+def item_labels(meta, pred):
+    """Returns ({task: (expected, predicted)}, (score_lo, score_hi, score)) for one analyzed chat."""
+    # ---------- Ground truth ----------
+    gt_intent = INTENT_GT_TO_PRED.get(
+        normalize(meta.get("intent")), "other"
+    )
+    gt_case = normalize(meta.get("case_type"))
+    gt_satisfaction = expected_satisfaction(gt_case)
+    gt_no_resolution = gt_case != "success"
+    score_lo, score_hi = expected_score_range(gt_case)
+
+    # ---------- Prediction ----------
+    pr_intent = normalize(pred.get("request_intent"))
+    pr_intent = {
+        "payment issue": "payment problems",
+        "technical issue": "technical errors",
+        "login issue": "account access",
+        "tariff": "questions about the tariff",
+    }.get(pr_intent, pr_intent)
+
+    if pr_intent not in TASKS["intent"]:
+        pr_intent = "other"
+
+    pr_satisfaction = normalize(pred.get("customer_satisfaction"))
+    if pr_satisfaction not in {"satisfied", "unsatisfied", "neutral"}:
+        pr_satisfaction = "unsatisfied"
+
+    pr_no_resolution = has_no_resolution(pred.get("agent_mistakes", []))
+
+    pr_score = pred.get("quality_score")
+    score_ok = isinstance(pr_score, int) and score_lo <= pr_score <= score_hi
+
+    return {
+        "intent": (gt_intent, pr_intent),
+        "satisfaction": (gt_satisfaction, pr_satisfaction),
+        "no_resolution": ("yes" if gt_no_resolution else "no", "yes" if pr_no_resolution else "no"),
+        "quality_score": ("in_range", "in_range" if score_ok else "out_of_range"),
+    }, (score_lo, score_hi, pr_score)
+
+
+class Evaluation:
+    """
+    Running evaluation: encodes each analyzed chat as it arrives and keeps live
+    accuracy counters, so results can be reported while data is still coming in.
+    """
+
+    def __init__(self):
+        self.gt = {task: LabelCodes(labels) for task, labels in TASKS.items()}
+        self.pr = {task: LabelCodes(labels) for task, labels in TASKS.items()}
+        self.slices = {name: LabelCodes() for name in SLICES}
+        self.mismatches = []
+        self.correct = dict.fromkeys(TASKS, 0)
+        self.n = 0
+
+    def add(self, item):
+        meta = item.get("metadata", {})
+        labels, (score_lo, score_hi, pr_score) = item_labels(meta, item.get("analysis", {}))
+        self.n += 1
+
+        for task, (gt_label, pr_label) in labels.items():
+            self.gt[task].add(gt_label)
+            self.pr[task].add(pr_label)
+            if gt_label == pr_label:
+                self.correct[task] += 1
+            # Only the reported head is kept so memory stays flat on large inputs
+            elif len(self.mismatches) < TOP_N_MISMATCHES:
+                if task == "quality_score":
+                    gt_label, pr_label = f"{score_lo}-{score_hi}", pr_score
+                elif task == "no_resolution":
+                    gt_label, pr_label = gt_label == "yes", pr_label == "yes"
+                self.mismatches.append((item.get("id"), task, gt_label, pr_label))
+
+        for name in SLICES:
+            self.slices[name].add(normalize(meta.get(name)) or "none")
+
+    def accuracy(self):
+        return {task: self.correct[task] / self.n if self.n else 0.0 for task in TASKS}
+
+    def report(self, resamples=BOOTSTRAP_RESAMPLES, confidence=CONFIDENCE, seed=0):
+        report = evaluate(self.gt, self.pr, self.slices, resamples, confidence, seed)
+        report["n"] = self.n
+        report["mismatches"] = self.mismatches
+        return report
+
+
+def stratum(meta):
+    return tuple(meta.get(name) for name in STRATA)
+
+
+def population_strata(dataset_path):
+    """{stratum: [(id, offset, length), ...]} of every chat in a dataset, from its label index."""
+    index = ChatIndex(dataset_path)
+    index.update()
+    return index.group(*STRATA)
+
+
+class StratifiedEvaluation:
+    """
+    Accuracy estimates from a stratified sample (see analyze.py --audit).
+
+    Each task's accuracy is the population-weighted mean of the per-stratum
+    sample accuracies, with a normal-approximation confidence interval whose
+    variance includes the finite population correction. Per-stratum
+    accuracies are smoothed as (correct + 1) / (n + 2) for the variance, so a
+    small stratum that happens to be all right or all wrong still counts as
+    uncertain.
+    """
+
+    def __init__(self, population):
+        self.population = {h: n for h, n in population.items() if n}
+        self.total = sum(self.population.values())
+        self.n = Counter()
+        self.correct = {task: Counter() for task in TASKS}
+
+    def add(self, item):
+        meta = item.get("metadata", {})
+        labels, _ = item_labels(meta, item.get("analysis", {}))
+        h = stratum(meta)
+        self.n[h] += 1
+        for task, (gt_label, pr_label) in labels.items():
+            self.correct[task][h] += gt_label == pr_label
+
+    def _smoothed(self, task, h):
+        return (self.correct[task][h] + 1) / (self.n[h] + 2)
+
+    def estimate(self, task, confidence=CONFIDENCE):
+        sampled = [h for h in self.population if self.n[h]]
+        covered = sum(self.population[h] for h in sampled)
+        if not covered:
+            return {"n": 0}
+
+        accuracy = variance = 0.0
+        for h in sampled:
+            # Strata without samples yet are left out and the weights renormalized
+            weight, n, size = self.population[h] / covered, self.n[h], self.population[h]
+            accuracy += weight * self.correct[task][h] / n
+            p = self._smoothed(task, h)
+            variance += weight ** 2 * p * (1 - p) / n * (1 - n / size)
+
+        half = NormalDist().inv_cdf((1 + confidence) / 2) * variance ** 0.5
+        return {
+            "n": sum(self.n[h] for h in sampled),
+            "accuracy": accuracy,
+            "accuracy_ci": [max(0.0, accuracy - half), min(1.0, accuracy + half)],
+            "width": min(1.0, accuracy + half) - max(0.0, accuracy - half),
+        }
+
+    def report(self, confidence=CONFIDENCE):
+        tasks = {task: self.estimate(task, confidence) for task in TASKS}
+        widest = max(TASKS, key=lambda task: tasks[task].get("width", 1.0))
+        return {
+            "n": sum(self.n.values()),
+            "population": self.total,
+            "confidence": confidence,
+            "strata": {
+                "|".join(str(v) for v in h): {"population": size, "sampled": self.n[h]}
+                for h, size in sorted(self.population.items(), key=lambda x: str(x[0]))
+            },
+            "tasks": tasks,
+            "widest_task": widest,
+            "width": tasks[widest].get("width", 1.0),
+        }
+
+    def allocate(self, k, taken, floor=0, task=None):
+        """
+        Splits k new samples across strata: at least `floor` per stratum, the
+        rest in proportion to population size times the stratum's standard
+        deviation for `task` (Neyman allocation), never more than a stratum
+        has left after `taken`.
+        """
+        left = {h: size - taken.get(h, 0) for h, size in self.population.items()}
+        plan = Counter()
+        for h in sorted(left, key=str):
+            extra = min(floor, left[h], k - sum(plan.values()))
+            if extra > 0:
+                plan[h] += extra
+                left[h] -= extra
+
+        tasks = [task] if task else list(TASKS)
+        while sum(plan.values()) < k and any(left.values()):
+            weights = {
+                h: size * max((self._smoothed(t, h) * (1 - self._smoothed(t, h))) ** 0.5 for t in tasks)
+                for h, size in self.population.items() if left[h]
+            }
+            remaining = k - sum(plan.values())
+            total = sum(weights.values())
+            # Largest remainder rounding, capped by what each stratum has left
+            shares = {h: remaining * w / total for h, w in weights.items()}
+            order = sorted(shares, key=lambda h: shares[h] - int(shares[h]), reverse=True)
+            given = {h: min(left[h], int(shares[h])) for h in shares}
+            for h in order[:remaining - sum(given.values())]:
+                given[h] = min(left[h], given[h] + 1)
+            if not any(given.values()):
+                break
+            for h, n in given.items():
+                plan[h] += n
+                left[h] -= n
+        return {h: n for h, n in plan.items() if n}
+
+
+def print_stratified_report(report):
+    print("\n==============================")
+    print("SAMPLED AUDIT ESTIMATES")
+    print("==============================")
+    sampled = sum(1 for s in report["strata"].values() if s["sampled"])
+    print(f"Dialogs analyzed: {report['n']} of {report['population']} ({report['n'] / report['population']:.1%}), "
+          f"{sampled}/{len(report['strata'])} intent x case_type strata sampled")
+
+    print(f"\n--- Estimated accuracy ({report['confidence']:.0%} CI) ---")
+    for task, m in report["tasks"].items():
+        if m["n"]:
+            print(f"{task + ':':<24}{format_metric(m, digits=1)}  width {m['width']:.3f}")
+    print("\nDone.")
+
+
+def encode(items):
+    """Single pass over the dataset: encodes every task and slice label as integer codes."""
+    evaluation = Evaluation()
+    for item in items:
+        evaluation.add(item)
+    return evaluation.gt, evaluation.pr, evaluation.slices, evaluation.mismatches
+
 
-    n = len(data)
+def macro_f1(cm, classes):
+    """Macro F1 over the given classes; cm may carry leading (e.g. resample) dimensions."""
+    tp = np.diagonal(cm, axis1=-2, axis2=-1)
+    denom = cm.sum(axis=-1) + cm.sum(axis=-2)
+    f1 = np.divide(2 * tp, denom, out=np.zeros(denom.shape), where=denom > 0)
+    return f1[..., classes].mean(axis=-1)
+
+
+def metrics(cm, rng, resamples, confidence):
+    """
+    Accuracy and macro F1 of one confusion matrix with percentile bootstrap CIs.
+
+    Resampling n items with replacement only changes how many land in each
+    confusion matrix cell, so each resample is drawn as multinomial cell counts
+    instead of re-indexing the items: the cost does not depend on n.
+    """
+    n = int(cm.sum())
     if n == 0:
-        print("Dataset is empty.")
-        return
+        return {"n": 0}
 
-    intent_correct = 0
-    satisfaction_correct = 0
-    no_resolution_correct = 0
-    score_correct = 0
+    k = cm.shape[0]
+    # F1 is averaged over classes present in the ground truth of this slice
+    classes = np.flatnonzero(cm.sum(axis=1))
+    samples = rng.multinomial(n, cm.ravel() / n, size=resamples).reshape(resamples, k, k)
 
-    intent_labels = list(INTENT_GT_TO_PRED.values()) + ["other"]
-    intent_cm = Counter()
-    satisfaction_cm = Counter()
+    q = [(1 - confidence) / 2 * 100, (1 + confidence) / 2 * 100]
+    accuracy = np.trace(samples, axis1=1, axis2=2) / n
+    f1 = macro_f1(samples, classes)
+    return {
+        "n": n,
+        "accuracy": float(np.trace(cm) / n),
+        "accuracy_ci": [float(v) for v in np.percentile(accuracy, q)],
+        "macro_f1": float(macro_f1(cm, classes)),
+        "macro_f1_ci": [float(v) for v in np.percentile(f1, q)],
+    }
 
-    mismatches = []
 
-    for item in data:
-        _id = item.get("id")
-        meta = item.get("metadata", {})
-        pred = item.get("analysis", {})
-
-        # ---------- Ground truth ----------
-        gt_intent = INTENT_GT_TO_PRED.get(
-            normalize(meta.get("intent")), "other"
-        )
-        gt_case = normalize(meta.get("case_type"))
-        gt_satisfaction = expected_satisfaction(gt_case)
-        gt_no_resolution = gt_case != "success"
-        score_lo, score_hi = expected_score_range(gt_case)
-
-        # ---------- Prediction ----------
-        pr_intent = normalize(pred.get("request_intent"))
-        pr_intent = {
-            "payment issue": "payment problems",
-            "technical issue": "technical errors",
-            "login issue": "account access",
-            "tariff": "questions about the tariff",
-        }.get(pr_intent, pr_intent)
-
-        if pr_intent not in intent_labels:
-            pr_intent = "other"
-
-        pr_satisfaction = normalize(pred.get("customer_satisfaction"))
-        if pr_satisfaction not in {"satisfied", "unsatisfied", "neutral"}:
-            pr_satisfaction = "unsatisfied"
-
-        pr_mistakes = pred.get("agent_mistakes", [])
-        pr_no_resolution = has_no_resolution(pr_mistakes)
-
-        pr_score = pred.get("quality_score")
-
-        # ---------- Intent ----------
-        intent_cm[(gt_intent, pr_intent)] += 1
-        if gt_intent == pr_intent:
-            intent_correct += 1
-        else:
-            mismatches.append(
-                (_id, "intent", gt_intent, pr_intent)
-            )
-
-        # ---------- Satisfaction ----------
-        satisfaction_cm[(gt_satisfaction, pr_satisfaction)] += 1
-        if gt_satisfaction == pr_satisfaction:
-            satisfaction_correct += 1
-        else:
-            mismatches.append(
-                (_id, "satisfaction", gt_satisfaction, pr_satisfaction)
-            )
-
-        # ---------- no_resolution ----------
-        if gt_no_resolution == pr_no_resolution:
-            no_resolution_correct += 1
-        else:
-            mismatches.append(
-                (_id, "no_resolution", gt_no_resolution, pr_no_resolution)
-            )
-
-        # ---------- Quality score ----------
-        if isinstance(pr_score, int) and score_lo <= pr_score <= score_hi:
-            score_correct += 1
-        else:
-            mismatches.append(
-                (_id, "quality_score", f"{score_lo}-{score_hi}", pr_score)
-            )
-
-    # ============================================================
-    # Results
-    # ============================================================
+def evaluate(gt, pr, slices, resamples=BOOTSTRAP_RESAMPLES, confidence=CONFIDENCE, seed=0):
+    """Builds confusion matrices, overall and per-slice metrics from the encoded labels."""
+    rng = np.random.default_rng(seed)
+    report = {"tasks": {}, "bootstrap": {"resamples": resamples, "confidence": confidence, "seed": seed}}
+
+    slice_codes = {name: codes.array() for name, codes in slices.items()}
+    for task, labels in TASKS.items():
+        k = len(labels)
+        cell = gt[task].array() * k + pr[task].array()
+        cm = np.bincount(cell, minlength=k * k).reshape(k, k)
+
+        result = {"labels": labels, "confusion_matrix": cm.tolist(), "overall": metrics(cm, rng, resamples, confidence)}
+
+        # One bincount per slice dimension gives every slice's confusion matrix at once
+        result["slices"] = {}
+        for name, codes in slice_codes.items():
+            values = slices[name].labels
+            per_slice = np.bincount(codes * k * k + cell, minlength=len(values) * k * k).reshape(-1, k, k)
+            result["slices"][name] = {
+                value: metrics(per_slice[i], rng, resamples, confidence)
+                for i, value in sorted(enumerate(values), key=lambda x: x[1])
+            }
+        report["tasks"][task] = result
+
+    return report
+
+
+def format_metric(m, key="accuracy", digits=0):
+    lo, hi = m[f"{key}_ci"]
+    return f"{m[key]:.{digits}%} [{lo:.{digits}%}-{hi:.{digits}%}]"
+
+
+def print_report(report):
+    tasks = report["tasks"]
 
     print("\n==============================")
     print("LLM PERFORMANCE EVALUATION")
     print("==============================")
-    print(f"Dialogs analyzed: {n}")
-
-    print("\n--- Accuracy ---")
-    print(f"Intent accuracy:        {intent_correct / n:.2%}")
-    print(f"Satisfaction accuracy:  {satisfaction_correct / n:.2%}")
-    print(f"No-resolution accuracy: {no_resolution_correct / n:.2%}")
-    print(f"Score-in-range:         {score_correct / n:.2%}")
-
-    print_confusion_matrix(intent_cm, intent_labels, "Intent")
-    print_confusion_matrix(
-        satisfaction_cm,
-        ["satisfied", "unsatisfied", "neutral"],
-        "Satisfaction"
-    )
+    print(f"Dialogs analyzed: {report['n']}")
+
+    bootstrap = report["bootstrap"]
+    print(f"\n--- Accuracy ({bootstrap['confidence']:.0%} bootstrap CI, {bootstrap['resamples']} resamples) ---")
+    titles = {"intent": "Intent accuracy", "satisfaction": "Satisfaction accuracy",
+              "no_resolution": "No-resolution accuracy", "quality_score": "Score-in-range"}
+    for task, title in titles.items():
+        m = tasks[task]["overall"]
+        line = f"{title + ':':<24}{format_metric(m, digits=2)}"
+        if task != "quality_score":
+            line += f"  macro F1 {format_metric(m, 'macro_f1', digits=2)}"
+        print(line)
+
+    print_confusion_matrix(tasks["intent"]["confusion_matrix"], TASKS["intent"], "Intent")
+    print_confusion_matrix(tasks["satisfaction"]["confusion_matrix"], TASKS["satisfaction"], "Satisfaction")
+
+    for name in SLICES:
+        print(f"\n--- Accuracy by {name} ---")
+        values = list(tasks["intent"]["slices"][name])
+        width = max(len(v) for v in values + [name]) + 2
+        print(name.ljust(width) + "n".ljust(8) + "".join(t.ljust(20) for t in TASKS))
+        for value in values:
+            row = value.ljust(width) + str(tasks["intent"]["slices"][name][value]["n"]).ljust(8)
+            row += "".join(format_metric(tasks[t]["slices"][name][value]).ljust(20) for t in TASKS)
+            print(row)
 
     print(f"\n--- Top {TOP_N_MISMATCHES} mismatches ---")
-    for m in mismatches[:TOP_N_MISMATCHES]:
+    for m in report["mismatches"]:
         print(f"ID {m[0]} | {m[1]} | expected={m[2]} | got={m[3]}")
 
     print("\nDone.")
 
+def save_report(report, json_output):
+    with open(json_output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=4, ensure_ascii=False)
+    print(f"[+] Report saved to {json_output}")
+
+def add_items(evaluation, items):
+    """Adds every analyzed chat; chats exported without an analysis (failed calls) are skipped."""
+    missing = 0
+    for item in items:
+        if "analysis" not in item:
+            missing += 1
+            continue
+        evaluation.add(item)
+    if missing:
+        print(f"[!] {missing} chats have no analysis and are not evaluated")
+
+def main(input_file=INPUT_FILE, filters=None, json_output=None, resamples=BOOTSTRAP_RESAMPLES,
+         confidence=CONFIDENCE, seed=0, population=None):
+    if population:
+        # A stratified sample: estimates are weighted by the population's stratum sizes
+        evaluation = StratifiedEvaluation({h: len(rows) for h, rows in population_strata(population).items()})
+        add_items(evaluation, load_items(input_file, filters or {}))
+        if not evaluation.n:
+            print("Dataset is empty.")
+            return
+        report = evaluation.report(confidence)
+        print_stratified_report(report)
+        if json_output:
+            save_report(report, json_output)
+        return
+
+    evaluation = Evaluation()
+    add_items(evaluation, load_items(input_file, filters or {}))
+
+    if evaluation.n == 0:
+        print("Dataset is empty.")
+        return
+
+    report = evaluation.report(resamples, confidence, seed)
+    print_report(report)
+
+    if json_output:
+        save_report(report, json_output)
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Evaluate analysis results against generation labels")
+    parser.add_argument("--input", default=INPUT_FILE, help="Analyzed dataset (JSON or JSONL)")
+    parser.add_argument("--json", help="Also write the full report (per-slice metrics, CIs, matrices) to this file")
+    parser.add_argument("--bootstrap", type=int, default=BOOTSTRAP_RESAMPLES, help="Bootstrap resamples per metric")
+    parser.add_argument("--confidence", type=float, default=CONFIDENCE, help="Confidence level of the intervals")
+    parser.add_argument("--seed", type=int, default=0, help="Bootstrap random seed")
+    parser.add_argument("--population", metavar="DATASET",
+                        help="--input is a stratified sample of DATASET (analyze.py --audit): report "
+                             "population-weighted accuracy estimates")
+    parser.add_argument("--intent", choices=INTENTS, help="Evaluate only this intent")
+    parser.add_argument("--case_type", choices=CASE_TYPES, help="Evaluate only this case type")
+    parser.add_argument("--mistake", choices=AGENT_MISTAKES, help="Evaluate only this generated agent mistake")
+    parser.add_argument("--personality", choices=[p["type"] for p in PERSONALITIES], help="Evaluate only this personality")
+    args = parser.parse_args()
+
+    main(args.input, dict(intent=args.intent, case_type=args.case_type,
+                          mistake=args.mistake, personality=args.personality),
+         json_output=args.json, resamples=args.bootstrap, confidence=args.confidence, seed=args.seed,
+         population=args.population)
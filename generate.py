@@ -1,26 +1,51 @@
-from src.utils import get_ollama_endpoint
+from src.utils import get_ollama_endpoints, get_data_path, bounded_map, iter_chats
+from src.pool import ClientPool
+from src.quota import QuotaScheduler
+from src.journal import DatasetJournal
+from src.index import ChatIndex
+from src.records import ChatStore
+from src.stats import LabelStats
+from src.cache import ResponseCache
+from src.telemetry import Telemetry
+from src.schemas import CHAT_SCHEMA, MULTI_CHAT_SCHEMA, parse, validate
+from src.streaming import StreamingClient
+from src.concurrency import AdaptiveLimit, current_workers
 from src.prompts import *
 from src.config import *
+from collections import Counter
 from tqdm import tqdm
 import argparse
-import ollama
 import random
 import json
-import re
+import time
 import os
 
 
 class ChatGenerator:
-    def __init__(self, model=MODEL, filename="dataset.json"):
-        self.endpoint = get_ollama_endpoint()
-        self.client = ollama.Client(host=self.endpoint)
+    def __init__(self, model=MODEL, filename="dataset.json", workers=1, cache=None, telemetry=None, index=False,
+                 stream=False, per_call=1):
+        self.client = ClientPool(get_ollama_endpoints())
+        if stream:
+            # Requests are cancelled as soon as the chat JSON is complete
+            self.client = StreamingClient(self.client)
+        self.endpoint = self.client.endpoint
         self.model = model
+        # A fixed number of concurrent requests, or an AdaptiveLimit that tunes it
+        self.workers = workers if isinstance(workers, AdaptiveLimit) else max(1, workers)
+        self.cache = cache
+        # Dialogues requested per LLM call (all of the same label cell)
+        self.per_call = max(1, per_call)
         self.path = os.path.join("data", filename)
+        self.journal = DatasetJournal(os.path.splitext(self.path)[0] + ".jsonl")
+        self.telemetry = telemetry or Telemetry(os.path.splitext(self.path)[0] + ".metrics.jsonl")
+        self.index = ChatIndex(self.journal.path) if index else None
+        # Label counters kept next to the journal, so `utils stats` can poll them during a run
+        self.stats = LabelStats(self.journal.path)
         self.current_id = 1
-        self.dataset = []
+        self.dataset = ChatStore()
 
     def _check_connection(self):
-        """Verifies if Ollama is reachable and the model is pulled."""
+        """Verifies if Ollama is reachable, health-checking every host of the pool."""
         try:
             self.client.list()
             print(f"[+] Connected to Ollama at {self.endpoint}")
@@ -29,13 +54,7 @@ class ChatGenerator:
             print(f"[!] Make sure Ollama is running and accessible.")
             exit(1)
 
-    def _clean_json(self, raw_data):
-        """Cleans JSON returned by a model."""
-        match = re.search(r'(\{.*}|\[.*])', raw_data, re.DOTALL)
-        return match.group(1) if match else raw_data
-
-    def generate_single_chat(self, data_id, intent, case_type, personality, agent_mistake="none"):
-        """Calls LLM for one chat generation."""
+    def _prompt(self, intent, case_type, personality, agent_mistake):
         prompt = CHAT_GENERATION_PROMPT.format(
             intent=intent,
             case_type=case_type,
@@ -45,23 +64,21 @@ class ChatGenerator:
         )
         prompt += SPECIAL_REQUIREMENTS.get(case_type, "")
         prompt += INTENT_REQUIREMENTS.get(intent, "")
+        return prompt
 
-        response = ollama.generate(
+    def _generate(self, prompt, schema, use_cache=True):
+        request = dict(
             model=self.model,
             prompt=prompt,
-            format="json",
+            format=schema,
             options={"temperature": 0.7}
         )
+        if self.cache and use_cache:
+            return self.cache.generate(self.client, **request)
+        return self.client.generate(**request)
 
-        clean_json = self._clean_json(response["response"])
-        messages = json.loads(clean_json)
-
-        # Ignored question mistake handling
-        messages = messages.get("messages", []) if agent_mistake != "ignored_question" else [messages]
-
-        if len(messages) == 0:
-            raise Exception("Generated empty chat")
-
+    @staticmethod
+    def _chat_record(data_id, intent, case_type, personality, agent_mistake, messages):
         return {
             "id": data_id,
             "metadata": {
@@ -73,42 +90,272 @@ class ChatGenerator:
             "chat": messages
         }
 
+    def generate_single_chat(self, data_id, intent, case_type, personality, agent_mistake="none"):
+        """Calls LLM for one chat generation."""
+        response = self._generate(self._prompt(intent, case_type, personality, agent_mistake), CHAT_SCHEMA)
+
+        # Output is constrained by CHAT_SCHEMA, so anything that fails validation is a wasted call
+        labels = dict(stage="generate", model=self.model, intent=intent, case_type=case_type)
+        try:
+            messages = parse(response["response"], CHAT_SCHEMA)["messages"]
+        except ValueError:
+            self.telemetry.record(response, failed=True, **labels)
+            raise
+        self.telemetry.record(response, **labels)
+
+        return self._chat_record(data_id, intent, case_type, personality, agent_mistake, messages)
+
+    def generate_multi_chat(self, count, intent, case_type, personality, agent_mistake="none", max_calls=3):
+        """
+        Asks for `count` different dialogues of one label cell in a single call, so the
+        generation prompt is evaluated once for all of them. Every dialogue is validated
+        on its own: valid ones are kept and the shortfall is requested again, in at most
+        max_calls calls. Returns the chats (fewer than count if the calls ran out).
+        """
+        base_prompt = self._prompt(intent, case_type, personality, agent_mistake)
+        chats, seen = [], set()
+        for attempt in range(max_calls):
+            missing = count - len(chats)
+            if missing <= 0:
+                break
+            # A top-up has to reach the model: the cache would answer with the same invalid or repeated dialogues
+            response = self._generate(base_prompt + MULTI_CHAT_REQUIREMENTS.format(count=missing), MULTI_CHAT_SCHEMA,
+                                      use_cache=attempt == 0)
+
+            try:
+                dialogues = json.loads(response["response"])["dialogues"]
+            except (ValueError, KeyError, TypeError):
+                dialogues = []
+            valid = 0
+            for dialogue in dialogues if isinstance(dialogues, list) else []:
+                try:
+                    messages = validate(dialogue, CHAT_SCHEMA)["messages"]
+                except ValueError:
+                    continue
+                # Repeated dialogues count as missing
+                key = json.dumps(messages, sort_keys=True, ensure_ascii=False)
+                if key in seen or len(chats) == count:
+                    continue
+                seen.add(key)
+                chats.append(self._chat_record(None, intent, case_type, personality, agent_mistake, messages))
+                valid += 1
+
+            self.telemetry.record(response, failed=not valid, stage="generate", model=self.model, intent=intent,
+                                  case_type=case_type, dialogues=missing, valid_dialogues=valid)
+        return chats
+
+    def generate_chats(self, count, intent, case_type, personality, agent_mistake="none"):
+        """Generates count chats of one label cell: one call per chat, or shared calls with per_call > 1."""
+        if count == 1 and self.per_call == 1:
+            return [self.generate_single_chat(None, intent, case_type, personality, agent_mistake)]
+        return self.generate_multi_chat(count, intent, case_type, personality, agent_mistake)
+
+    def _remember_dataset(self):
+        """Stamps the dataset file the journal matches, so edits made to it between runs are noticed."""
+        stat = os.stat(self.path)
+        self.journal.write_meta({
+            "dataset": {"size": stat.st_size, "mtime": stat.st_mtime},
+            "journal_size": os.path.getsize(self.journal.path)
+        })
+
+    def _dataset_edited(self):
+        meta = self.journal.read_meta()
+        if meta is None:
+            # Journal written before datasets were stamped: nothing to compare against
+            return False
+        stat = os.stat(self.path)
+        return meta["dataset"] != {"size": stat.st_size, "mtime": stat.st_mtime}
+
     def save_data(self):
-        """Saves current dataset into a file."""
-        with open(self.path, 'w', encoding='utf-8') as f:
-            json.dump(self.dataset, f, indent=4, ensure_ascii=False)
+        """Exports the journal into the dataset file."""
+        self.journal.checkpoint()
+        self.journal.export(self.path)
+        self.stats.copy_to(self.path)
+        self._remember_dataset()
+        if self.index:
+            self.index.update()
+
+    def _seed_journal(self):
+        self.journal.seed(iter_chats(self.path))
+        # The journal was rewritten, so counters and index kept for it no longer apply
+        self.stats.reset()
+        if self.index:
+            self.index.reset()
+        self._remember_dataset()
 
     def load_dataset(self):
-        """Load dataset from existing file"""
-        if os.path.exists(self.path):
-            try:
-                with open(self.path, 'r', encoding='utf-8') as f:
-                    self.dataset = json.load(f)
-                self.current_id = max((chat["id"] for chat in self.dataset)) + 1
+        """
+        Resumes from the journal, migrating an existing dataset file on first use.
+        A dataset file edited since the last run (e.g. by `utils del_empty` or `merge`)
+        is loaded into the journal again instead of being overwritten by the next export.
+        """
+        try:
+            if not self.journal.exists() and os.path.exists(self.path):
+                self._seed_journal()
+                print(f"[*] Migrated {self.path} into journal {self.journal.path}")
+            elif self.journal.exists() and os.path.exists(self.path) and self._dataset_edited():
+                if os.path.getsize(self.journal.path) != self.journal.read_meta()["journal_size"]:
+                    print(f"[!] {self.path} was changed since the last run, and {self.journal.path} holds chats "
+                          f"that were never exported into it.")
+                    print(f"[!] Export the journal elsewhere (python -m src.utils export) or delete it, then rerun.")
+                    exit(1)
+                self._seed_journal()
+                print(f"[*] {self.path} was changed since the last run: reloaded it into {self.journal.path}")
+
+            self.current_id = self.journal.resume()
+            self.stats.update()
+            if self.current_id > 1:
                 print(f"[*] Resuming from ID {self.current_id}")
-            except Exception as e:
-                print(f"[!] Could not read existing file: {e}")
+        except Exception as e:
+            print(f"[!] Could not read existing file: {e}")
+
+    def _pick_labels(self, case_type=None, intent=None, personality=None, mistake=None):
+        """Fills missing labels with random choices."""
+        case_type_ = case_type if case_type is not None else random.choice(CASE_TYPES)
+        intent_ = intent if intent is not None else random.choice(INTENTS)
+        personality_ = personality if personality is not None else random.choice(PERSONALITIES)
+        mistake_ = (random.choice(AGENT_MISTAKES) if mistake is None else mistake)
+        mistake_ = mistake_ if case_type_ == "agent_mistake" else "none"
+        return intent_, case_type_, personality_, mistake_
 
     def generate_samples(self, n, case_type=None, intent=None, personality=None, mistake=None, checkpoint=5):
         """Generates specific samples or random in case of None"""
-        for _ in tqdm(range(n)):
-            case_type_ = case_type if case_type is not None else random.choice(CASE_TYPES)
-            intent_ = intent if intent is not None else random.choice(INTENTS)
-            personality_ = personality if personality is not None else random.choice(PERSONALITIES)
-            mistake_ = (random.choice(AGENT_MISTAKES) if mistake is None else mistake)
-            mistake_ = mistake_ if case_type_ == "agent_mistake" else "none"
+        # One call per label cell and per_call chats
+        calls = (
+            (self._pick_labels(case_type, intent, personality, mistake), min(self.per_call, n - i))
+            for i in range(0, n, self.per_call)
+        )
 
-            try:
-                chat_data = self.generate_single_chat(self.current_id, intent_, case_type_, personality_, mistake_)
-                self.dataset.append(chat_data)
-                self.current_id += 1
-            except Exception as e:
-                print(f"[!] Error at ID {self.current_id}: {e}")
-                continue
+        # IDs are assigned when results are collected, so they stay sequential
+        # even though up to self.workers requests run concurrently
+        results = bounded_map(
+            lambda call: self.generate_chats(call[1], *call[0]),
+            calls,
+            workers=self.workers
+        )
+
+        with tqdm(total=n) as progress:
+            for (_, count), chats, error in results:
+                progress.update(count)
+                progress.set_postfix({**self.telemetry.postfix(), "conc": current_workers(self.workers)})
+                if error is not None:
+                    print(f"[!] Error at ID {self.current_id}: {error}")
+                    continue
+                if len(chats) < count:
+                    print(f"[!] {count - len(chats)} of {count} dialogues missing at ID {self.current_id}")
+
+                for chat_data in chats:
+                    self._store_chat(chat_data, checkpoint)
+
+    def _store_chat(self, chat_data, checkpoint):
+        """Assigns the next ID and journals a finished chat."""
+        chat_data["id"] = self.current_id
+        self.journal.append(chat_data)
+        self.stats.add(chat_data)
+        self.stats.save()
+        self.dataset.append(chat_data)
+        self.current_id += 1
+
+        # Checkpoint
+        if checkpoint > 0 and self.current_id % checkpoint == 0:
+            self.journal.checkpoint()
+            if self.index:
+                self.index.update()
+
+    def _group_plan(self, plan):
+        """Groups a quota plan into (cell, count) calls of up to per_call chats, still round-robin across cells."""
+        counts = Counter(plan)
+        cells = list(dict.fromkeys(plan))
+        return [
+            (cell, min(self.per_call, counts[cell] - k))
+            for k in range(0, max(counts.values()), self.per_call)
+            for cell in cells if k < counts[cell]
+        ]
+
+    def generate_quota(self, scheduler, checkpoint=5, max_rounds=5):
+        """Generates only label cells that are below their target until all quotas are met."""
+        personalities = {p["type"]: p for p in PERSONALITIES}
+
+        for round_ in range(1, max_rounds + 1):
+            plan = scheduler.plan()
+            if not plan:
+                break
+            print(f"[*] Quota round {round_}: {len(plan)} chats missing in {len(scheduler.deficits())} cells")
+
+            results = bounded_map(
+                lambda call: self.generate_chats(call[1], call[0][0], call[0][1], personalities[call[0][3]], call[0][2]),
+                self._group_plan(plan),
+                workers=self.workers
+            )
+
+            # Failed cells are not recorded, so the next round requests them again
+            with tqdm(total=len(plan)) as progress:
+                for (cell, count), chats, error in results:
+                    progress.update(count)
+                    progress.set_postfix({**self.telemetry.postfix(), "conc": current_workers(self.workers)})
+                    if error is not None:
+                        print(f"[!] Error at ID {self.current_id} {cell}: {error}")
+                        continue
+
+                    for chat_data in chats:
+                        self._store_chat(chat_data, checkpoint)
+                        scheduler.record(cell)
+
+        remaining = scheduler.remaining()
+        if remaining:
+            print(f"[!] {remaining} chats still missing after {max_rounds} rounds")
+
+    def chats_per_gpu_second(self, chats):
+        """Chats per second of server time (Ollama total_duration) spent by this generator's model."""
+        server = self.telemetry.summary().get(self.model, {}).get("server_seconds")
+        return chats / server if server else None
 
-            # Checkpoint
-            if checkpoint > 0 and self.current_id % checkpoint == 0:
-                self.save_data()
+    def compare_per_call(self, n, case_type=None, intent=None, personality=None, mistake=None):
+        """
+        Generates n chats with one call per chat and n chats with per_call dialogues per call,
+        for the same label cells, and reports chats per GPU-second of both. Nothing is saved
+        and the response cache is bypassed.
+        """
+        cells = [self._pick_labels(case_type, intent, personality, mistake) for _ in range(0, n, self.per_call)]
+        modes = {
+            "single": [(cell, 1) for cell in cells for _ in range(self.per_call)][:n],
+            f"{self.per_call} per call": [(cell, min(self.per_call, n - i * self.per_call)) for i, cell in enumerate(cells)],
+        }
+        cache, telemetry, per_call = self.cache, self.telemetry, self.per_call
+        self.cache = None
+        report = {}
+
+        try:
+            for mode, calls in modes.items():
+                self.telemetry = Telemetry()
+                self.per_call = 1 if mode == "single" else per_call
+                start = time.perf_counter()
+                chats = sum(
+                    len(result) for _, result, error in tqdm(bounded_map(
+                        lambda call: self.generate_chats(call[1], *call[0]), calls, workers=self.workers
+                    ), total=len(calls), desc=mode) if error is None
+                )
+                summary = self.telemetry.summary().get(self.model, {})
+                report[mode] = {
+                    "chats": chats,
+                    "calls": summary.get("calls", 0),
+                    "gpu_seconds": summary.get("server_seconds", 0.0),
+                    "chats_per_gpu_second": self.chats_per_gpu_second(chats),
+                    "chats_per_sec": chats / (time.perf_counter() - start),
+                    "prompt_tokens_per_chat": summary.get("prompt_tokens", 0) / chats if chats else None,
+                }
+        finally:
+            self.cache, self.telemetry, self.per_call = cache, telemetry, per_call
+
+        for mode, r in report.items():
+            print(f"[*] {mode:<12} {r['chats']} chats in {r['calls']} calls, {r['gpu_seconds']:.1f} GPU-s: "
+                  f"{r['chats_per_gpu_second'] or 0:.3f} chats/GPU-s, {r['chats_per_sec']:.2f} chats/s, "
+                  f"{r['prompt_tokens_per_chat'] or 0:.0f} prompt tokens/chat")
+        single, multi = report.values()
+        if single["chats_per_gpu_second"] and multi["chats_per_gpu_second"]:
+            print(f"[+] {multi['chats_per_gpu_second'] / single['chats_per_gpu_second']:.2f}x chats per GPU-second "
+                  f"with {per_call} dialogues per call")
+        return report
 
     def run(self, samples_per_case=3, checkpoint=5):
         """Generator cycle."""
@@ -121,7 +368,7 @@ class ChatGenerator:
             self.generate_samples(samples_per_case, case_type, checkpoint=checkpoint)
 
         self.save_data()
-        print(f"[+] Done! Saved {len(self.dataset)} chats to {self.path}")
+        print(f"[+] Done! Generated {len(self.dataset)} chats, saved to {self.path}")
 
 
 if __name__ == "__main__":
@@ -134,8 +381,23 @@ if __name__ == "__main__":
     parser.add_argument("--file", type=str, default="dataset.json", help="Output file name")
     parser.add_argument("--samples", type=int, default=3,
                         help="Samples per case type (for run) or total (for specific generation)")
-    parser.add_argument("--checkpoint", type=int, default=5, help="Save every N samples")
+    parser.add_argument("--checkpoint", type=int, default=5, help="Update journal index every N samples")
     parser.add_argument("--model", type=str, default=MODEL, help="Model name")
+    parser.add_argument("--workers", type=int, default=1, help="Number of concurrent LLM requests")
+    parser.add_argument("--adaptive", action="store_true",
+                        help="Tune concurrency from observed latency and errors, starting at --workers")
+    parser.add_argument("--max-workers", type=int, default=16, help="Upper bound for --adaptive")
+    parser.add_argument("--cache", action="store_true",
+                        help="Serve repeated prompts from the LLM response cache (replays identical chats)")
+    parser.add_argument("--cache-size", type=int, default=512, help="Response cache size limit in MB")
+    parser.add_argument("--stream", action="store_true",
+                        help="Stream responses and cancel each request once a valid chat JSON is complete")
+    parser.add_argument("--index", action="store_true",
+                        help="Keep a label index of the journal up to date for 'python -m src.utils query'")
+    parser.add_argument("--per-call", type=int, default=1, metavar="M",
+                        help="Ask for M different dialogues of the same label cell in one LLM call")
+    parser.add_argument("--compare-per-call", type=int, metavar="N",
+                        help="Only compare chats per GPU-second of single-chat vs --per-call generation on N chats")
 
     # Specific generation overrides
     parser.add_argument("--intent", type=str, choices=INTENTS, help="Filter by specific intent")
@@ -143,22 +405,52 @@ if __name__ == "__main__":
     parser.add_argument("--mistake", type=str, choices=AGENT_MISTAKES, help="Filter by specific agent mistake")
     parser.add_argument("--personality", type=str, choices=[p["type"] for p in PERSONALITIES], help="Filter by personality type")
 
+    # Stratified generation
+    parser.add_argument("--quota", type=int,
+                        help="Fill every intent x case_type x mistake x personality cell (narrowed by the filters above) up to N chats")
+
     args = parser.parse_args()
 
     # Initialize generator
-    generator = ChatGenerator(model=args.model, filename=args.file)
+    cache = ResponseCache(get_data_path("llm_cache.sqlite"), args.cache_size * 1024 * 1024) if args.cache else None
+    workers = AdaptiveLimit(args.model, args.workers, args.max_workers) if args.adaptive else args.workers
+    generator = ChatGenerator(model=args.model, filename=args.file, workers=workers, cache=cache,
+                              index=args.index, stream=args.stream, per_call=args.per_call)
+    personality = next((p for p in PERSONALITIES if p["type"] == args.personality), None)
+    # Unreachable hosts are ejected from the pool before any work is sent to them
+    generator._check_connection()
+
+    if args.compare_per_call:
+        if args.per_call < 2:
+            parser.error("--compare-per-call needs --per-call M with M > 1")
+        generator.compare_per_call(args.compare_per_call, args.case_type, args.intent, personality, args.mistake)
+        generator.client.print_stats()
+        exit(0)
+
     generator.load_dataset()
 
-    if any([args.intent, args.case_type, args.mistake, args.personality]):
-        print(f"[*] Target generation: intent={args.intent}, case={args.case_type}, mistake={args.mistake}, personality={args.personality}")
+    if args.quota:
+        scheduler = QuotaScheduler.uniform(
+            args.quota,
+            generator.stats.distribution(cells=True),
+            intents=[args.intent] if args.intent else None,
+            case_types=[args.case_type] if args.case_type else None,
+            mistakes=[args.mistake] if args.mistake else None,
+            personalities=[args.personality] if args.personality else None
+        )
+        print(f"[*] Quota generation: {scheduler.remaining()} chats missing across {len(scheduler.targets)} cells")
 
-        personality = next((p for p in PERSONALITIES if p["type"] == args.personality), None)
+        generator.generate_quota(scheduler, checkpoint=args.checkpoint)
+        generator.save_data()
+        print(f"[+] Quota generation complete. Saved to data/{args.file}")
+    elif any([args.intent, args.case_type, args.mistake, args.personality]):
+        print(f"[*] Target generation: intent={args.intent}, case={args.case_type}, mistake={args.mistake}, personality={args.personality}")
 
         generator.generate_samples(
             n=args.samples,
             case_type=args.case_type,
             intent=args.intent,
-            personality=args.personality,
+            personality=personality,
             mistake=args.mistake,
             checkpoint=args.checkpoint
         )
@@ -169,3 +461,15 @@ if __name__ == "__main__":
             samples_per_case=args.samples,
             checkpoint=args.checkpoint
         )
+
+    if cache:
+        print(f"[*] Cache: {cache.stats()}")
+    rate = generator.chats_per_gpu_second(len(generator.dataset))
+    if rate:
+        print(f"[*] {len(generator.dataset)} chats, {rate:.3f} chats per GPU-second ({args.per_call} per call)")
+    generator.telemetry.print_summary()
+    generator.client.print_stats()
+    if args.adaptive:
+        workers.print_summary()
+    generator.telemetry.close()
+
@@ -0,0 +1,311 @@
+from src.utils import bounded_map, get_data_path
+from src.journal import DatasetJournal
+from src.cache import ResponseCache
+from src.telemetry import Telemetry
+from src.concurrency import AdaptiveLimit, current_workers
+from src.residency import ModelScheduler, KEEP_ALIVE
+from src.config import *
+from generate import ChatGenerator
+from evaluate_results import Evaluation, print_report, save_report
+from tqdm import tqdm
+import itertools
+import threading
+import argparse
+import tempfile
+import analyze
+import queue
+import time
+import os
+
+# Marks the end of a stage's output
+DONE = object()
+
+
+def drain(q):
+    """Yields items from a queue until the DONE marker."""
+    while True:
+        item = q.get()
+        if item is DONE:
+            return
+        yield item
+
+
+class Pipeline:
+    """
+    Generate -> analyze -> evaluate in one process.
+
+    Each generated chat is journaled and handed to analysis through a bounded
+    queue, analyzed chats go through a second bounded queue into a running
+    Evaluation. Every stage has its own number of concurrent LLM requests; a
+    full queue blocks the stage in front of it, so a slow stage throttles the
+    one feeding it instead of piling up chats in memory.
+
+    Analyzed chats are journaled to <output>.pipeline.jsonl, which is removed
+    once a run finishes without errors. Rerunning an interrupted run resumes it.
+    """
+
+    def __init__(self, generator, output_file, analyze_workers=1, queue_size=16, cache=None, cascade=None):
+        self.generator = generator
+        self.output_file = output_file
+        self.analyze_workers = analyze_workers
+        self.cache = cache
+        self.cascade = cascade
+        self.telemetry = Telemetry(os.path.splitext(output_file)[0] + ".metrics.jsonl")
+        self.journal = DatasetJournal(os.path.splitext(output_file)[0] + ".pipeline.jsonl")
+        self.evaluation = Evaluation()
+
+        self._generated = queue.Queue(maxsize=queue_size)
+        self._analyzed = queue.Queue(maxsize=queue_size)
+        self.errors = {"generate": 0, "analyze": 0}
+        # First chat ID of the run, None until the journal is opened
+        self.first_id = None
+
+    def _generate_stage(self, n, filters, checkpoint):
+        g = self.generator
+        labels = (g._pick_labels(**filters) for _ in range(n))
+        try:
+            for _, chat_data, error in bounded_map(
+                lambda spec: g.generate_single_chat(None, *spec), labels, workers=g.workers
+            ):
+                if error is not None:
+                    self.errors["generate"] += 1
+                    print(f"[!] Generation error: {error}")
+                    continue
+                g._store_chat(chat_data, checkpoint)
+                # Analysis gets its own copy; blocks while the analysis queue is full
+                self._generated.put(dict(chat_data))
+        finally:
+            self._generated.put(DONE)
+
+    def _analyze_stage(self, pending):
+        try:
+            for item, result, error in bounded_map(
+                lambda item: analyze.analyze_items([item], self.cache, self.telemetry, self.cascade),
+                itertools.chain(pending, drain(self._generated)),
+                workers=self.analyze_workers
+            ):
+                if error is not None:
+                    self.errors["analyze"] += 1
+                    print(f"[!] Analysis error at ID {item.get('id')}: {error}")
+                    continue
+                item["analysis"] = result[0][0]
+                self._analyzed.put(item)
+        finally:
+            self._analyzed.put(DONE)
+
+    def _open_journal(self, fresh):
+        """
+        Starts a new run or resumes the unfinished one. Returns the chats the run
+        generated but didn't analyze, or None if another run's journal is in the way.
+        """
+        g = self.generator
+        key = analyze.run_key(g.path, self.cascade)
+        if fresh:
+            self.journal.remove()
+        meta = self.journal.read_meta() or {}
+        if self.journal.exists() and meta.get("run_key") != key:
+            print(f"[!] {self.journal.path} holds an unfinished run with another dataset, model or prompt.")
+            print("[!] Rerun with --fresh to discard it.")
+            return None
+        if meta.get("run_key") != key:
+            meta = {"run_key": key, "first_id": g.current_id}
+            self.journal.write_meta(meta)
+        self.first_id = meta["first_id"]
+
+        self.journal.resume()
+        analyzed = set()
+        for item in self.journal:
+            analyzed.add(item["id"])
+            self.evaluation.add(item)
+        # Everything the run generated is in the dataset journal, analyzed or not
+        pending = [chat for chat in g.journal if chat["id"] >= self.first_id and chat["id"] not in analyzed]
+        if analyzed or pending:
+            print(f"[*] Resuming: {len(analyzed)} chats already analyzed, {len(pending)} waiting for analysis")
+        return pending
+
+    def run(self, n, filters=None, checkpoint=5, fresh=False):
+        """
+        Runs all stages for n new chats and returns the evaluation report.
+        Rerunning an interrupted run finishes it: chats it generated are analyzed
+        first, and only the rest of the n chats is generated.
+        """
+        self.generator.load_dataset()
+        pending = self._open_journal(fresh)
+        if pending is None:
+            return None
+        generated = self.generator.current_id - self.first_id
+        todo = max(0, n - generated)
+
+        stages = [
+            threading.Thread(target=self._generate_stage, args=(todo, filters or {}, checkpoint), daemon=True),
+            threading.Thread(target=self._analyze_stage, args=(pending,), daemon=True),
+        ]
+        for stage in stages:
+            stage.start()
+
+        # Evaluation runs on the main thread, so accuracy is live while generation is still going
+        with tqdm(total=self.evaluation.n + len(pending) + todo, initial=self.evaluation.n, unit="chat") as progress:
+            for item in drain(self._analyzed):
+                self.journal.append(item)
+                self.evaluation.add(item)
+                progress.update(1)
+                progress.set_postfix({
+                    **{task: f"{acc:.0%}" for task, acc in self.evaluation.accuracy().items()},
+                    "queued": f"{self._generated.qsize()}/{self._analyzed.qsize()}",
+                    "conc": f"{current_workers(self.generator.workers)}/{current_workers(self.analyze_workers)}",
+                })
+
+        for stage in stages:
+            stage.join()
+
+        self.generator.save_data()
+        self.journal.close()
+        self.journal.export(self.output_file, indent=analyze.OUTPUT_INDENT)
+        if any(self.errors.values()):
+            print("[!] Some chats failed; rerun the same command to finish the run")
+        else:
+            self.journal.remove()
+        return self.evaluation.report() if self.evaluation.n else None
+
+
+def load_seconds(*telemetries):
+    return sum(r["load_seconds"] for t in telemetries for r in t.summary().values())
+
+
+def compare_residency(n, model=MODEL, gen_workers=1, analyze_workers=1, queue_size=16, keep_alive=KEEP_ALIVE):
+    """
+    Runs the pipeline for n chats twice: with calls sent as the stages produce them,
+    and with a ModelScheduler batching them per model. Reports the model load time
+    of both runs. Everything is written to a temporary directory, without the cache.
+    """
+    client = analyze.CLIENT
+    report = {}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        try:
+            for mode in ("interleaved", "residency"):
+                generator = ChatGenerator(model=model, filename=os.path.join(tmp, f"{mode}.json"), workers=gen_workers)
+                scheduler = None
+                analyze.CLIENT = client
+                if mode == "residency":
+                    scheduler = ModelScheduler(generator.client, keep_alive)
+                    generator.client = scheduler.wrap(generator.client)
+                    analyze.CLIENT = scheduler.wrap(client)
+
+                pipeline = Pipeline(generator, os.path.join(tmp, f"{mode}_analyzed.json"), analyze_workers, queue_size)
+                start = time.perf_counter()
+                pipeline.run(n)
+                report[mode] = {
+                    "chats": pipeline.evaluation.n,
+                    "seconds": time.perf_counter() - start,
+                    # Preloads are not in the telemetry, their load time is counted by the scheduler
+                    "load_seconds": load_seconds(generator.telemetry, pipeline.telemetry) +
+                                    (scheduler.load_seconds if scheduler else 0.0),
+                    "switches": scheduler.switches if scheduler else None,
+                }
+                generator.telemetry.close()
+                pipeline.telemetry.close()
+        finally:
+            analyze.CLIENT = client
+
+    for mode, r in report.items():
+        switches = f", {r['switches']} model switches" if r["switches"] is not None else ""
+        print(f"[*] {mode:<12} {r['chats']} chats in {r['seconds']:.1f}s, {r['load_seconds']:.1f}s loading models{switches}")
+    saved = report["interleaved"]["load_seconds"] - report["residency"]["load_seconds"]
+    print(f"[+] Residency scheduling saved {saved:.1f}s of model loads "
+          f"({report['interleaved']['seconds'] - report['residency']['seconds']:.1f}s of wall time)")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Generate, analyze and evaluate chats in one streaming pipeline",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument("--samples", type=int, default=20, help="Number of chats to generate")
+    parser.add_argument("--file", type=str, default="dataset.json", help="Generated dataset file name")
+    parser.add_argument("--output", type=str, default="evaluated_test.json", help="Analyzed dataset file name")
+    parser.add_argument("--model", type=str, default=MODEL, help="Generation model name")
+    parser.add_argument("--gen-workers", type=int, default=1, help="Concurrent generation requests")
+    parser.add_argument("--analyze-workers", type=int, default=1, help="Concurrent analysis requests")
+    parser.add_argument("--queue-size", type=int, default=16, help="Chats buffered between stages")
+    parser.add_argument("--adaptive", action="store_true",
+                        help="Tune both stages' concurrency from observed latency, starting at their --*-workers")
+    parser.add_argument("--max-workers", type=int, default=16, help="Upper bound per stage for --adaptive")
+    parser.add_argument("--checkpoint", type=int, default=5, help="Update journal index every N samples")
+    parser.add_argument("--cascade", metavar="FAST_MODEL", help="Analyze with a fast model first (see analyze.py)")
+    parser.add_argument("--no-cache", action="store_true", help="Bypass the LLM response cache for analysis")
+    parser.add_argument("--json", help="Also write the evaluation report to this file")
+    parser.add_argument("--fresh", action="store_true",
+                        help="Discard an unfinished earlier run instead of resuming it")
+    parser.add_argument("--residency", action="store_true",
+                        help="Run generation and analysis calls in per-model batches, so a host that fits one "
+                             "model at a time doesn't reload weights on every switch")
+    parser.add_argument("--keep-alive", default=KEEP_ALIVE, help="How long Ollama keeps a model loaded (--residency)")
+    parser.add_argument("--compare-residency", type=int, metavar="N",
+                        help="Run N chats with and without --residency and compare model load time, then exit")
+
+    parser.add_argument("--intent", type=str, choices=INTENTS, help="Filter by specific intent")
+    parser.add_argument("--case_type", type=str, choices=CASE_TYPES, help="Filter by specific case type")
+    parser.add_argument("--mistake", type=str, choices=AGENT_MISTAKES, help="Filter by specific agent mistake")
+    parser.add_argument("--personality", type=str, choices=[p["type"] for p in PERSONALITIES], help="Filter by personality type")
+    args = parser.parse_args()
+
+    if args.compare_residency:
+        compare_residency(args.compare_residency, args.model, args.gen_workers, args.analyze_workers,
+                          args.queue_size, args.keep_alive)
+        exit(0)
+
+    cache = None if args.no_cache else ResponseCache(get_data_path("llm_cache.sqlite"))
+    gen_workers, analyze_workers = args.gen_workers, args.analyze_workers
+    if args.adaptive:
+        gen_workers = AdaptiveLimit(args.model, gen_workers, args.max_workers)
+        analyze_workers = AdaptiveLimit(args.cascade or analyze.MODEL, analyze_workers, args.max_workers)
+
+    generator = ChatGenerator(model=args.model, filename=args.file, workers=gen_workers)
+    generator._check_connection()
+    analyze.check_connection()
+    scheduler = None
+    if args.residency:
+        # Both stages share one schedule: a stage's calls wait while the other model's batch drains
+        scheduler = ModelScheduler(generator.client, args.keep_alive)
+        generator.client = scheduler.wrap(generator.client)
+        analyze.CLIENT = scheduler.wrap(analyze.CLIENT)
+    pipeline = Pipeline(
+        generator,
+        os.path.join("data", args.output),
+        analyze_workers=analyze_workers,
+        queue_size=args.queue_size,
+        cache=cache,
+        cascade=(args.cascade, analyze.MODEL) if args.cascade else None
+    )
+
+    filters = dict(
+        intent=args.intent,
+        case_type=args.case_type,
+        mistake=args.mistake,
+        personality=next((p for p in PERSONALITIES if p["type"] == args.personality), None)
+    )
+    report = pipeline.run(args.samples, filters, checkpoint=args.checkpoint, fresh=args.fresh)
+    if pipeline.first_id is None:
+        exit(1)
+
+    if report:
+        print_report(report)
+        if args.json:
+            save_report(report, args.json)
+    else:
+        print("[!] No chats made it through the pipeline.")
+
+    print(f"[*] Errors: {pipeline.errors}")
+    generator.telemetry.print_summary()
+    pipeline.telemetry.print_summary()
+    generator.client.print_stats()
+    analyze.CLIENT.print_stats()
+    if scheduler:
+        scheduler.print_summary()
+    if args.adaptive:
+        gen_workers.print_summary()
+        analyze_workers.print_summary()
+    generator.telemetry.close()
+    pipeline.telemetry.close()
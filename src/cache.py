@@ -0,0 +1,120 @@
+import threading
+import hashlib
+import sqlite3
+import json
+import time
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+
+class ResponseCache:
+    """
+    Content-addressed SQLite cache for LLM responses.
+
+    Entries are keyed by a hash of model, prompt and generation options and
+    evicted least-recently-used first once the stored text exceeds max_bytes.
+    """
+
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, response TEXT NOT NULL, "
+            "size INTEGER NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON responses(last_access)")
+        self._db.commit()
+        self.size = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    @staticmethod
+    def make_key(model, prompt, system=None, options=None, format=None, think=None, **transport):
+        """
+        Hashes everything that influences the model output. Transport settings
+        (keep_alive, stream, ...) are left out, so they don't split the cache.
+        """
+        request = {"model": model, "prompt": prompt, "options": options, "format": format}
+        # Only set when used, so keys of requests without them stay what they were
+        if system is not None:
+            request["system"] = system
+        if think is not None:
+            request["think"] = think
+        payload = json.dumps(request, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            row = self._db.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._db.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._db.commit()
+            return row[0]
+
+    def put(self, key, response):
+        size = len(response.encode("utf-8"))
+        with self._lock:
+            old = self._db.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, response, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, response, size, time.time())
+            )
+            self.size += size - (old[0] if old else 0)
+            self._evict()
+            self._db.commit()
+
+    def _evict(self):
+        """Drops least recently used entries until the cache fits into max_bytes."""
+        while self.size > self.max_bytes:
+            rows = self._db.execute(
+                "SELECT key, size FROM responses ORDER BY last_access LIMIT 64"
+            ).fetchall()
+            if not rows:
+                self.size = 0
+                return
+
+            for key, size in rows:
+                if self.size <= self.max_bytes:
+                    break
+                self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.size -= size
+
+    def generate(self, client, **kwargs):
+        """Drop-in for client.generate that serves repeated requests from the cache."""
+        if kwargs.get("stream"):
+            # The caller consumes the stream, there is no complete response to store or replay
+            return client.generate(**kwargs)
+
+        key = self.make_key(**kwargs)
+        cached = self.get(key)
+        if cached is not None:
+            return {"response": cached}
+
+        response = client.generate(**kwargs)
+        self.put(key, response["response"])
+        return response
+
+    def stats(self):
+        with self._lock:
+            entries = self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": entries,
+            "size_bytes": self.size
+        }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
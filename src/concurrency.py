@@ -0,0 +1,105 @@
+from collections import Counter
+import time
+
+
+class AdaptiveLimit:
+    """
+    AIMD concurrency limit for a request loop (used by bounded_map).
+
+    Completed calls are grouped into windows of at least `window` calls. After each
+    window the limit grows by one while throughput keeps improving, is cut by
+    `backoff` when a call failed or the mean latency rose above `tolerance`
+    times the best recent window, and is held otherwise. After `probe_every`
+    windows on hold it probes one step higher.
+    """
+
+    def __init__(self, name, initial=1, maximum=16, minimum=1, window=8, backoff=0.7, tolerance=1.5, gain=0.05,
+                 probe_every=10):
+        self.name = name
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.window = window
+        self.backoff = backoff
+        self.tolerance = tolerance
+        self.gain = gain
+        self.probe_every = probe_every
+        self._holds = 0
+
+        self._limit = float(min(self.maximum, max(self.minimum, initial)))
+        self._best_latency = None
+        self._best_throughput = 0.0
+        self._reset_window()
+        self.history = []
+
+    @property
+    def current(self):
+        return int(self._limit)
+
+    def _reset_window(self):
+        self._calls = 0
+        self._errors = 0
+        self._latency = 0.0
+        self._window_start = time.perf_counter()
+
+    def record(self, latency, failed=False):
+        """Feeds one completed call; adjusts the limit at the end of each window."""
+        self._calls += 1
+        self._errors += failed
+        self._latency += latency
+        # Windows span at least two rounds of in-flight calls
+        if self._calls < max(self.window, 2 * self.current):
+            return
+
+        elapsed = time.perf_counter() - self._window_start
+        throughput = self._calls / elapsed if elapsed else 0.0
+        latency = self._latency / self._calls
+        if self._best_latency is None or latency < self._best_latency or self._limit <= self.minimum:
+            # At the minimum limit latency is not caused by us: re-learn the baseline
+            self._best_latency = latency
+        before = self.current
+
+        if self._errors or latency > self._best_latency * self.tolerance:
+            # Past the server's parallelism: queued requests only add latency
+            self._limit = max(self.minimum, self._limit * self.backoff)
+            action = "backoff"
+            # The throughput reached at a higher limit is not reachable any more
+            self._best_throughput = throughput
+        elif throughput > self._best_throughput * (1 + self.gain):
+            self._limit = min(self.maximum, self._limit + 1)
+            self._best_throughput = throughput
+            action = "increase"
+        elif self._holds + 1 >= self.probe_every and self._limit < self.maximum:
+            # Capacity may have been freed since the last backoff: try one more
+            self._limit += 1
+            self._best_throughput = throughput
+            action = "probe"
+        else:
+            action = "hold"
+        self._holds = self._holds + 1 if action == "hold" else 0
+
+        self.history.append({
+            "limit": before, "next": self.current, "action": action, "throughput": throughput,
+            "latency": latency, "errors": self._errors
+        })
+        self._reset_window()
+
+    def settled(self):
+        """The limit used most often over the last half of the run."""
+        recent = [h["limit"] for h in self.history[len(self.history) // 2:]]
+        return Counter(recent).most_common(1)[0][0] if recent else self.current
+
+    def print_summary(self):
+        if not self.history:
+            print(f"[*] Concurrency for {self.name}: {self.current} (not enough calls to adapt)")
+            return
+        limits = [h["limit"] for h in self.history]
+        actions = Counter(h["action"] for h in self.history)
+        best = max(self.history, key=lambda h: h["throughput"])
+        print(f"[*] Concurrency for {self.name}: settled at {self.settled()} "
+              f"(range {min(limits)}-{max(limits)} over {len(self.history)} windows, {dict(actions)}; "
+              f"best {best['throughput']:.2f} calls/s at {best['limit']})")
+
+
+def current_workers(workers):
+    """Concurrency in effect for a fixed worker count or an AdaptiveLimit."""
+    return workers.current if isinstance(workers, AdaptiveLimit) else workers
@@ -0,0 +1,199 @@
+from collections import OrderedDict
+import bisect
+import struct
+import zlib
+import json
+import os
+
+# File layout: MAGIC, zlib frames of JSONL records, zlib JSON frame table, tail
+MAGIC = b"CHATZ\x00\x01\n"
+TAIL = struct.Struct("<QQ")
+FRAMES_EXT = ".jsonz"
+FRAME_ITEMS = 32
+
+
+def is_frames_path(path):
+    """Paths written as compressed frames instead of a JSON array."""
+    return path.endswith(FRAMES_EXT)
+
+
+def is_frame_file(path):
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+class FrameWriter:
+    """
+    Incrementally writes records as independently zlib-compressed frames of
+    `frame_items` JSONL lines, followed by a table of every frame's byte
+    range and first/last ID. Same interface as JsonArrayWriter.
+    """
+
+    def __init__(self, f, frame_items=FRAME_ITEMS, level=6, close_file=False):
+        self.f = f
+        self.frame_items = frame_items
+        self.level = level
+        self.close_file = close_file
+        self.count = 0
+        self.bytes_written = 0
+        self.frames = []
+        self._lines = []
+        self._ids = []
+        self._sorted = True
+        self._all_ids = []
+        self._emit(MAGIC)
+
+    def _emit(self, data):
+        self.f.write(data)
+        self.bytes_written += len(data)
+
+    def _flush_frame(self):
+        if not self._lines:
+            return
+        data = zlib.compress(b"".join(self._lines), self.level)
+        self.frames.append([self.bytes_written, len(data), self._ids[0], self._ids[-1], len(self._lines)])
+        self._all_ids.append(self._ids)
+        self._emit(data)
+        self._lines = []
+        self._ids = []
+
+    def write(self, record):
+        _id = record.get("id")
+        last = self._ids[-1] if self._ids else (self.frames[-1][3] if self.frames else None)
+        if not isinstance(_id, int) or (last is not None and _id <= last):
+            self._sorted = False
+
+        self._lines.append((json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8"))
+        self._ids.append(_id)
+        self.count += 1
+        if len(self._lines) >= self.frame_items:
+            self._flush_frame()
+
+    def close(self):
+        self._flush_frame()
+        table = {"total": self.count, "sorted": self._sorted, "frames": self.frames}
+        if not self._sorted:
+            # IDs are not increasing, so frames can't be found by bisection: list every ID's frame
+            table["ids"] = [[_id, i] for i, ids in enumerate(self._all_ids) for _id in ids]
+        data = zlib.compress(json.dumps(table).encode("utf-8"), self.level)
+        offset = self.bytes_written
+        self._emit(data)
+        self._emit(TAIL.pack(offset, len(data)) + MAGIC)
+        if self.close_file:
+            self.f.close()
+
+
+class FrameReader:
+    """
+    Random access to a frames file: a chat is fetched by ID by decompressing
+    only its frame. The last `cache_frames` decompressed frames are kept, so
+    reading neighbouring IDs does not decompress the same frame again.
+    """
+
+    def __init__(self, path, cache_frames=8):
+        self.path = path
+        self._f = open(path, 'rb')
+        self._f.seek(-(TAIL.size + len(MAGIC)), os.SEEK_END)
+        tail = self._f.read()
+        if tail[TAIL.size:] != MAGIC:
+            raise ValueError(f"{path} is not a complete frames file")
+        offset, length = TAIL.unpack(tail[:TAIL.size])
+        self._f.seek(offset)
+        table = json.loads(zlib.decompress(self._f.read(length)))
+
+        self.total = table["total"]
+        self.sorted = table["sorted"]
+        self.frames = table["frames"]
+        self._first_ids = [frame[2] for frame in self.frames]
+        self._frame_of = None if self.sorted else {_id: i for _id, i in table["ids"]}
+        self._cache = OrderedDict()
+        self.cache_frames = cache_frames
+
+    def __len__(self):
+        return self.total
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _read_frame(self, i):
+        offset, length = self.frames[i][:2]
+        self._f.seek(offset)
+        return zlib.decompress(self._f.read(length)).splitlines()
+
+    def _lines(self, i):
+        lines = self._cache.get(i)
+        if lines is None:
+            lines = self._cache[i] = self._read_frame(i)
+            if len(self._cache) > self.cache_frames:
+                self._cache.popitem(last=False)
+        else:
+            self._cache.move_to_end(i)
+        return lines
+
+    def _find_frame(self, chat_id):
+        if not self.sorted:
+            return self._frame_of.get(chat_id)
+        i = bisect.bisect_right(self._first_ids, chat_id) - 1
+        return i if i >= 0 and chat_id <= self.frames[i][3] else None
+
+    def get(self, chat_id):
+        """Returns the chat with this ID, or None."""
+        i = self._find_frame(chat_id)
+        if i is None:
+            return None
+        lines = self._lines(i)
+        _, _, first, last, count = self.frames[i]
+        if self.sorted and last - first + 1 == count:
+            # Consecutive IDs: the line position follows from the ID
+            return json.loads(lines[chat_id - first])
+        for line in lines:
+            chat = json.loads(line)
+            if chat.get("id") == chat_id:
+                return chat
+        return None
+
+    def range(self, first, last):
+        """Yields chats with first <= ID <= last, in file order."""
+        in_range = lambda _id: isinstance(_id, int) and first <= _id <= last
+        if not self.sorted:
+            for i in sorted({i for _id, i in self._frame_of.items() if in_range(_id)}):
+                for line in self._lines(i):
+                    chat = json.loads(line)
+                    if in_range(chat.get("id")):
+                        yield chat
+            return
+
+        start = max(0, bisect.bisect_right(self._first_ids, first) - 1)
+        for i in range(start, len(self.frames)):
+            if self.frames[i][2] > last:
+                return
+            for line in self._lines(i):
+                chat = json.loads(line)
+                if in_range(chat["id"]):
+                    yield chat
+
+    def iter_frames(self):
+        """Yields (frame offset, frame length, chat) for every chat, frame by frame."""
+        for i, (offset, length, *_) in enumerate(self.frames):
+            for line in self._read_frame(i):
+                yield offset, length, json.loads(line)
+
+    def __iter__(self):
+        for _, _, chat in self.iter_frames():
+            yield chat
+
+    def close(self):
+        self._f.close()
+
+
+def dump_frames(records, path, frame_items=FRAME_ITEMS):
+    """Writes records into a new frames file."""
+    with open(path, 'wb') as f:
+        writer = FrameWriter(f, frame_items)
+        for record in records:
+            writer.write(record)
+        writer.close()
+    return writer
@@ -0,0 +1,172 @@
+from src.utils import iter_chat_offsets, read_chat_at, dataset_format
+from src.frames import FrameReader
+import sqlite3
+import json
+import os
+
+# Query filters and the columns they map to
+FILTERS = {
+    "intent": "intent",
+    "case_type": "case_type",
+    "mistake": "mistake",
+    "personality": "personality_type",
+    "request_intent": "request_intent",
+    "satisfaction": "customer_satisfaction",
+    "quality_score": "quality_score",
+}
+
+
+class ChatIndex:
+    """
+    SQLite sidecar index (<dataset>.index.sqlite) over a JSON, JSONL or frames dataset.
+
+    Stores each chat's metadata labels, analysis labels and byte offset, so
+    subsets can be selected and fetched without parsing any other chat.
+    JSONL files (e.g. generation journals) are indexed incrementally: only
+    bytes appended since the last update are read.
+    """
+
+    def __init__(self, dataset_path):
+        self.dataset_path = dataset_path
+        self.path = dataset_path + ".index.sqlite"
+        self._db = sqlite3.connect(self.path)
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS chats (
+                id INTEGER PRIMARY KEY,
+                offset INTEGER NOT NULL,
+                length INTEGER NOT NULL,
+                intent TEXT,
+                case_type TEXT,
+                mistake TEXT,
+                personality_type TEXT,
+                request_intent TEXT,
+                customer_satisfaction TEXT,
+                quality_score INTEGER
+            );
+            CREATE TABLE IF NOT EXISTS agent_mistakes (id INTEGER NOT NULL, mistake TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT);
+            CREATE INDEX IF NOT EXISTS idx_labels ON chats(case_type, mistake, personality_type, intent);
+            CREATE INDEX IF NOT EXISTS idx_agent_mistakes ON agent_mistakes(mistake, id);
+        """)
+
+    def _state(self):
+        rows = self._db.execute("SELECT key, value FROM state").fetchall()
+        return {key: json.loads(value) for key, value in rows}
+
+    def _clear(self):
+        self._db.execute("DELETE FROM chats")
+        self._db.execute("DELETE FROM agent_mistakes")
+
+    def reset(self):
+        """Forgets everything indexed, e.g. after the dataset was rewritten in place."""
+        self._clear()
+        self._db.execute("DELETE FROM state")
+        self._db.commit()
+
+    def update(self):
+        """Brings the index up to date. Returns the number of newly indexed chats."""
+        if not os.path.exists(self.dataset_path):
+            return 0
+
+        stat = os.stat(self.dataset_path)
+        state = self._state()
+        indexed = state.get("indexed_bytes", 0)
+        jsonl = dataset_format(self.dataset_path) == "jsonl"
+
+        if state.get("size") == stat.st_size and state.get("mtime") == stat.st_mtime:
+            return 0
+
+        # A JSON array or frames file is rewritten as a whole, a JSONL file only grows
+        if not jsonl or stat.st_size < indexed:
+            self._clear()
+            indexed = 0
+
+        added = 0
+        rows, mistakes = [], []
+        for offset, length, item in self._iter_from(indexed, jsonl):
+            meta = item.get("metadata", {})
+            analysis = item.get("analysis", {})
+            rows.append((
+                item["id"], offset, length,
+                meta.get("intent"), meta.get("case_type"), meta.get("mistake"), meta.get("personality_type"),
+                analysis.get("request_intent"), analysis.get("customer_satisfaction"), analysis.get("quality_score")
+            ))
+            mistakes.extend((item["id"], m) for m in analysis.get("agent_mistakes", []))
+            added += 1
+
+        self._db.executemany("DELETE FROM agent_mistakes WHERE id = ?", [(row[0],) for row in rows])
+        self._db.executemany("INSERT OR REPLACE INTO chats VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        self._db.executemany("INSERT INTO agent_mistakes VALUES (?, ?)", mistakes)
+        self._db.executemany("INSERT OR REPLACE INTO state VALUES (?, ?)", [
+            ("size", json.dumps(stat.st_size)),
+            ("mtime", json.dumps(stat.st_mtime)),
+            ("indexed_bytes", json.dumps(self._end)),
+        ])
+        self._db.commit()
+        return added
+
+    def _iter_from(self, start, jsonl):
+        """Yields (offset, length, chat) and leaves the end of the last complete record in self._end."""
+        if not jsonl:
+            self._end = os.path.getsize(self.dataset_path)
+            yield from iter_chat_offsets(self.dataset_path)
+            return
+
+        # Only the appended tail of a JSONL file is read
+        with open(self.dataset_path, 'rb') as f:
+            f.seek(start)
+            offset = start
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # Partially written last line: picked up by the next update
+                    break
+                if line.strip():
+                    yield offset, len(line.rstrip(b"\r\n")), json.loads(line)
+                offset += len(line)
+        self._end = offset
+
+    def query(self, agent_mistake=None, limit=None, **filters):
+        """Returns (id, offset, length) rows matching the label filters."""
+        clauses, params = [], []
+        for name, value in filters.items():
+            if value is None:
+                continue
+            clauses.append(f"{FILTERS[name]} = ?")
+            params.append(value)
+        if agent_mistake:
+            clauses.append("id IN (SELECT id FROM agent_mistakes WHERE mistake = ?)")
+            params.append(agent_mistake)
+
+        sql = "SELECT id, offset, length FROM chats"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY id"
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+        return self._db.execute(sql, params).fetchall()
+
+    def group(self, *names):
+        """Returns {(label values): [(id, offset, length), ...]} grouped by the given filter names."""
+        columns = ", ".join(FILTERS[name] for name in names)
+        groups = {}
+        for row in self._db.execute(f"SELECT {columns}, id, offset, length FROM chats ORDER BY id"):
+            groups.setdefault(row[:len(names)], []).append(row[len(names):])
+        return groups
+
+    def count(self, **filters):
+        return len(self.query(**filters))
+
+    def fetch(self, rows):
+        """Yields full chats for rows returned by query(), reading only their bytes (or frames)."""
+        if dataset_format(self.dataset_path) == "frames":
+            with FrameReader(self.dataset_path) as reader:
+                for _id, _, _ in rows:
+                    yield reader.get(_id)
+            return
+
+        with open(self.dataset_path, 'rb') as f:
+            for _, offset, length in rows:
+                yield read_chat_at(f, offset, length)
+
+    def close(self):
+        self._db.close()
@@ -0,0 +1,234 @@
+from src.frames import FrameWriter, is_frames_path
+import itertools
+import json
+import os
+
+TAIL_BLOCK_SIZE = 4096
+
+
+class JsonArrayWriter:
+    """
+    Incrementally writes records as an indented JSON array.
+    Output is byte-identical to json.dump(records, f, indent=indent, ensure_ascii=False).
+    """
+
+    def __init__(self, f, indent=4, close_file=False):
+        self.f = f
+        self.pad = " " * indent
+        self.indent = indent
+        self.close_file = close_file
+        self.count = 0
+        self.bytes_written = 0
+
+    def _emit(self, text):
+        self.f.write(text)
+        self.bytes_written += len(text.encode("utf-8"))
+
+    def write(self, record):
+        body = json.dumps(record, indent=self.indent, ensure_ascii=False)
+        self._emit(("[\n" if self.count == 0 else ",\n") + self.pad + body.replace("\n", "\n" + self.pad))
+        self.count += 1
+
+    def close(self):
+        self._emit("[]" if self.count == 0 else "\n]")
+        if self.close_file:
+            self.f.close()
+
+
+def dump_json_array(records, f, indent=4):
+    """Streams records into f as a JSON array."""
+    writer = JsonArrayWriter(f, indent)
+    for record in records:
+        writer.write(record)
+    writer.close()
+
+
+def open_dataset_writer(path, frames=None, indent=4):
+    """
+    Opens a dataset file for incremental writing: compressed frames (src/frames.py)
+    for *.jsonz paths, an indented JSON array otherwise. close() also closes the file.
+    """
+    if frames is None:
+        frames = is_frames_path(path)
+    if frames:
+        return FrameWriter(open(path, 'wb'), close_file=True)
+    return JsonArrayWriter(open(path, 'w', encoding='utf-8'), indent, close_file=True)
+
+
+def dump_dataset(records, path, frames=None, indent=4):
+    """Writes records into a dataset file in the format chosen by open_dataset_writer."""
+    writer = open_dataset_writer(path, frames, indent)
+    for record in records:
+        writer.write(record)
+    writer.close()
+    return writer
+
+
+def read_last_line(path):
+    """Reads the last complete line of a file without scanning it from the start."""
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        end = f.tell()
+        pos = end
+        buffer = b""
+
+        while pos > 0:
+            step = min(TAIL_BLOCK_SIZE, pos)
+            pos -= step
+            f.seek(pos)
+            buffer = f.read(step) + buffer
+            lines = buffer.rstrip(b"\n").split(b"\n")
+            if len(lines) > 1 or pos == 0:
+                return lines[-1].decode("utf-8") if lines[-1] else None
+
+    return None
+
+
+class DatasetJournal:
+    """
+    Append-only JSONL journal of generated chats.
+
+    Every chat is written as one line and fsynced, so a crash loses at most the
+    chat in flight. A small sidecar index (<journal>.idx) remembers the last ID
+    and journal size, so resuming never has to parse the journal itself.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.index_path = path + ".idx"
+        self.meta_path = path + ".meta"
+        self.last_id = 0
+        self._file = None
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def _read_index(self):
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        # Index is only trusted if nothing was appended after it was written
+        if index.get("size") != os.path.getsize(self.path):
+            return None
+        return index
+
+    def _write_index(self):
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                "size": os.path.getsize(self.path),
+                "last_id": self.last_id
+            }, f)
+        os.replace(tmp_path, self.index_path)
+
+    def _repair_tail(self):
+        """Drops a partially written last line left by a crash."""
+        with open(self.path, 'rb+') as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            if size == 0:
+                return
+            f.seek(size - 1)
+            if f.read(1) == b"\n":
+                return
+
+            pos = size
+            while pos > 0:
+                step = min(TAIL_BLOCK_SIZE, pos)
+                pos -= step
+                f.seek(pos)
+                cut = f.read(step).rfind(b"\n")
+                if cut != -1:
+                    f.truncate(pos + cut + 1)
+                    return
+            f.truncate(0)
+
+    def resume(self):
+        """Returns the next free ID, reading only the sidecar index or the journal tail."""
+        if not self.exists():
+            return 1
+
+        index = self._read_index()
+        if index is not None:
+            self.last_id = index.get("last_id", 0)
+            return self.last_id + 1
+
+        self._repair_tail()
+        last_line = read_last_line(self.path)
+        self.last_id = json.loads(last_line)["id"] if last_line else 0
+        return self.last_id + 1
+
+    def seed(self, records):
+        """Initializes the journal from already existing records."""
+        with open(self.path, 'w', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                self.last_id = max(self.last_id, record["id"])
+            f.flush()
+            os.fsync(f.fileno())
+        self._write_index()
+
+    def append(self, record):
+        """Appends one record and forces it to disk."""
+        if self._file is None:
+            self._file = open(self.path, 'a', encoding='utf-8')
+
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.last_id = record["id"]
+
+    def checkpoint(self):
+        """Persists the sidecar index."""
+        if self._file is not None or self.exists():
+            self._write_index()
+
+    def close(self):
+        if self._file is not None:
+            self._write_index()
+            self._file.close()
+            self._file = None
+
+    def __iter__(self):
+        if not self.exists():
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+
+    def read_meta(self):
+        """Returns what the writer of the journal stored with write_meta(), or None."""
+        try:
+            with open(self.meta_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def write_meta(self, meta):
+        with open(self.meta_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+
+    def remove(self):
+        """Deletes the journal together with its index and metadata."""
+        self.close()
+        for path in (self.path, self.index_path, self.meta_path):
+            if os.path.exists(path):
+                os.remove(path)
+        self.last_id = 0
+
+    def export(self, output_path, extra=(), indent=4):
+        """
+        Compacts the journal into the regular indented JSON array format, or frames for *.jsonz.
+        Records in `extra` are written after the journaled ones.
+        """
+        if self._file is not None:
+            self._file.flush()
+
+        tmp_path = output_path + ".tmp"
+        dump_dataset(itertools.chain(self, extra), tmp_path, frames=is_frames_path(output_path), indent=indent)
+        os.replace(tmp_path, output_path)
@@ -0,0 +1,353 @@
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from datetime import datetime, timezone
+import threading
+import argparse
+import random
+import json
+import time
+import re
+
+INTENTS = ["payment problems", "technical errors", "account access", "questions about the tariff", "refund"]
+SATISFACTION = ["satisfied", "neutral", "unsatisfied"]
+MISTAKES = ["no_resolution", "rude_tone", "ignored_question"]
+
+CUSTOMER_LINES = [
+    "Hi, I was charged twice for my subscription this month.",
+    "The app keeps crashing every time I open the settings page.",
+    "I can't log in, the 2FA code never arrives.",
+    "I'd like a refund for the plan I cancelled last week.",
+    "ok thx, but it still doesnt work tbh",
+]
+AGENT_LINES = [
+    "I'm sorry to hear that. Could you share the last four digits of the card?",
+    "Thanks for the details. Please try reinstalling the app and let me know.",
+    "I have reset your 2FA settings, a new code should arrive shortly.",
+    "I have issued the refund, it should appear within 5 business days.",
+    "Is there anything else I can help you with today?",
+]
+
+
+def estimate_tokens(text):
+    return max(1, len(text) // 4)
+
+
+def merge_chunks(chunks):
+    """Collapses streamed chunks into one non-streamed response."""
+    merged = dict(chunks[-1])
+    for field in ("response", "thinking"):
+        text = "".join(c.get(field, "") for c in chunks)
+        if text or field == "response":
+            merged[field] = text
+    return merged
+
+
+class MockOllamaServer:
+    """
+    Local stand-in for an Ollama server speaking the /api/generate protocol.
+
+    Latency is modelled as model load + prompt eval + decode, with the number
+    of concurrently served requests capped like OLLAMA_NUM_PARALLEL. Errors
+    and malformed JSON are injected at configurable rates. Thinking tokens
+    before analysis payloads and whitespace tokens after it can be added to mimic
+    models that overrun the JSON answer.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, token_rate=200.0, prompt_rate=2000.0,
+                 load_latency=0.0, error_rate=0.0, malformed_rate=0.0, parallel=4, max_loaded=1, seed=None,
+                 think_tokens=0, trailing_tokens=0):
+        self.latency = latency
+        self.token_rate = token_rate
+        self.prompt_rate = prompt_rate
+        self.load_latency = load_latency
+        self.error_rate = error_rate
+        self.malformed_rate = malformed_rate
+        self.max_loaded = max_loaded
+        self.think_tokens = think_tokens
+        self.trailing_tokens = trailing_tokens
+        self.random = random.Random(seed)
+
+        self._slots = threading.Semaphore(parallel)
+        self._lock = threading.Lock()
+        self._loaded = []
+        self.reset()
+
+        self._httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def reset(self):
+        with self._lock:
+            self._stats = {"requests": 0, "errors": 0, "malformed": 0, "loads": 0, "latencies": [],
+                           "decoded_tokens": 0, "cancelled_tokens": 0}
+
+    def stats(self):
+        with self._lock:
+            return {**self._stats, "latencies": list(self._stats["latencies"]), "loaded": list(self._loaded)}
+
+    # ------------------------------------------------------------
+    # Simulation
+    # ------------------------------------------------------------
+
+    def _load(self, model):
+        """Returns load time in seconds, evicting the least recently used model if needed."""
+        with self._lock:
+            if model in self._loaded:
+                self._loaded.remove(model)
+                self._loaded.append(model)
+                return 0.0
+            self._loaded.append(model)
+            del self._loaded[:-self.max_loaded]
+            self._stats["loads"] += 1
+        return self.load_latency
+
+    def _chat_payload(self):
+        messages = []
+        for i in range(self.random.randint(3, 10)):
+            role, lines = ("customer", CUSTOMER_LINES) if i % 2 == 0 else ("agent", AGENT_LINES)
+            messages.append({"role": role, "text": self.random.choice(lines)})
+        return {"messages": messages}
+
+    def _analysis_payload(self, confidence=False):
+        payload = {
+            "reasoning": "The agent addressed the request.",
+            "request_intent": self.random.choice(INTENTS),
+            "customer_satisfaction": self.random.choice(SATISFACTION),
+            "agent_mistakes": self.random.sample(MISTAKES, self.random.randint(0, 1))
+        }
+        if confidence:
+            payload["confidence"] = self.random.choices(["high", "medium", "low"], weights=[7, 2, 1])[0]
+        return payload
+
+    def _payload(self, prompt):
+        ids = re.findall(r"DIALOGUE ID (\S+?):", prompt)
+        if ids:
+            return {"results": [{"id": _id, **self._analysis_payload()} for _id in ids]}
+        if "QA auditor" in prompt:
+            return self._analysis_payload(confidence='"confidence"' in prompt)
+        count = re.search(r"Write (\d+) different dialogues", prompt)
+        if count:
+            return {"dialogues": [self._chat_payload() for _ in range(int(count.group(1)))]}
+        return self._chat_payload()
+
+    def _pieces(self, text):
+        return [text[i:i + 4] for i in range(0, len(text), 4)]
+
+    def generate(self, request):
+        """
+        Returns (status, iterator of response chunks) for one /api/generate call.
+        Chunks are produced at token_rate; closing the iterator early (client
+        disconnect) counts the tokens that were never decoded as cancelled.
+        """
+        model = request.get("model", "")
+        prompt = request.get("prompt", "")
+
+        self._slots.acquire()
+        start = time.perf_counter()
+        load = self._load(model)
+
+        with self._lock:
+            self._stats["requests"] += 1
+            fail = self.random.random() < self.error_rate
+            malformed = not fail and self.random.random() < self.malformed_rate
+
+        if not prompt and not fail:
+            # Like Ollama, a request without a prompt only loads the model
+            return 200, self._loaded_only(model, start, load, request.get("keep_alive"))
+
+        if fail:
+            time.sleep(self.latency)
+            with self._lock:
+                self._stats["errors"] += 1
+                self._stats["latencies"].append(time.perf_counter() - start)
+            self._slots.release()
+            return 500, iter([{"error": "mock server error"}])
+
+        text = json.dumps(self._payload(prompt), ensure_ascii=False)
+        if malformed:
+            text = text[:len(text) // 2]
+            with self._lock:
+                self._stats["malformed"] += 1
+
+        # The analysis model thinks first: in a separate field with think=true, inline otherwise
+        think = request.get("think")
+        thought = self._pieces("Let me look at the dialogue. " * self.think_tokens)[:self.think_tokens]
+        if think is False or "QA auditor" not in prompt:
+            thought = []
+        # Models that keep decoding whitespace after the JSON is closed
+        tokens = ([("thinking", p) for p in thought] if think else
+                  [("response", p) for p in (["<think>"] + thought + ["</think>"] if thought else [])])
+        tokens += [("response", p) for p in self._pieces(text) + ["\n"] * self.trailing_tokens]
+
+        prompt_tokens = estimate_tokens(prompt)
+        prompt_eval = prompt_tokens / self.prompt_rate
+        created_at = datetime.now(timezone.utc).isoformat()
+        return 200, self._decode(model, created_at, tokens, start, load, prompt_tokens, prompt_eval,
+                                 request.get("keep_alive"))
+
+    def _unload(self, model):
+        with self._lock:
+            if model in self._loaded:
+                self._loaded.remove(model)
+
+    def _loaded_only(self, model, start, load, keep_alive):
+        try:
+            time.sleep(load)
+            yield {
+                "model": model,
+                "created_at": datetime.now(timezone.utc).isoformat(),
+                "response": "",
+                "done": True,
+                "done_reason": "unload" if keep_alive == 0 else "load",
+                "total_duration": int((time.perf_counter() - start) * 1e9),
+                "load_duration": int(load * 1e9),
+            }
+        finally:
+            if keep_alive == 0:
+                self._unload(model)
+            self._slots.release()
+
+    def _decode(self, model, created_at, tokens, start, load, prompt_tokens, prompt_eval, keep_alive=None):
+        sent = 0
+        try:
+            time.sleep(self.latency + load + prompt_eval)
+            decode_start = time.perf_counter()
+            for field, piece in tokens:
+                time.sleep(1 / self.token_rate)
+                sent += 1
+                yield {"model": model, "created_at": created_at, field: piece, "done": False}
+
+            total = time.perf_counter() - start
+            yield {
+                "model": model,
+                "created_at": created_at,
+                "response": "",
+                "done": True,
+                "done_reason": "stop",
+                "total_duration": int(total * 1e9),
+                "load_duration": int(load * 1e9),
+                "prompt_eval_count": prompt_tokens,
+                "prompt_eval_duration": int(prompt_eval * 1e9),
+                "eval_count": len(tokens),
+                "eval_duration": int((time.perf_counter() - decode_start) * 1e9),
+            }
+        finally:
+            with self._lock:
+                self._stats["latencies"].append(time.perf_counter() - start)
+                self._stats["decoded_tokens"] += sent
+                self._stats["cancelled_tokens"] += len(tokens) - sent
+            if keep_alive == 0:
+                self._unload(model)
+            self._slots.release()
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status, chunks):
+                body = json.dumps(chunks[0]).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _stream(self, chunks):
+                """Writes chunks as they are decoded; stops decoding when the client disconnects."""
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                self.close_connection = True
+                try:
+                    for chunk in chunks:
+                        self.wfile.write((json.dumps(chunk) + "\n").encode("utf-8"))
+                        self.wfile.flush()
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+                finally:
+                    chunks.close()
+
+            def do_GET(self):
+                if self.path == "/api/tags":
+                    models = [{"name": m, "model": m} for m in server.stats()["loaded"]]
+                    self._send(200, [{"models": models}])
+                elif self.path == "/api/ps":
+                    models = [{"name": m, "model": m, "size_vram": 0} for m in server.stats()["loaded"]]
+                    self._send(200, [{"models": models}])
+                elif self.path == "/_stats":
+                    self._send(200, [server.stats()])
+                else:
+                    self._send(404, [{"error": "not found"}])
+
+            def do_HEAD(self):
+                self.send_response(200)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                request = json.loads(self.rfile.read(length) or b"{}")
+
+                if self.path == "/api/generate":
+                    status, chunks = server.generate(request)
+                    if status != 200:
+                        self._send(status, list(chunks))
+                    elif request.get("stream", True):
+                        self._stream(chunks)
+                    else:
+                        self._send(status, [merge_chunks(list(chunks))])
+                elif self.path == "/_reset":
+                    server.reset()
+                    self._send(200, [{}])
+                else:
+                    self._send(404, [{"error": "not found"}])
+
+        return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mock Ollama server for offline benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--latency", type=float, default=0.0, help="Fixed per-request latency in seconds")
+    parser.add_argument("--token-rate", type=float, default=200.0, help="Decode tokens per second")
+    parser.add_argument("--prompt-rate", type=float, default=2000.0, help="Prompt eval tokens per second")
+    parser.add_argument("--load-latency", type=float, default=0.0, help="Seconds to load a non-resident model")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with HTTP 500")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="Share of responses with truncated JSON")
+    parser.add_argument("--parallel", type=int, default=4, help="Requests served concurrently (OLLAMA_NUM_PARALLEL)")
+    parser.add_argument("--max-loaded", type=int, default=1, help="Models resident at once (OLLAMA_MAX_LOADED_MODELS)")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--think-tokens", type=int, default=0, help="Thinking tokens decoded before analysis payloads")
+    parser.add_argument("--trailing-tokens", type=int, default=0, help="Whitespace tokens decoded after the payload")
+    args = parser.parse_args()
+
+    mock = MockOllamaServer(
+        args.host, args.port, args.latency, args.token_rate, args.prompt_rate, args.load_latency,
+        args.error_rate, args.malformed_rate, args.parallel, args.max_loaded, args.seed,
+        args.think_tokens, args.trailing_tokens
+    )
+    print(f"[+] Mock Ollama listening on {mock.url}")
+    try:
+        mock._httpd.serve_forever()
+    except KeyboardInterrupt:
+        mock._httpd.server_close()
@@ -0,0 +1,178 @@
+import threading
+import ollama
+import httpx
+import time
+
+HOST_ERRORS = (ConnectionError, httpx.TransportError)
+
+
+class PooledHost:
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.client = ollama.Client(host=endpoint)
+        self.in_flight = 0
+        self.healthy = True
+        self.ejected_at = 0.0
+        self.calls = 0
+        self.errors = 0
+        self.busy_seconds = 0.0
+
+
+class ClientPool:
+    """
+    Spreads Ollama requests over several hosts.
+
+    Each request goes to the healthy host with the fewest in-flight calls.
+    Hosts that fail a health check (check(), run by the scripts at startup) or
+    a request with a connection error are ejected and re-probed every
+    `recheck_interval` seconds. The last healthy host is never ejected: its
+    failed request raises instead, and the next request tries it again. The
+    pool exposes the same generate()/list()/ps() calls as ollama.Client, so it
+    can be used in its place.
+    """
+
+    def __init__(self, endpoints, recheck_interval=30.0):
+        self.hosts = [PooledHost(endpoint) for endpoint in endpoints]
+        self.recheck_interval = recheck_interval
+        self._lock = threading.Lock()
+        self._started = time.perf_counter()
+
+    @property
+    def endpoint(self):
+        return ", ".join(host.endpoint for host in self.hosts)
+
+    def _check_host(self, host):
+        try:
+            host.client.list()
+        except Exception:
+            return False
+        return True
+
+    def check(self):
+        """Health-checks every host. Returns the number of healthy hosts."""
+        for host in self.hosts:
+            healthy = self._check_host(host)
+            with self._lock:
+                host.healthy = healthy
+                host.ejected_at = 0.0 if healthy else time.monotonic()
+        return sum(host.healthy for host in self.hosts)
+
+    def _recheck_ejected(self, force=False):
+        now = time.monotonic()
+        with self._lock:
+            due = [h for h in self.hosts
+                   if not h.healthy and (force or now - h.ejected_at >= self.recheck_interval)]
+            for host in due:
+                # Push the next probe forward so concurrent callers don't probe the same host
+                host.ejected_at = now
+
+        for host in due:
+            if self._check_host(host):
+                with self._lock:
+                    host.healthy = True
+                print(f"[+] Ollama host {host.endpoint} is back in the pool")
+
+    def _acquire(self, exclude):
+        with self._lock:
+            candidates = [h for h in self.hosts if h.healthy and h not in exclude]
+            if not candidates:
+                return None
+            host = min(candidates, key=lambda h: (h.in_flight, h.calls))
+            host.in_flight += 1
+            return host
+
+    def _eject(self, host):
+        """Takes a failed host out of the pool. Returns False if it is the last healthy one, which stays."""
+        with self._lock:
+            if host.healthy:
+                if sum(h.healthy for h in self.hosts) == 1:
+                    return False
+                host.healthy = False
+                host.ejected_at = time.monotonic()
+                print(f"[!] Ollama host {host.endpoint} ejected from the pool")
+        return True
+
+    def generate(self, **kwargs):
+        """Routes one generate call, failing over to other hosts on connection errors."""
+        self._recheck_ejected()
+        tried = set()
+
+        while True:
+            host = self._acquire(tried)
+            if host is None and not tried:
+                # Every host was ejected by health checks: probe them now instead of failing until the next recheck
+                self._recheck_ejected(force=True)
+                host = self._acquire(tried)
+            if host is None:
+                raise ConnectionError(f"No healthy Ollama host available ({self.endpoint})")
+            tried.add(host)
+
+            start = time.perf_counter()
+            streaming = False
+            try:
+                response = host.client.generate(**kwargs)
+                if kwargs.get("stream"):
+                    # A stream connects lazily, so connection errors surface on the first chunk
+                    first = next(response)
+                    streaming = True
+                    return self._relay(host, start, first, response)
+                return response
+            except HOST_ERRORS:
+                with self._lock:
+                    host.errors += 1
+                if not self._eject(host):
+                    raise
+            except Exception:
+                with self._lock:
+                    host.errors += 1
+                raise
+            finally:
+                if not streaming:
+                    self._release(host, start)
+
+    def _release(self, host, start):
+        with self._lock:
+            host.in_flight -= 1
+            host.calls += 1
+            host.busy_seconds += time.perf_counter() - start
+
+    def _relay(self, host, start, first, stream):
+        """Yields a streamed response; the host stays busy until the stream is consumed or closed."""
+        try:
+            yield first
+            yield from stream
+        finally:
+            stream.close()
+            self._release(host, start)
+
+    def list(self):
+        """Mirrors ollama.Client.list on the first healthy host; raises if none is reachable."""
+        if not self.check():
+            raise ConnectionError(f"No healthy Ollama host available ({self.endpoint})")
+        return next(h for h in self.hosts if h.healthy).client.list()
+
+    def ps(self):
+        """Mirrors ollama.Client.ps (models loaded in memory) on the first healthy host."""
+        if not self.check():
+            raise ConnectionError(f"No healthy Ollama host available ({self.endpoint})")
+        return next(h for h in self.hosts if h.healthy).client.ps()
+
+    def stats(self):
+        elapsed = time.perf_counter() - self._started
+        with self._lock:
+            return {
+                host.endpoint: {
+                    "healthy": host.healthy,
+                    "calls": host.calls,
+                    "errors": host.errors,
+                    "calls_per_sec": host.calls / elapsed if elapsed else 0.0,
+                    "avg_latency": host.busy_seconds / host.calls if host.calls else 0.0
+                }
+                for host in self.hosts
+            }
+
+    def print_stats(self):
+        print("\n--- Ollama hosts ---")
+        for endpoint, s in self.stats().items():
+            print(f"{'[+]' if s['healthy'] else '[!]'} {endpoint}: {s['calls']} calls, {s['errors']} errors, "
+                  f"{s['calls_per_sec']:.2f} calls/s, avg {s['avg_latency']:.2f}s")
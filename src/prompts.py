@@ -10,7 +10,7 @@ Requirements:
 - It is forbidden to put {mistake} and other system indicators into dialogs.
 - Use natural language with occasional typos and slang depending on customer personality, but don't over do it.
 - Generate 3-10 messages for chat 
-IMPORTANT: Return ONLY JSON list of messages. Use ONLY "role" and "text" fields.
+IMPORTANT: Return ONLY JSON object with "messages" list. Use ONLY "role" ("customer" or "agent") and "text" fields for messages.
 """
 
 SPECIAL_REQUIREMENTS = {
@@ -68,4 +68,9 @@ INTENT_REQUIREMENTS = {
     "tariff_refund": """
         INTENT SCENARIO: Refund requests or plan cancellations.
         """
-}
\ No newline at end of file
+}
+
+MULTI_CHAT_REQUIREMENTS = """
+\nMULTIPLE DIALOGUES: Write {count} different dialogues for this same setup. Vary the greeting, wording, details and length between them.
+IMPORTANT: Return ONLY JSON object with "dialogues" list of {count} objects, each with its own "messages" list as described above.
+"""
@@ -0,0 +1,77 @@
+from src.utils import label_cell
+from src.config import *
+import random
+
+
+def label_grid(intents=None, case_types=None, mistakes=None, personalities=None):
+    """
+    Lists every valid label cell as (intent, case_type, mistake, personality_type).
+    Mistakes only vary for agent_mistake chats, all other case types use "none".
+    """
+    intents = intents or INTENTS
+    case_types = case_types or CASE_TYPES
+    mistakes = mistakes or AGENT_MISTAKES
+    personalities = personalities or [p["type"] for p in PERSONALITIES]
+
+    grid = []
+    for intent in intents:
+        for case_type in case_types:
+            for mistake in (mistakes if case_type == "agent_mistake" else ["none"]):
+                for personality in personalities:
+                    grid.append((intent, case_type, mistake, personality))
+    return grid
+
+
+class QuotaScheduler:
+    """
+    Plans generation so that only label cells below their target are requested.
+
+    Counts come from a distribution with cells=True (LabelStats.distribution or
+    labels_distribution). A failed generation simply isn't recorded, so its
+    cell shows up again in the next plan().
+    """
+
+    def __init__(self, targets, distribution=None):
+        self.targets = {cell: n for cell, n in targets.items() if n > 0}
+        cells = (distribution or {}).get("cells", {})
+        self.counts = {cell: cells.get(self.key(cell), 0) for cell in self.targets}
+
+    @classmethod
+    def uniform(cls, per_cell, distribution=None, **grid_filters):
+        """Targets the same number of chats in every cell of the (filtered) grid."""
+        return cls({cell: per_cell for cell in label_grid(**grid_filters)}, distribution)
+
+    @staticmethod
+    def key(cell):
+        intent, case_type, mistake, personality = cell
+        return label_cell({
+            "intent": intent,
+            "case_type": case_type,
+            "mistake": mistake,
+            "personality_type": personality
+        })
+
+    def deficits(self):
+        return {
+            cell: self.targets[cell] - self.counts[cell]
+            for cell in self.targets
+            if self.counts[cell] < self.targets[cell]
+        }
+
+    def remaining(self):
+        return sum(self.deficits().values())
+
+    def plan(self):
+        """
+        Returns one request per missing chat, interleaved round-robin across
+        cells so that an interrupted run still leaves the dataset balanced.
+        """
+        slots = [
+            (k, random.random(), cell)
+            for cell, deficit in self.deficits().items()
+            for k in range(deficit)
+        ]
+        return [cell for _, _, cell in sorted(slots)]
+
+    def record(self, cell):
+        self.counts[cell] += 1
@@ -0,0 +1,160 @@
+from src.config import INTENTS, CASE_TYPES, AGENT_MISTAKES, PERSONALITIES
+from array import array
+
+ROLES = ["customer", "agent"]
+
+# Key layouts stored in compact form; anything else is kept as parsed JSON
+METADATA_KEYS = ("intent", "case_type", "personality_type", "mistake")
+MESSAGE_KEYS = ("role", "text")
+MISSING = object()
+
+
+class LabelTable:
+    """Maps label strings to small integer codes. Values outside the config enums get new codes."""
+
+    def __init__(self, values):
+        self.values = list(values)
+        self._codes = {value: i for i, value in enumerate(self.values)}
+
+    def code(self, value):
+        code = self._codes.get(value)
+        if code is None:
+            code = self._codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+
+class ChatRecord:
+    __slots__ = ("id", "intent", "case_type", "personality", "mistake", "first_message", "messages", "extra", "keys")
+
+    def __init__(self, id, intent, case_type, personality, mistake, first_message, messages, extra):
+        self.id = id
+        self.intent = intent
+        self.case_type = case_type
+        self.personality = personality
+        self.mistake = mistake
+        self.first_message = first_message
+        self.messages = messages
+        self.extra = extra
+        self.keys = None
+
+
+class ChatStore:
+    """
+    Compact in-memory dataset.
+
+    Each chat is a __slots__ record whose metadata labels are integer codes
+    into tables seeded from src/config.py. Message roles are one byte each and
+    all message texts live in one contiguous UTF-8 buffer indexed by offsets.
+    Chats whose metadata or messages have another shape, and any other
+    top-level fields (e.g. "analysis"), are kept as parsed JSON in `extra`,
+    so iterating the store gives back exactly the chats that were added.
+    """
+
+    def __init__(self, chats=()):
+        self.intents = LabelTable(INTENTS)
+        self.case_types = LabelTable(CASE_TYPES)
+        self.personalities = LabelTable(p["type"] for p in PERSONALITIES)
+        self.mistakes = LabelTable(["none"] + AGENT_MISTAKES)
+        self.roles = LabelTable(ROLES)
+
+        self.records = []
+        self._roles = array("B")
+        self._offsets = array("Q", [0])
+        self._text = bytearray()
+        self.extend(chats)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        for record in self.records:
+            yield self.to_dict(record)
+
+    def __getitem__(self, index):
+        return self.to_dict(self.records[index])
+
+    def extend(self, chats):
+        for chat in chats:
+            self.append(chat)
+
+    def append(self, chat):
+        keys = tuple(chat)
+        chat = dict(chat)
+        meta = chat.pop("metadata", MISSING)
+        messages = chat.pop("chat", MISSING)
+        _id = chat.pop("id", None)
+
+        labels = (None, None, None, None)
+        if isinstance(meta, dict) and tuple(meta) == METADATA_KEYS and all(isinstance(v, str) for v in meta.values()):
+            labels = (
+                self.intents.code(meta["intent"]),
+                self.case_types.code(meta["case_type"]),
+                self.personalities.code(meta["personality_type"]),
+                self.mistakes.code(meta["mistake"])
+            )
+        elif meta is not MISSING:
+            chat["metadata"] = meta
+
+        first = len(self._roles)
+        count = None
+        if isinstance(messages, list) and all(
+            isinstance(m, dict) and tuple(m) == MESSAGE_KEYS and isinstance(m["role"], str) and isinstance(m["text"], str)
+            for m in messages
+        ):
+            for m in messages:
+                self._roles.append(self.roles.code(m["role"]))
+                self._text += m["text"].encode("utf-8")
+                self._offsets.append(len(self._text))
+            count = len(messages)
+        elif messages is not MISSING:
+            chat["chat"] = messages
+
+        record = ChatRecord(_id, *labels, first, count, chat or None)
+        if keys != tuple(self._keys(record)):
+            # Only chats whose field order differs from the generator's carry it
+            record.keys = keys
+        self.records.append(record)
+        return record
+
+    @staticmethod
+    def _keys(record):
+        extra = record.extra or {}
+        keys = ["id"]
+        if record.intent is not None or "metadata" in extra:
+            keys.append("metadata")
+        if record.messages is not None or "chat" in extra:
+            keys.append("chat")
+        return keys + [key for key in extra if key not in ("metadata", "chat")]
+
+    def _message(self, i):
+        text = self._text[self._offsets[i]:self._offsets[i + 1]].decode("utf-8")
+        return {"role": self.roles.values[self._roles[i]], "text": text}
+
+    def to_dict(self, record):
+        """Rebuilds the chat as plain JSON-compatible dicts."""
+        chat = {"id": record.id}
+        extra = record.extra or {}
+
+        if record.intent is not None:
+            chat["metadata"] = {
+                "intent": self.intents.values[record.intent],
+                "case_type": self.case_types.values[record.case_type],
+                "personality_type": self.personalities.values[record.personality],
+                "mistake": self.mistakes.values[record.mistake]
+            }
+        elif "metadata" in extra:
+            chat["metadata"] = extra["metadata"]
+
+        if record.messages is not None:
+            first = record.first_message
+            chat["chat"] = [self._message(i) for i in range(first, first + record.messages)]
+        elif "chat" in extra:
+            chat["chat"] = extra["chat"]
+
+        for key, value in extra.items():
+            if key not in chat:
+                chat[key] = value
+        if record.keys is not None:
+            chat = {key: chat[key] for key in record.keys}
+        return chat
@@ -0,0 +1,154 @@
+import threading
+import time
+
+# How long Ollama keeps a model loaded after its last request
+KEEP_ALIVE = "30m"
+
+
+def model_tag(name):
+    """Ollama lists models with their tag ("llama3" is resident as "llama3:latest")."""
+    return name if ":" in name else name + ":latest"
+
+
+class ModelScheduler:
+    """
+    Serves LLM calls for several models on one Ollama host one model at a time.
+
+    With little VRAM every switch between e.g. the generation and the analysis
+    model reloads weights. Calls are therefore admitted only for the current
+    model; calls for other models wait until its batch is drained (nothing in
+    flight and nobody waiting for it). On a switch the running models are read
+    from /api/ps, and a model that is not resident is preloaded explicitly, so
+    its load is paid once instead of by the first calls of the batch. Every
+    call carries keep_alive, so a model isn't unloaded between its batches.
+
+    Clients are wrapped with wrap(); all wrapped clients share the schedule.
+    """
+
+    def __init__(self, client, keep_alive=KEEP_ALIVE):
+        self.client = client
+        self.keep_alive = keep_alive
+        self.current = None
+        self._cond = threading.Condition()
+        self._in_flight = 0
+        self._waiting = {}
+        self._switching = False
+
+        self.calls = 0
+        self.switches = 0
+        self.preloads = 0
+        self.load_seconds = 0.0
+
+    def wrap(self, client):
+        return ScheduledClient(client, self)
+
+    def resident(self):
+        """Names of the models loaded on the host, or None when it can't be asked."""
+        try:
+            response = self.client.ps()
+        except Exception:
+            return None
+        return {m["model"] or m["name"] for m in response["models"]}
+
+    def preload(self, model):
+        """Loads a model that is not resident. Returns the seconds it took, 0 if it was resident."""
+        resident = self.resident()
+        if resident is not None and model_tag(model) in {model_tag(m) for m in resident}:
+            return 0.0
+
+        start = time.perf_counter()
+        # A request without a prompt only loads the model
+        response = self.client.generate(model=model, prompt="", keep_alive=self.keep_alive)
+        seconds = (response.get("load_duration") or 0) / 1e9 or time.perf_counter() - start
+        self.preloads += 1
+        self.load_seconds += seconds
+        return seconds
+
+    def _can_run(self, model):
+        if self._switching:
+            return False
+        if self.current is None or self.current == model:
+            return True
+        # Switch only once the current model's batch is drained
+        return self._in_flight == 0 and not self._waiting.get(self.current)
+
+    def acquire(self, model):
+        with self._cond:
+            self._waiting[model] = self._waiting.get(model, 0) + 1
+            while not self._can_run(model):
+                self._cond.wait()
+            self._waiting[model] -= 1
+
+            switch = self.current != model
+            if switch:
+                self.switches += self.current is not None
+                self.current = model
+                self._switching = True
+            self._in_flight += 1
+            self.calls += 1
+
+        if switch:
+            try:
+                self.preload(model)
+            except Exception as e:
+                # The call itself will load the model (or report the error)
+                print(f"[!] Could not preload {model}: {e}")
+            finally:
+                with self._cond:
+                    self._switching = False
+                    self._cond.notify_all()
+
+    def release(self):
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify_all()
+
+    def summary(self):
+        return {
+            "calls": self.calls,
+            "switches": self.switches,
+            "preloads": self.preloads,
+            "load_seconds": self.load_seconds,
+        }
+
+    def print_summary(self):
+        s = self.summary()
+        print("\n--- Model residency ---")
+        print(f"[*] {s['calls']} calls, {s['switches']} model switches, "
+              f"{s['preloads']} preloads taking {s['load_seconds']:.1f}s")
+
+
+class ScheduledClient:
+    """
+    Wraps a client (ollama.Client or ClientPool) so every generate() call waits
+    for its model's turn in a ModelScheduler. Other attributes are passed through.
+    """
+
+    def __init__(self, client, scheduler):
+        self.client = client
+        self.scheduler = scheduler
+
+    def generate(self, **kwargs):
+        kwargs.setdefault("keep_alive", self.scheduler.keep_alive)
+        self.scheduler.acquire(kwargs.get("model"))
+        streaming = False
+        try:
+            response = self.client.generate(**kwargs)
+            if kwargs.get("stream"):
+                streaming = True
+                return self._relay(response)
+            return response
+        finally:
+            if not streaming:
+                self.scheduler.release()
+
+    def _relay(self, stream):
+        """The model's turn lasts until the stream is consumed or closed."""
+        try:
+            yield from stream
+        finally:
+            stream.close()
+            self.scheduler.release()
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
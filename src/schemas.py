@@ -0,0 +1,118 @@
+import json
+
+ANALYSIS_INTENTS = ["payment problems", "technical errors", "account access", "questions about the tariff", "refund", "other"]
+ANALYSIS_SATISFACTION = ["satisfied", "neutral", "unsatisfied"]
+ANALYSIS_MISTAKES = ["no_resolution", "rude_tone", "ignored_question"]
+
+CHAT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "messages": {
+            "type": "array",
+            "minItems": 1,
+            "items": {
+                "type": "object",
+                "properties": {
+                    "role": {"type": "string", "enum": ["customer", "agent"]},
+                    "text": {"type": "string"}
+                },
+                "required": ["role", "text"]
+            }
+        }
+    },
+    "required": ["messages"]
+}
+
+# Several chats of one label cell in one call; each dialogue is validated against CHAT_SCHEMA on its own
+MULTI_CHAT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "dialogues": {"type": "array", "minItems": 1, "items": CHAT_SCHEMA}
+    },
+    "required": ["dialogues"]
+}
+
+ANALYSIS_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "reasoning": {"type": "string"},
+        "request_intent": {"type": "string", "enum": ANALYSIS_INTENTS},
+        "customer_satisfaction": {"type": "string", "enum": ANALYSIS_SATISFACTION},
+        "agent_mistakes": {
+            "type": "array",
+            "items": {"type": "string", "enum": ANALYSIS_MISTAKES}
+        }
+    },
+    "required": ["reasoning", "request_intent", "customer_satisfaction", "agent_mistakes"]
+}
+
+ANALYSIS_CONFIDENCE = ["high", "medium", "low"]
+
+# Analysis with a self-reported confidence, used by the fast model of the cascade
+CONFIDENT_ANALYSIS_SCHEMA = {
+    "type": "object",
+    "properties": {**ANALYSIS_SCHEMA["properties"], "confidence": {"type": "string", "enum": ANALYSIS_CONFIDENCE}},
+    "required": ANALYSIS_SCHEMA["required"] + ["confidence"]
+}
+
+BATCH_RESULT_SCHEMA = {
+    "type": "object",
+    "properties": {"id": {"type": "string"}, **ANALYSIS_SCHEMA["properties"]},
+    "required": ["id"] + ANALYSIS_SCHEMA["required"]
+}
+
+BATCH_ANALYSIS_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "results": {"type": "array", "items": BATCH_RESULT_SCHEMA}
+    },
+    "required": ["results"]
+}
+
+TYPES = {
+    "object": dict,
+    "array": list,
+    "string": str,
+    "integer": int,
+    "number": (int, float),
+    "boolean": bool
+}
+
+
+class SchemaError(ValueError):
+    pass
+
+
+def validate(value, schema, path="$"):
+    """
+    Validates value against the subset of JSON Schema used by our prompts
+    (type, properties, required, enum, items, minItems). Raises SchemaError.
+    """
+    expected = schema.get("type")
+    if expected and not isinstance(value, TYPES[expected]):
+        raise SchemaError(f"{path}: expected {expected}, got {type(value).__name__}")
+
+    if "enum" in schema and value not in schema["enum"]:
+        raise SchemaError(f"{path}: {value!r} is not one of {schema['enum']}")
+
+    if isinstance(value, dict):
+        for key in schema.get("required", []):
+            if key not in value:
+                raise SchemaError(f"{path}: missing '{key}'")
+        for key, sub_schema in schema.get("properties", {}).items():
+            if key in value:
+                validate(value[key], sub_schema, f"{path}.{key}")
+
+    if isinstance(value, list):
+        if len(value) < schema.get("minItems", 0):
+            raise SchemaError(f"{path}: expected at least {schema['minItems']} items")
+        if "items" in schema:
+            for i, item in enumerate(value):
+                validate(item, schema["items"], f"{path}[{i}]")
+
+    return value
+
+
+def parse(text, schema):
+    """Decodes a structured-output response and validates it. Raises ValueError."""
+    return validate(json.loads(text), schema)
@@ -0,0 +1,145 @@
+from src.utils import iter_chats, label_cell, dataset_format
+from src.config import *
+from collections import Counter
+import json
+import os
+
+GROUPS = ("intents", "case_types", "mistakes", "personalities", "cells")
+
+
+class LabelStats:
+    """
+    Label counters of a dataset, persisted in a small state file (<dataset>.stats.json).
+
+    The file remembers the dataset size it was counted at, so reading it is
+    instant while it is fresh. A JSONL dataset that has grown since (e.g. a
+    generation journal) is caught up by counting only the appended lines,
+    anything else is recounted from scratch. With dataset_path=None the
+    counters only live in memory.
+    """
+
+    def __init__(self, dataset_path):
+        self.dataset_path = dataset_path
+        self.path = dataset_path + ".stats.json" if dataset_path else None
+        self.counts = {group: Counter() for group in GROUPS}
+        self.total = 0
+        self.counted_bytes = 0
+        self._stamp = None
+
+    def add(self, chat):
+        meta = chat.get("metadata", {})
+        case_type = meta.get("case_type")
+        self.counts["intents"][meta.get("intent")] += 1
+        self.counts["case_types"][case_type] += 1
+        self.counts["personalities"][meta.get("personality_type")] += 1
+        if case_type == "agent_mistake":
+            self.counts["mistakes"][meta.get("mistake")] += 1
+        self.counts["cells"][label_cell(meta)] += 1
+        self.total += 1
+
+    def combine(self, other):
+        """Adds the counts of another dataset, e.g. when datasets are merged."""
+        for group in GROUPS:
+            self.counts[group].update(other.counts[group])
+        self.total += other.total
+
+    def load(self):
+        """Reads the state file. Returns False if there is none."""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return False
+
+        self.counts = {group: Counter(state["counts"].get(group, {})) for group in GROUPS}
+        self.total = state["total"]
+        self.counted_bytes = state["counted_bytes"]
+        self._stamp = (state["size"], state["mtime"])
+        return True
+
+    def save(self, counted_bytes=None):
+        """Writes the state file stamped with the current dataset size."""
+        stat = os.stat(self.dataset_path)
+        self.counted_bytes = stat.st_size if counted_bytes is None else counted_bytes
+        self._stamp = (stat.st_size, stat.st_mtime)
+
+        # Readers may poll the file while it is rewritten, so it is replaced atomically
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                "size": stat.st_size,
+                "mtime": stat.st_mtime,
+                "counted_bytes": self.counted_bytes,
+                "total": self.total,
+                "counts": {group: dict(counts) for group, counts in self.counts.items()}
+            }, f)
+        os.replace(tmp_path, self.path)
+
+    def _reset(self):
+        self.counts = {group: Counter() for group in GROUPS}
+        self.total = 0
+        self.counted_bytes = 0
+
+    def reset(self):
+        """Drops the counts and the state file, e.g. after the dataset was rewritten in place."""
+        self._reset()
+        self._stamp = None
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+    def _count_tail(self):
+        """Counts complete JSONL lines appended after counted_bytes."""
+        with open(self.dataset_path, 'rb') as f:
+            f.seek(self.counted_bytes)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # Partially written last line: counted by the next update
+                    break
+                if line.strip():
+                    self.add(json.loads(line))
+                self.counted_bytes += len(line)
+
+    def update(self):
+        """Brings the counts up to date with the dataset. Returns the number of newly counted chats."""
+        if self._stamp is None:
+            self.load()
+        if not os.path.exists(self.dataset_path):
+            return 0
+
+        stat = os.stat(self.dataset_path)
+        if self._stamp == (stat.st_size, stat.st_mtime):
+            return 0
+
+        before = self.total
+        if dataset_format(self.dataset_path) == "jsonl" and stat.st_size >= self.counted_bytes:
+            self._count_tail()
+            self.save(self.counted_bytes)
+        else:
+            self._reset()
+            for chat in iter_chats(self.dataset_path):
+                self.add(chat)
+            self.save()
+        return self.total - before
+
+    def copy_to(self, dataset_path):
+        """Saves these counts as the state of another file holding the same chats (e.g. an export)."""
+        copy = LabelStats(dataset_path)
+        copy.combine(self)
+        copy.save()
+        return copy
+
+    def distribution(self, cells=False):
+        """Counts in the format of labels_distribution()."""
+        distribution = {
+            "intents": {i: self.counts["intents"][i] for i in INTENTS},
+            "case_types": {c: self.counts["case_types"][c] for c in CASE_TYPES},
+            "mistakes": {m: self.counts["mistakes"][m] for m in AGENT_MISTAKES},
+            "personalities": {p["type"]: self.counts["personalities"][p["type"]] for p in PERSONALITIES},
+            "totals": {
+                "intents": self.total,
+                "mistakes": sum(self.counts["mistakes"].values())
+            }
+        }
+        if cells:
+            distribution["cells"] = dict(self.counts["cells"])
+        return distribution
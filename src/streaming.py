@@ -0,0 +1,204 @@
+from src.schemas import validate
+import itertools
+import time
+import json
+
+STREAM_FIELDS = ("tokens", "payload_tokens", "thinking_tokens", "stopped_early", "think_capped")
+
+
+class JsonBoundary:
+    """
+    Incremental detector for the end of the first top-level JSON object in streamed text.
+
+    Text before the opening brace and a leading <think>...</think> block are
+    skipped. Braces inside strings are ignored, so feed() returns True exactly
+    when the brace that closes the object has arrived.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.start = None
+        self.end = None
+        self.thinking = False
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+
+    @property
+    def payload(self):
+        return self.text[self.start:self.end] if self.end is not None else None
+
+    def _skip_preamble(self):
+        """Moves past leading whitespace and think blocks. Returns False while more text is needed."""
+        while True:
+            rest = self.text[self._pos:].lstrip()
+            self._pos = len(self.text) - len(rest)
+            if rest.startswith("<think>"):
+                close = self.text.find("</think>", self._pos)
+                self.thinking = close < 0
+                if close < 0:
+                    return False
+                self._pos = close + len("</think>")
+                continue
+            # A partial "<think" tag at the very end of the text
+            if rest and "<think>".startswith(rest):
+                return False
+
+            brace = self.text.find("{", self._pos)
+            if brace < 0:
+                self._pos = len(self.text)
+                return False
+            self.start = self._pos = brace
+            return True
+
+    def feed(self, piece):
+        """Adds streamed text. Returns True once the JSON object is complete."""
+        if self.end is not None:
+            return True
+        self.text += piece
+        if self.start is None and not self._skip_preamble():
+            return False
+
+        text = self.text
+        for i in range(self._pos, len(text)):
+            char = text[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in "{[":
+                self._depth += 1
+            elif char in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    self.end = i + 1
+                    return True
+        self._pos = len(text)
+        return False
+
+
+def _is_valid(payload, schema):
+    try:
+        value = json.loads(payload)
+        if isinstance(schema, dict):
+            validate(value, schema)
+    except ValueError:
+        return False
+    return True
+
+
+def stream_generate(client, early_stop=True, think_budget=None, **kwargs):
+    """
+    Streams one generate call and stops reading once a complete payload that
+    validates against the requested format has arrived; closing the stream
+    makes Ollama abort the generation. With think_budget, a model that thinks
+    for more tokens than that is cut off and asked again with thinking disabled.
+
+    Returns a dict shaped like a non-streamed response plus a "stream" entry.
+    Early-stopped calls get no final chunk, so their durations are measured on
+    the client: time to first token is reported as prompt eval.
+    """
+    start = time.perf_counter_ns()
+    first_token = None
+    boundary = JsonBoundary()
+    text, thinking = [], []
+    final = None
+    stats = dict.fromkeys(STREAM_FIELDS, 0)
+
+    stream = client.generate(stream=True, **kwargs)
+    try:
+        for chunk in stream:
+            if first_token is None:
+                first_token = time.perf_counter_ns()
+
+            piece = chunk.get("response") or ""
+            thought = chunk.get("thinking") or ""
+            if piece or thought:
+                stats["tokens"] += 1
+
+            # Thinking arrives in its own field, or inline in a <think> block
+            if thought or (piece and boundary.thinking):
+                thinking.append(thought)
+                stats["thinking_tokens"] += 1
+                if think_budget is not None and stats["thinking_tokens"] > think_budget:
+                    stats["think_capped"] = 1
+                    break
+
+            if piece:
+                text.append(piece)
+                if not stats["payload_tokens"] and boundary.feed(piece):
+                    stats["payload_tokens"] = stats["tokens"]
+                    if early_stop and not chunk.get("done") and _is_valid(boundary.payload, kwargs.get("format")):
+                        stats["stopped_early"] = 1
+                        break
+
+            if chunk.get("done"):
+                final = chunk
+                break
+    finally:
+        stream.close()
+
+    now = time.perf_counter_ns()
+
+    if stats["think_capped"]:
+        # Thinking tokens already decoded are lost; the retry answers directly
+        retry = stream_generate(client, early_stop, None, **{**kwargs, "think": False})
+        retry["stream"]["thinking_tokens"] += stats["thinking_tokens"]
+        retry["stream"]["tokens"] += stats["tokens"]
+        retry["stream"]["think_capped"] = 1
+        retry["total_duration"] = retry.get("total_duration", 0) + now - start
+        return retry
+
+    if final is not None:
+        response = {field: final.get(field) for field in (
+            "total_duration", "load_duration", "prompt_eval_count", "prompt_eval_duration",
+            "eval_count", "eval_duration", "done_reason"
+        )}
+    else:
+        first_token = first_token or now
+        response = {
+            "total_duration": now - start,
+            "load_duration": 0,
+            "prompt_eval_count": 0,
+            "prompt_eval_duration": first_token - start,
+            "eval_count": stats["tokens"],
+            "eval_duration": now - first_token,
+            "done_reason": "early_stop" if stats["stopped_early"] else "cancelled",
+        }
+
+    response["response"] = boundary.payload if stats["stopped_early"] else "".join(text)
+    response["thinking"] = "".join(thinking)
+    response["stream"] = stats
+    return response
+
+
+class StreamingClient:
+    """
+    Wraps a client (ollama.Client or ClientPool) so every generate() call is
+    streamed through stream_generate(). Other attributes are passed through.
+
+    With early stop, every `probe_every`-th call (starting with the first) still
+    runs to the end. These probes measure how many tokens the model decodes
+    after the payload, which Telemetry uses to estimate the tokens saved by
+    the early-stopped calls.
+    """
+
+    def __init__(self, client, early_stop=True, think_budget=None, probe_every=20):
+        self.client = client
+        self.early_stop = early_stop
+        self.think_budget = think_budget
+        self.probe_every = probe_every
+        self._calls = itertools.count()
+
+    def generate(self, **kwargs):
+        probe = self.probe_every and next(self._calls) % self.probe_every == 0
+        return stream_generate(self.client, self.early_stop and not probe, self.think_budget, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
@@ -0,0 +1,146 @@
+from collections import defaultdict
+import threading
+import json
+import time
+
+DURATION_FIELDS = ("total_duration", "load_duration", "prompt_eval_duration", "eval_duration")
+COUNT_FIELDS = ("prompt_eval_count", "eval_count")
+
+
+class Telemetry:
+    """
+    Records Ollama performance fields of every LLM call.
+
+    Each call is appended to a JSONL metrics file together with its labels
+    (stage, model, intent, case_type) and aggregated in memory for the
+    progress bar postfix and the end-of-run summary. Durations are in
+    nanoseconds, as returned by Ollama.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._file = None
+        self._lock = threading.Lock()
+        self._totals = defaultdict(lambda: defaultdict(int))
+        self._started = time.perf_counter()
+        self.last_load = 0
+
+    def record(self, response, failed=False, **labels):
+        """
+        Stores the performance fields of one response. Cached responses carry none of them.
+        failed marks a call whose output could not be parsed, i.e. wasted GPU time.
+        """
+        metrics = {field: response.get(field) or 0 for field in DURATION_FIELDS + COUNT_FIELDS}
+        cached = not metrics["total_duration"]
+        stream = response.get("stream") or {}
+        entry = {"ts": time.time(), **labels, **metrics, "cached": cached, "failed": failed, **stream}
+
+        with self._lock:
+            totals = self._totals[labels.get("model")]
+            totals["calls"] += 1
+            totals["cached"] += cached
+            totals["failed"] += failed
+            totals["failed_duration"] += metrics["total_duration"] if failed else 0
+            for field, value in metrics.items():
+                totals[field] += value
+            if stream:
+                self._record_stream(totals, stream, metrics["eval_count"])
+            if metrics["load_duration"]:
+                self.last_load = metrics["load_duration"]
+
+            if self.path:
+                if self._file is None:
+                    self._file = open(self.path, 'a', encoding='utf-8')
+                self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                self._file.flush()
+
+    def _record_stream(self, totals, stream, eval_count):
+        totals["streamed"] += 1
+        totals["stopped_early"] += stream["stopped_early"]
+        totals["thinking_tokens"] += stream["thinking_tokens"]
+        totals["think_capped"] += stream["think_capped"]
+        if not stream["stopped_early"] and stream["payload_tokens"]:
+            # Streams that ran to the end show how much is decoded after the payload closes
+            totals["full_streams"] += 1
+            totals["tail_tokens"] += max(0, eval_count - stream["payload_tokens"])
+
+    def postfix(self):
+        """Short live stats for tqdm.set_postfix."""
+        with self._lock:
+            eval_count = sum(t["eval_count"] for t in self._totals.values())
+            eval_duration = sum(t["eval_duration"] for t in self._totals.values())
+            load_duration = sum(t["load_duration"] for t in self._totals.values())
+            failed = sum(t["failed"] for t in self._totals.values())
+
+        return {
+            "tok/s": f"{eval_count / (eval_duration / 1e9):.1f}" if eval_duration else "-",
+            "load": f"{load_duration / 1e9:.1f}s",
+            "last_load": f"{self.last_load / 1e9:.1f}s",
+            "wasted": failed
+        }
+
+    def summary(self):
+        """Per-model totals with the share of server time spent loading, prompt-evaluating and decoding."""
+        report = {}
+        with self._lock:
+            for model, t in self._totals.items():
+                total = t["total_duration"]
+                other = total - t["load_duration"] - t["prompt_eval_duration"] - t["eval_duration"]
+                report[model] = {
+                    "calls": t["calls"],
+                    "cached": t["cached"],
+                    "parse_failures": t["failed"],
+                    "wasted_seconds": t["failed_duration"] / 1e9,
+                    "prompt_tokens": t["prompt_eval_count"],
+                    "eval_tokens": t["eval_count"],
+                    "server_seconds": total / 1e9,
+                    "load_seconds": t["load_duration"] / 1e9,
+                    "prompt_eval_seconds": t["prompt_eval_duration"] / 1e9,
+                    "decode_seconds": t["eval_duration"] / 1e9,
+                    "other_seconds": max(0, other) / 1e9,
+                    "prompt_tokens_per_sec": t["prompt_eval_count"] / (t["prompt_eval_duration"] / 1e9)
+                    if t["prompt_eval_duration"] else 0.0,
+                    "decode_tokens_per_sec": t["eval_count"] / (t["eval_duration"] / 1e9)
+                    if t["eval_duration"] else 0.0,
+                    "streamed": t["streamed"],
+                    "stopped_early": t["stopped_early"],
+                    "thinking_tokens": t["thinking_tokens"],
+                    "think_capped": t["think_capped"],
+                    "tail_tokens": t["tail_tokens"],
+                    "full_streams": t["full_streams"],
+                    # Estimate: early-stopped calls would have decoded the average tail of full streams
+                    "saved_tokens": round(t["stopped_early"] * t["tail_tokens"] / t["full_streams"])
+                    if t["full_streams"] else None,
+                }
+        return report
+
+    def print_summary(self):
+        wall = time.perf_counter() - self._started
+        print("\n--- LLM telemetry ---")
+        print(f"Wall time: {wall:.1f}s")
+        for model, r in self.summary().items():
+            server = r["server_seconds"] or 1
+            print(f"[{model}] {r['calls']} calls ({r['cached']} cached), "
+                  f"{r['prompt_tokens']} prompt / {r['eval_tokens']} decode tokens")
+            print(f"    load        {r['load_seconds']:8.1f}s ({r['load_seconds'] / server:.0%})")
+            print(f"    prompt eval {r['prompt_eval_seconds']:8.1f}s ({r['prompt_eval_seconds'] / server:.0%}), "
+                  f"{r['prompt_tokens_per_sec']:.0f} tok/s")
+            print(f"    decode      {r['decode_seconds']:8.1f}s ({r['decode_seconds'] / server:.0%}), "
+                  f"{r['decode_tokens_per_sec']:.1f} tok/s")
+            print(f"    other       {r['other_seconds']:8.1f}s ({r['other_seconds'] / server:.0%})")
+            print(f"    wasted on {r['parse_failures']} parse failures: {r['wasted_seconds']:.1f}s "
+                  f"({r['wasted_seconds'] / server:.0%})")
+            if r["streamed"]:
+                print(f"    streamed    {r['streamed']} calls, {r['stopped_early']} stopped after the payload, "
+                      f"{r['thinking_tokens']} thinking tokens ({r['think_capped']} capped)")
+                if r["full_streams"]:
+                    saved = f", ~{r['saved_tokens']} saved by early stop" if r["stopped_early"] else ""
+                    print(f"    tail        {r['tail_tokens']} tokens decoded after the payload in "
+                          f"{r['full_streams']} full streams{saved}")
+        if self.path:
+            print(f"Per-call metrics: {self.path}")
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
@@ -1,12 +1,32 @@
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from collections import Counter
 from src.config import *
+from src.journal import DatasetJournal, open_dataset_writer, dump_dataset
+from src.frames import FrameReader, is_frame_file
+from src.concurrency import AdaptiveLimit
+import itertools
 import argparse
+import hashlib
+import time
+import heapq
 import json
 import os
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 DATA_DIR = os.path.join(BASE_DIR, "data")
 
+READ_CHUNK_SIZE = 64 * 1024
+
+
+def get_ollama_endpoints():
+    """
+    Returns all Ollama endpoints: the comma-separated list in OLLAMA_HOSTS, or the
+    single endpoint from get_ollama_endpoint(). The list has its own variable because
+    ollama-python parses OLLAMA_HOST on import and rejects a list there.
+    """
+    endpoints = [url.strip() for url in os.getenv("OLLAMA_HOSTS", "").split(",") if url.strip()]
+    return endpoints or [get_ollama_endpoint()]
+
 
 def get_ollama_endpoint():
     """
@@ -22,72 +42,445 @@ def get_ollama_endpoint():
     return "http://localhost:11434"
 
 
+def _timed_call(func, item):
+    """Runs func in a worker; the completion time is taken there, so a slow consumer does not inflate latencies."""
+    try:
+        return func(item), None, time.perf_counter()
+    except Exception as e:
+        return None, e, time.perf_counter()
+
+
+def bounded_map(func, items, workers=1):
+    """
+    Applies func to items keeping at most `workers` calls in flight.
+    Yields (item, result, error) tuples in the original item order.
+
+    workers may be an AdaptiveLimit: the number of calls in flight then follows
+    its current limit, and every call's latency and failure is fed back to it.
+    ValueErrors (unparseable model output) are not counted as failures.
+    """
+    limit = workers if isinstance(workers, AdaptiveLimit) else None
+    if limit:
+        workers = limit.maximum
+
+    if workers <= 1:
+        for item in items:
+            try:
+                yield item, func(item), None
+            except Exception as e:
+                yield item, None, e
+        return
+
+    items = iter(items)
+    end = object()
+    # Items are pulled on their own thread, so a slow input (e.g. a queue fed by
+    # another stage) never holds back results that are already finished
+    fetcher = ThreadPoolExecutor(max_workers=1)
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            in_flight = {}
+            finished = {}
+            fetching = None
+            exhausted = False
+            next_index = 0
+            emit_index = 0
+
+            while True:
+                capacity = limit.current if limit else workers
+                if fetching is None and not exhausted and len(in_flight) < capacity:
+                    fetching = fetcher.submit(next, items, end)
+                if fetching is None and not in_flight:
+                    return
+
+                done, _ = wait(list(in_flight) + ([fetching] if fetching else []), return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future is fetching:
+                        fetching = None
+                        item = future.result()
+                        if item is end:
+                            exhausted = True
+                            continue
+                        in_flight[executor.submit(_timed_call, func, item)] = (next_index, item, time.perf_counter())
+                        next_index += 1
+                        continue
+
+                    index, item, submitted = in_flight.pop(future)
+                    result, error, completed = future.result()
+                    finished[index] = (item, result, error)
+                    if limit:
+                        limit.record(completed - submitted, error is not None and not isinstance(error, ValueError))
+
+                # Reorder buffer: results leave strictly in submission order
+                while emit_index in finished:
+                    yield finished.pop(emit_index)
+                    emit_index += 1
+    finally:
+        fetcher.shutdown(wait=False)
+
+
+def chunked(items, size):
+    """Groups an iterable into lists of at most `size` items."""
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def iter_chat_offsets(path):
+    """
+    Yields (byte offset, byte length, chat) for every chat of a JSON array or JSONL file.
+
+    The file is decoded as latin-1 so that character positions equal byte
+    positions; the returned chats are only meant for reading ASCII labels,
+    fetch the full chat with read_chat_at. For a frames file the offsets are
+    those of the chat's compressed frame, fetch it with FrameReader.get.
+    """
+    if is_frame_file(path):
+        with FrameReader(path) as reader:
+            yield from reader.iter_frames()
+        return
+
+    with open(path, 'r', encoding='latin-1', newline='') as f:
+        head = f.read(1)
+        while head and head.isspace():
+            head = f.read(1)
+        if not head:
+            return
+
+        f.seek(0)
+        if head == "[":
+            for start, end, item in _iter_json_array(f, offsets=True):
+                yield start, end - start, item
+            return
+
+        offset = 0
+        for line in f:
+            if line.strip():
+                yield offset, len(line.rstrip("\r\n")), json.loads(line)
+            offset += len(line)
+
+
+def read_chat_at(f, offset, length):
+    """Reads a single chat from a binary file object at a known byte offset."""
+    f.seek(offset)
+    return json.loads(f.read(length).decode("utf-8"))
+
+
 def get_data_path(filename):
     """Grants correct data path."""
     return os.path.join(DATA_DIR, filename)
 
 
-def concat_json_databases(filenames, output_filename):
-    """Concatenates multiple JSON databases with id reindexing."""
-    merged_data = []
-
+def _iter_json_array(f, chunk_size=READ_CHUNK_SIZE, offsets=False):
+    """
+    Incrementally decodes items of a top-level JSON array from a text stream.
+    With offsets=True yields (start, end, item) character offsets instead.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    base = 0
+    pos = 0
+    eof = False
+    started = False
+
+    while True:
+        # Skip separators between items
+        while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+            pos += 1
+
+        if pos == len(buffer):
+            if eof:
+                raise ValueError("Unexpected end of JSON array")
+            base += len(buffer)
+            buffer = f.read(chunk_size)
+            pos = 0
+            eof = not buffer
+            continue
+
+        if not started:
+            if buffer[pos] != "[":
+                raise ValueError("Expected a JSON array")
+            started = True
+            pos += 1
+            continue
+
+        if buffer[pos] == "]":
+            return
+
+        try:
+            item, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            # Item is cut by the chunk boundary: read more and retry
+            chunk = f.read(chunk_size)
+            eof = not chunk
+            base += pos
+            buffer = buffer[pos:] + chunk
+            pos = 0
+            continue
+
+        yield (base + pos, base + end, item) if offsets else item
+        pos = end
+
+
+def dataset_format(path):
+    """Returns the file format of a dataset: "frames", "json" (array) or "jsonl"."""
+    if is_frame_file(path):
+        return "frames"
+    with open(path, 'rb') as f:
+        head = f.read(64).lstrip()
+    return "json" if head.startswith(b"[") else "jsonl"
+
+
+def iter_chats(path):
+    """
+    Yields chats one at a time from a JSON array, JSONL or frames file.
+    Memory use stays flat regardless of the file size.
+    """
+    if is_frame_file(path):
+        with FrameReader(path) as reader:
+            yield from reader
+        return
+
+    with open(path, 'r', encoding='utf-8') as f:
+        head = f.read(1)
+        while head and head.isspace():
+            head = f.read(1)
+        if not head:
+            return
+
+        if head == "[":
+            f.seek(0)
+            yield from _iter_json_array(f)
+            return
+
+        yield json.loads(head + f.readline())
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def _open_inputs(filenames):
+    streams = []
     for fn in filenames:
         path = get_data_path(fn)
         if os.path.exists(path):
-            with open(path, 'r', encoding='utf-8') as f:
-                merged_data.extend(json.load(f))
+            streams.append(iter_chats(path))
         else:
             print(f"[!] Warning: File {fn} not found in {DATA_DIR}")
+    return streams
+
+
+def _chat_fingerprint(item):
+    """Content hash of a chat's messages, used for deduplication."""
+    text = json.dumps(item.get("chat", []), sort_keys=True, ensure_ascii=False)
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+
+class ShardedWriter:
+    """Writes dataset shards of bounded size plus a manifest describing them."""
+
+    def __init__(self, output_filename, max_items=None, max_bytes=None):
+        self.stem, self.ext = os.path.splitext(output_filename)
+        self.ext = self.ext or ".json"
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.shards = []
+        self._writer = None
+        self._first_id = None
+        self._last_id = None
+
+    def _open_shard(self):
+        from src.stats import LabelStats
+
+        name = f"{self.stem}-{len(self.shards) + 1:05d}{self.ext}"
+        self._writer = open_dataset_writer(get_data_path(name))
+        self._stats = LabelStats(get_data_path(name))
+        self._name = name
+        self._first_id = None
+
+    def _close_shard(self):
+        self._writer.close()
+        self._stats.save()
+        self.shards.append({
+            "file": self._name,
+            "count": self._writer.count,
+            "first_id": self._first_id,
+            "last_id": self._last_id,
+            "bytes": self._writer.bytes_written
+        })
+        self._writer = None
+
+    def write(self, item):
+        if self._writer is None:
+            self._open_shard()
+
+        self._writer.write(item)
+        self._stats.add(item)
+        if self._first_id is None:
+            self._first_id = item["id"]
+        self._last_id = item["id"]
+
+        full = (
+            (self.max_items and self._writer.count >= self.max_items)
+            or (self.max_bytes and self._writer.bytes_written >= self.max_bytes)
+        )
+        if full:
+            self._close_shard()
+
+    def close(self):
+        if self._writer is not None:
+            self._close_shard()
+
+        manifest = f"{self.stem}.manifest.json"
+        with open(get_data_path(manifest), 'w', encoding='utf-8') as f:
+            json.dump({
+                "total": sum(shard["count"] for shard in self.shards),
+                "shards": self.shards
+            }, f, indent=4)
+        return manifest
+
+
+def concat_json_databases(filenames, output_filename, interleave=False, dedup=False,
+                          shard_items=None, shard_bytes=None):
+    """
+    Concatenates multiple JSON databases with id reindexing.
 
-    # Reindexing
-    for i, item in enumerate(merged_data, 1):
-        item["id"] = i
-
-    output_path = get_data_path(output_filename)
-    with open(output_path, 'w', encoding='utf-8') as f:
-        json.dump(merged_data, f, indent=4, ensure_ascii=False)
-    print(f"[+] Concatenated {len(merged_data)} items into {output_filename}")
+    Inputs are streamed, so memory use does not grow with their size.
+    interleave performs a k-way merge of the inputs by their original ids
+    instead of concatenating them, dedup drops chats whose messages were
+    already seen, and shard_items / shard_bytes split the output into shards
+    described by a <output>.manifest.json file.
 
+    Label counters of the output (see src/stats.py) are the sum of the
+    inputs' counters; with dedup or shards they are counted while writing.
+    """
+    # Imported here because src.stats itself depends on this module
+    from src.stats import LabelStats
+
+    streams = _open_inputs(filenames)
+    if interleave:
+        merged = heapq.merge(*streams, key=lambda item: item.get("id", 0))
+    else:
+        merged = itertools.chain(*streams)
+
+    sharded = shard_items or shard_bytes
+    if sharded:
+        writer = ShardedWriter(output_filename, shard_items, shard_bytes)
+    else:
+        writer = open_dataset_writer(get_data_path(output_filename))
+
+    combined = not (dedup or sharded)
+    stats = LabelStats(None)
+    if combined:
+        for fn in filenames:
+            if os.path.exists(get_data_path(fn)):
+                input_stats = LabelStats(get_data_path(fn))
+                input_stats.update()
+                stats.combine(input_stats)
+
+    seen = set()
+    duplicates = 0
+    next_id = 1
+
+    for item in merged:
+        if dedup:
+            fingerprint = _chat_fingerprint(item)
+            if fingerprint in seen:
+                duplicates += 1
+                continue
+            seen.add(fingerprint)
+
+        # Reindexing
+        item["id"] = next_id
+        next_id += 1
+        writer.write(item)
+        if dedup and not sharded:
+            stats.add(item)
+
+    if sharded:
+        manifest = writer.close()
+        print(f"[+] Concatenated {next_id - 1} items into {len(writer.shards)} shards (manifest: {manifest})")
+    else:
+        writer.close()
+        stats.copy_to(get_data_path(output_filename))
+        print(f"[+] Concatenated {next_id - 1} items into {output_filename}")
+
+    if dedup:
+        print(f"[*] Dropped {duplicates} duplicate chats")
+
+
+def label_cell(meta):
+    """Joint label key of a chat: intent|case_type|mistake|personality_type."""
+    mistake = meta.get("mistake") if meta.get("case_type") == "agent_mistake" else "none"
+    return "|".join(str(x) for x in (meta.get("intent"), meta.get("case_type"), mistake, meta.get("personality_type")))
+
+
+def labels_distribution(database, cells=False):
+    """
+    Calculates label distribution in database by counting every chat.
+    With cells=True also returns joint counts per label_cell.
+    For a dataset file, dataset_stats() reads the persisted counters instead.
+    """
+    # Imported here because src.stats itself depends on this module
+    from src.stats import LabelStats
 
-def labels_distribution(database):
-    """Calculates label distribution in database."""
     if isinstance(database, str):
-        with open(get_data_path(database), 'r', encoding='utf-8') as f:
-            database = json.load(f)
-
-    intent_counts = Counter()
-    case_counts = Counter()
-    mistake_counts = Counter()
+        database = iter_chats(get_data_path(database))
 
+    stats = LabelStats(None)
     for chat in database:
-        meta = chat.get("metadata", {})
+        stats.add(chat)
+    return stats.distribution(cells)
 
-        intent_counts[meta.get("intent")] += 1
-        case_type = meta.get("case_type")
-        case_counts[case_type] += 1
 
-        if case_type == "agent_mistake":
-            mistake_counts[meta.get("mistake")] += 1
+def dataset_stats(filename):
+    """Label counters of a dataset file, from its state file when it is up to date."""
+    from src.stats import LabelStats  # see labels_distribution
 
-    return {
-        "intents": {i: intent_counts[i] for i in INTENTS},
-        "case_types": {c: case_counts[c] for c in CASE_TYPES},
-        "mistakes": {m: mistake_counts[m] for m in AGENT_MISTAKES},
-        "totals": {
-            "intents": len(database),
-            "mistakes": sum(mistake_counts.values())
-        }
-    }
+    path = get_data_path(filename)
+    if not os.path.exists(path):
+        print(f"[!] File {filename} not found in {DATA_DIR}")
+        return None
 
+    stats = LabelStats(path)
+    added = stats.update()
+    if added:
+        print(f"[*] Counted {added} new chats")
+    return stats
 
-def delete_empty_chats(filename, output_filename):
-    with open(get_data_path(filename), 'r', encoding='utf-8') as f:
-        database = json.load(f)
 
-    database = [chat for chat in database if len(chat["chat"]) != 0]
+def fetch_chats(filename, ids=None, first=None, last=None):
+    """
+    Yields chats by ID or by an inclusive ID range. Frames files are read by
+    random access, other formats are scanned.
+    """
+    path = get_data_path(filename)
+    if is_frame_file(path):
+        with FrameReader(path) as reader:
+            if ids:
+                yield from (chat for chat in map(reader.get, ids) if chat is not None)
+            else:
+                yield from reader.range(first, last)
+        return
+
+    wanted = set(ids or ())
+    for chat in iter_chats(path):
+        _id = chat.get("id")
+        if _id in wanted or (not ids and first <= _id <= last):
+            yield chat
 
-    with open(get_data_path(output_filename), 'w', encoding='utf-8') as f:
-        json.dump(database, f, indent=4)
+
+def delete_empty_chats(filename, output_filename):
+    database = iter_chats(get_data_path(filename))
+
+    dump_dataset((chat for chat in database if len(chat["chat"]) != 0), get_data_path(output_filename))
 
 
 if __name__ == "__main__":
@@ -98,6 +491,11 @@ if __name__ == "__main__":
     merge_parser = subparsers.add_parser("merge", help="Merge multiple JSON files")
     merge_parser.add_argument("--inputs", nargs="+", required=True, help="List of files to merge")
     merge_parser.add_argument("--output", default="merged_dataset.json", help="Output filename")
+    merge_parser.add_argument("--interleave", action="store_true",
+                              help="K-way merge inputs by their original ids instead of concatenating")
+    merge_parser.add_argument("--dedup", action="store_true", help="Drop chats with identical messages")
+    merge_parser.add_argument("--shard-items", type=int, help="Split output into shards of N chats")
+    merge_parser.add_argument("--shard-mb", type=float, help="Split output into shards of about N MB")
 
     # Example: python utils.py stats --input a.json
     stats_parser = subparsers.add_parser("stats", help="Show dataset distribution statistics")
@@ -108,16 +506,73 @@ if __name__ == "__main__":
     stats_parser.add_argument("--input", required=True, help="Input database filename")
     stats_parser.add_argument("--output", required=True, help="Output database filename")
 
+    # Example: python utils.py export --input dataset.jsonl --output dataset.json
+    export_parser = subparsers.add_parser("export", help="Compact a generation journal into a JSON (or .jsonz) database")
+    export_parser.add_argument("--input", required=True, help="Journal filename (.jsonl)")
+    export_parser.add_argument("--output", required=True, help="Output database filename")
+
+    # Example: python utils.py fetch --input dataset.jsonz --range 100 120
+    fetch_parser = subparsers.add_parser("fetch", help="Print chats by ID (random access for .jsonz files)")
+    fetch_parser.add_argument("--input", required=True, help="Database filename")
+    fetch_group = fetch_parser.add_mutually_exclusive_group(required=True)
+    fetch_group.add_argument("--id", type=int, nargs="+", help="Chat IDs")
+    fetch_group.add_argument("--range", type=int, nargs=2, metavar=("FIRST", "LAST"), help="Inclusive ID range")
+
+    # Example: python utils.py query --input dataset.jsonl --case_type agent_mistake --mistake rude_tone --output subset.json
+    query_parser = subparsers.add_parser("query", help="Select chats by labels using the sidecar index")
+    query_parser.add_argument("--input", required=True, help="Database filename (JSON, JSONL or .jsonz)")
+    query_parser.add_argument("--output", help="Write matching chats to this filename (otherwise only count)")
+    query_parser.add_argument("--intent", choices=INTENTS)
+    query_parser.add_argument("--case_type", choices=CASE_TYPES)
+    query_parser.add_argument("--mistake", choices=AGENT_MISTAKES)
+    query_parser.add_argument("--personality", choices=[p["type"] for p in PERSONALITIES])
+    query_parser.add_argument("--request_intent", help="Filter by analysis request_intent")
+    query_parser.add_argument("--satisfaction", help="Filter by analysis customer_satisfaction")
+    query_parser.add_argument("--agent_mistake", help="Filter by a mistake found by the analysis")
+    query_parser.add_argument("--limit", type=int)
+
     args = parser.parse_args()
 
     if args.command == "merge":
-        concat_json_databases(args.inputs, args.output)
+        concat_json_databases(
+            args.inputs, args.output,
+            interleave=args.interleave,
+            dedup=args.dedup,
+            shard_items=args.shard_items,
+            shard_bytes=int(args.shard_mb * 1024 * 1024) if args.shard_mb else None
+        )
     elif args.command == "stats":
-        results = labels_distribution(args.input)
-        if results:
-            print(json.dumps(results, indent=4))
+        stats = dataset_stats(args.input)
+        if stats:
+            print(json.dumps(stats.distribution(), indent=4))
     elif args.command == "del_empty":
         delete_empty_chats(args.input, args.output)
+    elif args.command == "query":
+        # Imported here because src.index itself depends on this module
+        from src.index import ChatIndex
+
+        index = ChatIndex(get_data_path(args.input))
+        added = index.update()
+        if added:
+            print(f"[*] Indexed {added} chats")
+
+        rows = index.query(
+            intent=args.intent, case_type=args.case_type, mistake=args.mistake, personality=args.personality,
+            request_intent=args.request_intent, satisfaction=args.satisfaction,
+            agent_mistake=args.agent_mistake, limit=args.limit
+        )
+        if args.output:
+            dump_dataset(index.fetch(rows), get_data_path(args.output))
+            print(f"[+] Saved {len(rows)} chats to {args.output}")
+        else:
+            print(f"[+] {len(rows)} matching chats")
+    elif args.command == "fetch":
+        first, last = args.range or (None, None)
+        for chat in fetch_chats(args.input, args.id, first, last):
+            print(json.dumps(chat, indent=4, ensure_ascii=False))
+    elif args.command == "export":
+        DatasetJournal(get_data_path(args.input)).export(get_data_path(args.output))
+        print(f"[+] Exported {args.input} into {args.output}")
 
 
 
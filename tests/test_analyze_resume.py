@@ -0,0 +1,38 @@
+import json
+
+import analyze
+from src.journal import DatasetJournal, dump_dataset
+from src.telemetry import Telemetry
+
+
+def fake_analyze(calls):
+    def analyze_items(items, cache=None, telemetry=None, cascade=None):
+        calls.extend(item["id"] for item in items)
+        return [{"intent": "refund", "for": item["id"]} for item in items], len(items)
+    return analyze_items
+
+
+def test_resume_from_torn_journal(tmp_path, monkeypatch):
+    input_file = str(tmp_path / "dataset.json")
+    output_file = str(tmp_path / "analyzed.json")
+    dump_dataset(({"id": i, "messages": []} for i in range(1, 6)), input_file)
+
+    # An interrupted run: two results journaled, the third torn by the crash
+    journal = DatasetJournal(str(tmp_path / "analyzed.jsonl"))
+    journal.write_meta({"run_key": analyze.run_key(input_file)})
+    for i in (1, 2):
+        journal.append({"id": i, "messages": [], "analysis": {"intent": "refund", "for": i}})
+    journal.close()
+    with open(journal.path, 'a', encoding='utf-8') as f:
+        f.write('{"id": 3, "messages": [], "anal')
+
+    calls = []
+    monkeypatch.setattr(analyze, "analyze_items", fake_analyze(calls))
+    analyze.run_analysis(input_file, output_file, telemetry=Telemetry())
+
+    assert sorted(calls) == [3, 4, 5]
+    with open(output_file, 'r', encoding='utf-8') as f:
+        output = json.load(f)
+    assert sorted(item["id"] for item in output) == [1, 2, 3, 4, 5]
+    assert all(item["analysis"]["for"] == item["id"] for item in output)
+    assert not journal.exists()
@@ -0,0 +1,44 @@
+import numpy as np
+
+from evaluate_results import LabelCodes
+
+
+def test_codes_round_trip():
+    codes = LabelCodes(["a", "b"])
+    for label in ["b", "a", "c", "b"]:
+        codes.add(label)
+    assert codes.labels == ["a", "b", "c"]
+    assert codes.array().tolist() == [1, 0, 2, 1]
+
+
+def test_widens_past_256_labels():
+    codes = LabelCodes()
+    for i in range(256):
+        codes.add(i)
+    assert codes.values.itemsize == 1
+
+    codes.add(256)
+    assert codes.values.itemsize == 2
+    assert codes.array().tolist() == list(range(257))
+
+
+def test_widens_past_65536_labels():
+    codes = LabelCodes()
+    for i in range(65536):
+        codes.add(i)
+    assert codes.values.itemsize == 2
+
+    codes.add(65536)
+    codes.add(0)
+    assert codes.values.itemsize == 4
+    values = codes.array()
+    assert values.dtype == np.intp
+    assert values[-2:].tolist() == [65536, 0]
+    assert values[:65537].tolist() == list(range(65537))
+
+
+def test_initial_labels_pick_width():
+    codes = LabelCodes(range(300))
+    assert codes.values.itemsize == 2
+    codes.add(299)
+    assert codes.array().tolist() == [299]
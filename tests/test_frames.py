@@ -0,0 +1,84 @@
+import pytest
+
+from src.frames import FrameReader, dump_frames, is_frame_file
+from src.journal import dump_dataset
+from src.utils import iter_chats
+
+
+def chat(chat_id):
+    return {"id": chat_id, "metadata": {"intent": "refund"}, "messages": [{"role": "agent", "text": "Привіт " * 3}]}
+
+
+@pytest.fixture
+def sorted_file(tmp_path):
+    path = str(tmp_path / "sorted.jsonz")
+    dump_frames((chat(i) for i in range(1, 101)), path, frame_items=8)
+    return path
+
+
+@pytest.fixture
+def unsorted_file(tmp_path):
+    path = str(tmp_path / "unsorted.jsonz")
+    dump_frames((chat(i) for i in [5, 3, 40, 1, 22, 7, 100, 2, 9]), path, frame_items=2)
+    return path
+
+
+def test_round_trip(sorted_file):
+    assert is_frame_file(sorted_file)
+    with FrameReader(sorted_file) as reader:
+        assert len(reader) == 100
+        assert reader.sorted
+        assert list(reader) == [chat(i) for i in range(1, 101)]
+
+
+def test_dump_dataset_picks_frames_by_extension(tmp_path):
+    path = str(tmp_path / "dataset.jsonz")
+    dump_dataset((chat(i) for i in range(1, 4)), path)
+    assert is_frame_file(path)
+    assert list(iter_chats(path)) == [chat(i) for i in range(1, 4)]
+
+
+def test_empty_file(tmp_path):
+    path = str(tmp_path / "empty.jsonz")
+    dump_frames([], path)
+    with FrameReader(path) as reader:
+        assert len(reader) == 0
+        assert reader.get(1) is None
+        assert list(reader.range(1, 10)) == []
+
+
+def test_get_sorted(sorted_file):
+    with FrameReader(sorted_file, cache_frames=2) as reader:
+        for chat_id in (1, 8, 9, 57, 100):
+            assert reader.get(chat_id) == chat(chat_id)
+        assert reader.get(0) is None
+        assert reader.get(101) is None
+
+
+def test_get_with_gaps(tmp_path):
+    path = str(tmp_path / "gaps.jsonz")
+    ids = [1, 2, 4, 8, 16, 32]
+    dump_frames((chat(i) for i in ids), path, frame_items=4)
+    with FrameReader(path) as reader:
+        assert [reader.get(i) for i in ids] == [chat(i) for i in ids]
+        assert reader.get(3) is None
+
+
+def test_get_unsorted(unsorted_file):
+    with FrameReader(unsorted_file) as reader:
+        assert not reader.sorted
+        assert reader.get(40) == chat(40)
+        assert reader.get(2) == chat(2)
+        assert reader.get(4) is None
+
+
+def test_range_sorted(sorted_file):
+    with FrameReader(sorted_file) as reader:
+        assert [c["id"] for c in reader.range(7, 18)] == list(range(7, 19))
+        assert [c["id"] for c in reader.range(99, 500)] == [99, 100]
+        assert list(reader.range(200, 300)) == []
+
+
+def test_range_unsorted_keeps_file_order(unsorted_file):
+    with FrameReader(unsorted_file) as reader:
+        assert [c["id"] for c in reader.range(2, 22)] == [5, 3, 22, 7, 2, 9]
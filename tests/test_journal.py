@@ -0,0 +1,90 @@
+import json
+import os
+
+from src.journal import DatasetJournal
+from src.utils import iter_chats
+
+
+def chat(chat_id):
+    return {"id": chat_id, "messages": [{"role": "client", "text": f"chat {chat_id}"}]}
+
+
+def make_journal(tmp_path, ids):
+    journal = DatasetJournal(str(tmp_path / "dataset.jsonl"))
+    for chat_id in ids:
+        journal.append(chat(chat_id))
+    journal.close()
+    return journal
+
+
+def tear(journal, text='{"id": 99, "messa'):
+    """Simulates a crash in the middle of an append: a partial last line and a stale index."""
+    with open(journal.path, 'a', encoding='utf-8') as f:
+        f.write(text)
+
+
+def test_resume_uses_index(tmp_path):
+    make_journal(tmp_path, [1, 2, 3])
+    assert DatasetJournal(str(tmp_path / "dataset.jsonl")).resume() == 4
+
+
+def test_resume_without_journal(tmp_path):
+    assert DatasetJournal(str(tmp_path / "missing.jsonl")).resume() == 1
+
+
+def test_resume_drops_torn_tail(tmp_path):
+    tear(make_journal(tmp_path, [1, 2, 3]))
+
+    journal = DatasetJournal(str(tmp_path / "dataset.jsonl"))
+    assert journal.resume() == 4
+    assert [record["id"] for record in journal] == [1, 2, 3]
+    with open(journal.path, 'rb') as f:
+        assert f.read().endswith(b"\n")
+
+
+def test_resume_after_torn_first_line(tmp_path):
+    journal = DatasetJournal(str(tmp_path / "dataset.jsonl"))
+    tear(journal)
+    assert journal.resume() == 1
+    assert os.path.getsize(journal.path) == 0
+
+
+def test_append_after_repair(tmp_path):
+    tear(make_journal(tmp_path, [1, 2]))
+
+    journal = DatasetJournal(str(tmp_path / "dataset.jsonl"))
+    journal.append(chat(journal.resume()))
+    journal.close()
+
+    assert [record["id"] for record in journal] == [1, 2, 3]
+    assert DatasetJournal(journal.path).resume() == 4
+
+
+def test_stale_index_without_torn_tail(tmp_path):
+    journal = make_journal(tmp_path, [1, 2])
+    # Appended after the index was written, e.g. a crash between append and checkpoint
+    with open(journal.path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(chat(3)) + "\n")
+    assert DatasetJournal(journal.path).resume() == 4
+
+
+def test_seed_and_export(tmp_path):
+    journal = DatasetJournal(str(tmp_path / "dataset.jsonl"))
+    journal.seed(chat(i) for i in (1, 2))
+    journal.append(chat(3))
+    output = str(tmp_path / "dataset.json")
+    journal.export(output, extra=[{"id": 4}])
+
+    assert [record["id"] for record in iter_chats(output)] == [1, 2, 3, 4]
+    assert journal.resume() == 4
+
+
+def test_meta_and_remove(tmp_path):
+    journal = make_journal(tmp_path, [1])
+    assert journal.read_meta() is None
+    journal.write_meta({"run_key": "abc"})
+    assert journal.read_meta() == {"run_key": "abc"}
+
+    journal.remove()
+    for path in (journal.path, journal.index_path, journal.meta_path):
+        assert not os.path.exists(path)